@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.utils.html import format_html
 
-from .models import Comment, Follow, Group, Post
+from .models import Comment, Follow, Group, MediaFile, Post, UserCounters
 
 
 @admin.register(Post)
@@ -42,3 +42,18 @@ class FollowAdmin(admin.ModelAdmin):
     search_fields = ('author', 'user', 'author')
     list_filter = ('author', 'user', 'author')
     empty_value_display = '-пусто-'
+
+
+@admin.register(UserCounters)
+class UserCountersAdmin(admin.ModelAdmin):
+    list_display = ('user', 'followers_count', 'following_count',
+                    'posts_count')
+    search_fields = ('user__username',)
+    empty_value_display = '-пусто-'
+
+
+@admin.register(MediaFile)
+class MediaFileAdmin(admin.ModelAdmin):
+    list_display = ('name', 'size', 'refs', 'created')
+    search_fields = ('name',)
+    empty_value_display = '-пусто-'
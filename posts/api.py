@@ -0,0 +1,183 @@
+"""JSON API для чтения лент: /api/v1/.
+
+Страницы API берут те же querysets, что и HTML-страницы (for_feed,
+follow_feed), но выбирают их через values(): строки приходят словарями
+без создания моделей и рендеринга шаблонов. Ответ сериализуется без
+пробелов и без экранирования кириллицы.
+
+Параметры запроса:
+    fields - поля через запятую, по умолчанию все поля ресурса;
+    limit - записей на странице, не больше MAX_LIMIT;
+    cursor - курсор из next или previous предыдущего ответа.
+
+Ответ списка: {"results": [...], "next": курсор|null,
+"previous": курсор|null}. Ошибки: {"error": "..."} с кодом 400, 401
+или 404.
+"""
+from functools import wraps
+
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+
+from . import timeline
+from .constants import COMMENT_ORDERING, POSTS_PER_PAGE
+from .existence import require_existing
+from .models import Group, Post, User
+from .paginator import CursorPaginator, InvalidCursor
+from .replicas import read_replica
+
+
+MAX_LIMIT = 100
+JSON_PARAMS = {'ensure_ascii': False, 'separators': (',', ':')}
+
+# Имя поля в ответе -> поле для values()
+POST_FIELDS = {
+    'id': 'id',
+    'text': 'text',
+    'pub_date': 'pub_date',
+    'author': 'author__username',
+    'group': 'group__slug',
+    'image': 'thumbnail_url',
+    'comment_count': 'comment_count',
+}
+COMMENT_FIELDS = {
+    'id': 'id',
+    'text': 'text',
+    'created': 'created',
+    'author': 'author__username',
+}
+GROUP_FIELDS = {
+    'id': 'id',
+    'slug': 'slug',
+    'title': 'title',
+    'description': 'description',
+}
+POST_ORDERING = ('-pub_date', '-id')
+GROUP_ORDERING = ('id',)
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def api_view(view):
+    """Превращает ApiError и Http404 в JSON-ответ с ошибкой."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return error_response('Только GET.', 405)
+        try:
+            return view(request, *args, **kwargs)
+        except ApiError as error:
+            return error_response(str(error), error.status)
+        except Http404:
+            return error_response('Не найдено.', 404)
+    return read_replica(wrapper)
+
+
+def error_response(message, status):
+    return JsonResponse({'error': message}, status=status,
+                        json_dumps_params=JSON_PARAMS)
+
+
+def selected_fields(request, available):
+    """[(имя, поле values()), ...] по параметру fields."""
+    names = [name.strip() for name in request.GET.get('fields', '').split(',')
+             if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ApiError('Неизвестные поля: ' + ', '.join(unknown) +
+                       '. Доступны: ' + ', '.join(available) + '.')
+    return [(name, available[name]) for name in names or available]
+
+
+def page_limit(request):
+    try:
+        limit = int(request.GET.get('limit', POSTS_PER_PAGE))
+    except ValueError:
+        raise ApiError('limit должен быть числом.')
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ApiError(f'limit должен быть от 1 до {MAX_LIMIT}.')
+    return limit
+
+
+def serialize(rows, fields):
+    return [{name: row[lookup] for name, lookup in fields} for row in rows]
+
+
+def list_response(request, queryset, available, ordering):
+    """Страница queryset по курсору в виде JSON."""
+    fields = selected_fields(request, available)
+    lookups = {lookup for _, lookup in fields}
+    # Поля курсора выбираются всегда, даже если их не просили
+    lookups.update(name.lstrip('-') for name in ordering)
+    paginator = CursorPaginator(queryset.values(*lookups),
+                                page_limit(request), ordering=ordering)
+    try:
+        page = paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        raise ApiError('Некорректный курсор.')
+    return JsonResponse({
+        'results': serialize(page.object_list, fields),
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    }, json_dumps_params=JSON_PARAMS)
+
+
+@api_view
+def posts(request):
+    """Все посты, как на главной."""
+    return list_response(request, Post.objects.for_feed(), POST_FIELDS,
+                         POST_ORDERING)
+
+
+@api_view
+def post_detail(request, post_id):
+    fields = selected_fields(request, POST_FIELDS)
+    row = Post.objects.filter(pk=post_id).values(
+        *{lookup for _, lookup in fields}
+    ).first()
+    if row is None:
+        raise Http404
+    return JsonResponse(serialize([row], fields)[0],
+                        json_dumps_params=JSON_PARAMS)
+
+
+@api_view
+def post_comments(request, post_id):
+    post = get_object_or_404(Post.objects.only('id'), pk=post_id)
+    return list_response(request, post.comments.all(), COMMENT_FIELDS,
+                         COMMENT_ORDERING)
+
+
+@api_view
+def groups(request):
+    return list_response(request, Group.objects.all(), GROUP_FIELDS,
+                         GROUP_ORDERING)
+
+
+@api_view
+@require_existing('group', 'slug')
+def group_posts(request, slug):
+    group = get_object_or_404(Group.objects.only('id'), slug=slug)
+    return list_response(request, group.posts.for_feed(), POST_FIELDS,
+                         POST_ORDERING)
+
+
+@api_view
+@require_existing('username', 'username')
+def user_posts(request, username):
+    author = get_object_or_404(User.objects.only('id'), username=username)
+    return list_response(request, author.posts.for_feed(), POST_FIELDS,
+                         POST_ORDERING)
+
+
+@api_view
+def follow_posts(request):
+    """Лента подписок текущего пользователя."""
+    if not request.user.is_authenticated:
+        raise ApiError('Нужно войти.', 401)
+    return list_response(request, timeline.follow_feed(request.user),
+                         POST_FIELDS, POST_ORDERING)
@@ -0,0 +1,322 @@
+"""Нагрузочный прогон страниц лент для manage.py feed_benchmark.
+
+seed() создаёт синтетические данные генератором posts.seed
+с префиксом PREFIX и добавляет к первым постам картинки. Сценарии
+выбирают объекты только из пользователей и групп с этим префиксом. run()
+гоняет сценарии через тестовый клиент Django или через локальный
+WSGI-сервер и для каждого сценария считает перцентили времени ответа,
+число SQL-запросов на запрос, средний размер ответа и рост пикового
+RSS процесса. Сценарии api_* читают те же ленты через JSON API
+(posts.api), их удобно сравнивать с HTML-страницами.
+
+Локальная база отвечает быстрее сетевой, поэтому slow_io() добавляет
+к каждому SQL-запросу задержку: так видно, сколько страница ждёт
+базу и что даёт параллельная выборка posts.fanout
+(POSTS_QUERY_WORKERS).
+
+Результат - словарь, который команда пишет в JSON, чтобы сравнивать
+прогоны на разных коммитах (compare()).
+"""
+import platform
+import random
+import subprocess
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from io import BytesIO
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import HTTPErrorProcessor, Request, build_opener
+from wsgiref.simple_server import WSGIRequestHandler, make_server
+
+import django
+from django.core.files.base import ContentFile
+from django.core.handlers.wsgi import WSGIHandler
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import budgets
+from .models import Group, Post, User
+from .seed import finish, generate, text
+from .uploads import peak_rss
+
+
+PREFIX = 'bench'
+SCENARIOS = ('index', 'group_posts', 'profile', 'post_view', 'follow_index',
+             'add_comment', 'api_index', 'api_profile', 'api_follow')
+
+
+def _image(rng):
+    color = tuple(rng.randrange(256) for _ in range(3))
+    buffer = BytesIO()
+    Image.new('RGB', (1200, 800), color).save(buffer, 'JPEG')
+    return ContentFile(buffer.getvalue(), name=f'{PREFIX}.jpg')
+
+
+@transaction.atomic
+def seed(users=50, groups=5, posts=500, comments=1000, follows=500,
+         images=10, random_seed=0):
+    """Создаёт синтетические данные. Возвращает {вид: штук}."""
+    plan, created, _ = generate(
+        users=users, groups=groups, posts=posts, comments=comments,
+        follows=follows, random_seed=random_seed, prefix=PREFIX,
+    )
+    finish(plan)
+    # generate() вставляет строки без сигналов, поэтому картинки
+    # сохраняются по одной: варианты строит posts.thumbnails
+    rng = random.Random(random_seed)
+    with_images = Post.objects.filter(pk__gte=plan.post_base).order_by('pk')
+    for post in with_images[:images]:
+        post.image = _image(rng)
+        post.save()
+    created['images'] = min(images, posts)
+    return created
+
+
+class Context:
+    """Объекты, к которым обращаются сценарии."""
+
+    def __init__(self, random_seed=0):
+        self.rng = random.Random(random_seed)
+        bench_users = User.objects.filter(username__startswith=f'{PREFIX}_')
+        self.usernames = list(bench_users.values_list('username', flat=True))
+        self.slugs = list(Group.objects.filter(
+            slug__startswith=f'{PREFIX}-'
+        ).values_list('slug', flat=True))
+        self.posts = list(Post.objects.filter(
+            author__in=bench_users
+        ).values_list('pk', 'author__username'))
+        self.viewer = bench_users.filter(
+            follower__isnull=False
+        ).first() or bench_users.first()
+        if not (self.usernames and self.slugs and self.posts):
+            raise ValueError('Нет данных для прогона, запустите seed().')
+
+    def request(self, scenario):
+        """(метод, url, данные) очередного запроса сценария."""
+        rng = self.rng
+        if scenario == 'index':
+            return 'get', reverse('index'), None
+        if scenario == 'group_posts':
+            return 'get', reverse('group',
+                                  args=[rng.choice(self.slugs)]), None
+        if scenario == 'profile':
+            return 'get', reverse('profile',
+                                  args=[rng.choice(self.usernames)]), None
+        if scenario == 'follow_index':
+            return 'get', reverse('follow_index'), None
+        if scenario == 'api_index':
+            return 'get', reverse('api_posts'), None
+        if scenario == 'api_profile':
+            return 'get', reverse('api_user_posts',
+                                  args=[rng.choice(self.usernames)]), None
+        if scenario == 'api_follow':
+            return 'get', reverse('api_follow'), None
+        post_id, username = rng.choice(self.posts)
+        if scenario == 'post_view':
+            return 'get', reverse('post', args=[username, post_id]), None
+        if scenario == 'add_comment':
+            return 'post', reverse('add_comment', args=[username, post_id]), {
+                'text': text(rng, 8, 8)
+            }
+        raise ValueError(f'Неизвестный сценарий {scenario}')
+
+
+def percentile(values, percent):
+    """Перцентиль по ближайшему рангу, values отсортированы."""
+    if not values:
+        return 0.0
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[int(rank) - 1]
+
+
+def summarize(timings, queries, rss_growth, sizes=()):
+    timings = sorted(timings)
+    total = sum(timings)
+    return {
+        'requests': len(timings),
+        'rps': len(timings) / total if total else 0.0,
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p95_ms': percentile(timings, 95) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+        'max_ms': timings[-1] * 1000 if timings else 0.0,
+        'queries_avg': sum(queries) / len(queries) if queries else 0.0,
+        'queries_max': max(queries, default=0),
+        'bytes_avg': sum(sizes) / len(sizes) if sizes else 0.0,
+        'rss_growth_kb': rss_growth,
+    }
+
+
+@contextmanager
+def slow_io(delay):
+    """Добавляет delay секунд к каждому SQL-запросу внутри блока."""
+    def wrapper(execute, sql, params, many, context):
+        time.sleep(delay)
+        return execute(sql, params, many, context)
+
+    with ExitStack() as stack:
+        if delay:
+            for db in connections.all():
+                stack.enter_context(db.execute_wrapper(wrapper))
+        yield
+
+
+class ClientDriver:
+    """Запросы через тестовый клиент в этом же потоке."""
+
+    name = 'client'
+
+    def __init__(self, user, io_delay=0):
+        self.client = Client()
+        self.client.force_login(user)
+        self.io_delay = io_delay
+
+    def __call__(self, method, url, data):
+        with budgets.measure() as measurement, slow_io(self.io_delay):
+            response = getattr(self.client, method)(url, data)
+        return response.status_code, measurement.queries, len(
+            response.content
+        )
+
+    def close(self):
+        pass
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class _Handler(WSGIHandler):
+    def get_response(self, request):
+        request._dont_enforce_csrf_checks = True
+        return super().get_response(request)
+
+
+class _NoRedirect(HTTPErrorProcessor):
+    """Отдаёт ответ с редиректом как есть, как тестовый клиент."""
+
+    def http_response(self, request, response):
+        return response
+
+    https_response = http_response
+
+
+class ServerDriver:
+    """Запросы по HTTP к локальному WSGI-серверу в соседнем потоке.
+
+    Запросы SQL считаются внутри потока сервера. CSRF не проверяется,
+    как и в тестовом клиенте.
+    """
+
+    name = 'wsgi'
+
+    def __init__(self, user, io_delay=0):
+        handler = _Handler()
+        self.queries = []
+
+        def app(environ, start_response):
+            with budgets.measure() as measurement, slow_io(io_delay):
+                result = handler(environ, start_response)
+                content = b''.join(result)
+            self.queries.append(measurement.queries)
+            return [content]
+
+        self.server = make_server('127.0.0.1', 0, app,
+                                  handler_class=_QuietHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        client = Client()
+        client.force_login(user)
+        self.cookies = '; '.join(f'{key}={morsel.value}'
+                                 for key, morsel in client.cookies.items())
+        self.base = f'http://127.0.0.1:{self.server.server_port}'
+
+    def __call__(self, method, url, data):
+        body = urlencode(data).encode() if data else None
+        request = Request(self.base + url, data=body,
+                          method=method.upper(),
+                          headers={'Cookie': self.cookies})
+        try:
+            with build_opener(_NoRedirect).open(request) as response:
+                size = len(response.read())
+                status = response.status
+        except HTTPError as error:
+            status, size = error.code, len(error.read())
+        return status, self.queries.pop() if self.queries else 0, size
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+DRIVERS = {'client': ClientDriver, 'wsgi': ServerDriver}
+
+
+def run(scenarios=SCENARIOS, requests=100, warmup=5, driver='client',
+        random_seed=0, io_delay=0):
+    """Прогоняет сценарии и возвращает результаты с описанием окружения.
+
+    io_delay - задержка каждого SQL-запроса в секундах, см. slow_io().
+    """
+    context = Context(random_seed)
+    driver = DRIVERS[driver](context.viewer, io_delay)
+    results = {}
+    try:
+        for scenario in scenarios:
+            for _ in range(warmup):
+                driver(*context.request(scenario))
+            timings, queries, sizes, errors = [], [], [], 0
+            rss = peak_rss()
+            for _ in range(requests):
+                request = context.request(scenario)
+                started = time.perf_counter()
+                status, count, size = driver(*request)
+                timings.append(time.perf_counter() - started)
+                queries.append(count)
+                sizes.append(size)
+                errors += status >= 400
+            results[scenario] = summarize(timings, queries, peak_rss() - rss,
+                                          sizes)
+            results[scenario]['errors'] = errors
+    finally:
+        driver.close()
+    meta = environment(driver.name, requests)
+    meta['io_delay_ms'] = io_delay * 1000
+    meta['query_workers'] = getattr(settings, 'POSTS_QUERY_WORKERS', 0)
+    return {'meta': meta, 'results': results}
+
+
+def environment(driver, requests):
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = ''
+    return {'commit': commit, 'date': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(), 'database': connection.vendor,
+            'driver': driver, 'requests': requests,
+            'rss_peak_kb': peak_rss()}
+
+
+def compare(old, new, metrics=('p50_ms', 'p95_ms', 'p99_ms', 'queries_avg',
+                               'bytes_avg')):
+    """[(сценарий, метрика, было, стало, изменение в %), ...]."""
+    rows = []
+    for scenario, result in new['results'].items():
+        before = old['results'].get(scenario)
+        if before is None:
+            continue
+        for metric in metrics:
+            was, now = before.get(metric, 0), result.get(metric, 0)
+            change = (now - was) / was * 100 if was else 0.0
+            rows.append((scenario, metric, was, now, change))
+    return rows
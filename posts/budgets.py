@@ -0,0 +1,197 @@
+"""Бюджеты запросов и времени для страниц posts.
+
+BudgetMiddleware измеряет каждый запрос: число SQL-запросов, их общее
+время, время рендеринга шаблонов и размер ответа. Метрики
+складываются по имени URL, пишутся в лог posts.budgets и отдаются
+заголовком Server-Timing. Если метрика превышает бюджет своего URL,
+в лог пишется предупреждение, а при POSTS_BUDGET_RAISE - выбрасывается
+BudgetExceeded. В тестах то же самое проверяет
+MyTestCase.assertWithinBudget.
+
+Время шаблонов считается по самому внешнему Template.render, поэтому
+вложенные include не учитываются дважды. Обёртка ставится на
+Template.render только на время замеров measure() и снимается, когда
+последний из них закончился. SQL, выполненный ленивыми
+queryset'ами во время рендеринга, входит и в db, и в template.
+
+Подключение: 'posts.budgets.BudgetMiddleware' в MIDDLEWARE, как можно
+выше, чтобы в замер попали и запросы других middleware.
+
+Настройки:
+    POSTS_VIEW_BUDGETS - бюджеты по имени URL, дополняют BUDGETS;
+        ключ '*' задаёт бюджет остальных страниц;
+    POSTS_BUDGET_RAISE - выбрасывать BudgetExceeded вместо записи
+        в лог (для тестов и стендов).
+"""
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.template.base import Template
+
+
+logger = logging.getLogger(__name__)
+
+# queries - штук, db_ms и template_ms - миллисекунд, bytes - байт
+DEFAULT_BUDGET = {'queries': 20, 'db_ms': 200, 'template_ms': 300,
+                  'bytes': 500 * 1024}
+BUDGETS = {
+    'index': {'queries': 7},
+    'group': {'queries': 10},
+    'profile': {'queries': 11},
+    'follow_index': {'queries': 7},
+    'post': {'queries': 8},
+    'post_comments': {'queries': 4, 'bytes': 100 * 1024},
+    'search': {'queries': 7},
+    'api_posts': {'queries': 3},
+    'api_user_posts': {'queries': 4},
+    'api_follow': {'queries': 5},
+}
+
+_local = threading.local()
+_render = Template.render
+_installed = 0
+_install_lock = threading.Lock()
+
+
+class BudgetExceeded(AssertionError):
+    pass
+
+
+def budget_for(url_name):
+    """Бюджет страницы: значения по умолчанию, BUDGETS и настройки."""
+    configured = getattr(settings, 'POSTS_VIEW_BUDGETS', {})
+    budget = dict(DEFAULT_BUDGET)
+    budget.update(configured.get('*', {}))
+    budget.update(BUDGETS.get(url_name, {}))
+    budget.update(configured.get(url_name, {}))
+    return budget
+
+
+class Measurement:
+    """Метрики одного запроса."""
+
+    def __init__(self):
+        self.url_name = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.size = 0
+        self.started = time.perf_counter()
+        self.total_time = 0.0
+        self._template_depth = 0
+        # Запросы могут идти из потоков posts.fanout
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self._lock:
+                self.queries += 1
+                self.db_time += time.perf_counter() - started
+
+    def finish(self, request, response):
+        self.total_time = time.perf_counter() - self.started
+        match = getattr(request, 'resolver_match', None)
+        self.url_name = match.url_name if match else None
+        if not response.streaming:
+            self.size = len(response.content)
+
+    def as_dict(self):
+        return {'queries': self.queries,
+                'db_ms': self.db_time * 1000,
+                'template_ms': self.template_time * 1000,
+                'bytes': self.size}
+
+    def breaches(self, budget=None):
+        """Список превышений бюджета в виде строк."""
+        budget = budget_for(self.url_name) if budget is None else budget
+        return [f'{name}: {value:.0f} > {budget[name]}'
+                for name, value in self.as_dict().items()
+                if name in budget and value > budget[name]]
+
+    def server_timing(self):
+        return (f'db;dur={self.db_time * 1000:.1f};'
+                f'desc="{self.queries} queries", '
+                f'template;dur={self.template_time * 1000:.1f}, '
+                f'total;dur={self.total_time * 1000:.1f}')
+
+
+def _timed_render(self, context):
+    measurement = getattr(_local, 'measurement', None)
+    if measurement is None or measurement._template_depth:
+        return _render(self, context)
+    measurement._template_depth += 1
+    started = time.perf_counter()
+    try:
+        return _render(self, context)
+    finally:
+        measurement.template_time += time.perf_counter() - started
+        measurement._template_depth -= 1
+
+
+@contextmanager
+def _timed_templates():
+    """Подменяет Template.render, пока идёт хотя бы один замер."""
+    global _installed
+    with _install_lock:
+        if not _installed:
+            Template.render = _timed_render
+        _installed += 1
+    try:
+        yield
+    finally:
+        with _install_lock:
+            _installed -= 1
+            if not _installed:
+                Template.render = _render
+
+
+@contextmanager
+def measure():
+    """Считает запросы ко всем базам и время шаблонов внутри блока."""
+    measurement = Measurement()
+    previous = getattr(_local, 'measurement', None)
+    _local.measurement = measurement
+    try:
+        with ExitStack() as stack:
+            stack.enter_context(_timed_templates())
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(measurement))
+            yield measurement
+    finally:
+        _local.measurement = previous
+
+
+def report(measurement):
+    """Пишет метрики в лог и сообщает о превышении бюджета."""
+    name = measurement.url_name or '-'
+    breaches = measurement.breaches()
+    logger.debug('%s: %s', name, measurement.as_dict())
+    if not breaches:
+        return
+    message = f'Превышен бюджет страницы {name}: ' + ', '.join(breaches)
+    if getattr(settings, 'POSTS_BUDGET_RAISE', False):
+        raise BudgetExceeded(message)
+    logger.warning(message)
+
+
+class BudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with measure() as measurement:
+            response = self.get_response(request)
+        measurement.finish(request, response)
+        report(measurement)
+        timing = measurement.server_timing()
+        if response.has_header('Server-Timing'):
+            timing = f'{response["Server-Timing"]}, {timing}'
+        response['Server-Timing'] = timing
+        return response
@@ -0,0 +1,66 @@
+"""Версии закэшированных карточек постов.
+
+Карточка (includes/post_item.html) кэшируется по ключу из id поста,
+Post.card_version и роли зрителя (гость, автор или другой
+пользователь). Версия увеличивается при правке поста, новом
+комментарии, переименовании группы и смене имени автора, после чего
+карточка рендерится заново.
+"""
+from django.db.models import F
+from django.db.models.expressions import Combinable
+from django.utils import timezone
+
+from .models import Post
+
+
+def bump(queryset):
+    """Увеличивает версию карточек у постов из queryset."""
+    return queryset.update(card_version=F('card_version') + 1,
+                           updated=timezone.now())
+
+
+def bump_post(post_id):
+    return bump(Post.objects.filter(pk=post_id))
+
+
+def bump_on_save(instance, update_fields=None):
+    """Увеличивает версию в том же UPDATE, что сохраняет пост.
+
+    Вызывается из pre_save. Версия считается в базе через F(): значение
+    в памяти загружено раньше и могло отстать от комментария, который
+    уже увеличил версию, и тогда правка записала бы тот же номер.
+    """
+    if instance._state.adding:
+        return
+    if update_fields is not None and 'card_version' not in update_fields:
+        return
+    instance.card_version = F('card_version') + 1
+
+
+def reload_version(instance):
+    """Заменяет выражение из bump_on_save значением из базы."""
+    if isinstance(instance.card_version, Combinable):
+        instance.refresh_from_db(using=instance._state.db,
+                                 fields=['card_version'])
+
+
+def remember_fields(instance, fields, update_fields=None):
+    """Запоминает, менялись ли поля, которые показываются в карточке.
+
+    Вызывается из pre_save: сравнивает значения в памяти с базой
+    и кладёт результат в instance._card_fields_changed.
+    """
+    instance._card_fields_changed = False
+    if instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and not set(fields) & set(update_fields):
+        return
+    old = type(instance)._default_manager.filter(
+        pk=instance.pk
+    ).values_list(*fields).first()
+    new = tuple(getattr(instance, field) for field in fields)
+    instance._card_fields_changed = old is not None and old != new
+
+
+def fields_changed(instance):
+    return getattr(instance, '_card_fields_changed', False)
@@ -0,0 +1,35 @@
+import hashlib
+
+from django.views.decorators.http import condition
+
+
+def feed_condition(state_func):
+    """Условный GET (ETag/Last-Modified) для страниц лент.
+
+    state_func(request, *args, **kwargs) дёшево, без рендеринга,
+    описывает видимое содержимое страницы и возвращает пару
+    (parts, last_modified) либо (None, None), если описать страницу
+    нельзя (например, объект не найден). parts превращается в ETag,
+    last_modified отдаётся только анонимным посетителям: для
+    авторизованных страница зависит ещё и от зрителя.
+    """
+    def get_state(request, *args, **kwargs):
+        if not hasattr(request, '_feed_state'):
+            request._feed_state = state_func(request, *args, **kwargs)
+        return request._feed_state
+
+    def etag(request, *args, **kwargs):
+        parts, _ = get_state(request, *args, **kwargs)
+        if parts is None:
+            return None
+        viewer = request.user.pk if request.user.is_authenticated else 0
+        raw = repr((viewer, parts)).encode()
+        return hashlib.md5(raw).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return None
+        _, modified = get_state(request, *args, **kwargs)
+        return modified
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
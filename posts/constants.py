@@ -0,0 +1,7 @@
+"""Размеры страниц и порядок записей, общие для HTML-страниц, API
+и manage.py feed_explain.
+"""
+
+POSTS_PER_PAGE = 10
+COMMENTS_PER_PAGE = 20
+COMMENT_ORDERING = ('-created', '-id')
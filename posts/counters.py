@@ -0,0 +1,108 @@
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Comment, Follow, Post, User, UserCounters
+
+
+BATCH_SIZE = 1000
+
+
+def _shift(queryset, field, delta):
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    return queryset.update(**{field: F(field) + delta,
+                              'updated': timezone.now()})
+
+
+def change_user_counter(user_id, field, delta):
+    """Сдвигает счётчик пользователя на delta одним UPDATE.
+
+    Если строки со счётчиками ещё нет (пользователь создан до
+    появления счётчиков), при увеличении она создаётся пересчётом.
+    При уменьшении строку не создаём: пользователь может удаляться
+    каскадом прямо сейчас.
+    """
+    updated = _shift(UserCounters.objects.filter(user_id=user_id),
+                     field, delta)
+    if not updated and delta > 0:
+        repair_user_counters([user_id])
+
+
+def change_comment_count(post_id, delta):
+    _shift(Post.objects.filter(pk=post_id), 'comment_count', delta)
+
+
+def _related_count(model, field):
+    counts = model.objects.filter(
+        **{field: OuterRef('pk')}
+    ).order_by().values(field).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(counts), 0)
+
+
+def _bulk_repair(queryset, fields, dry_run):
+    """Сохраняет пересчитанные значения real_<field> пачками."""
+    repaired = 0
+    batch = []
+    now = timezone.now()
+    for obj in queryset.iterator():
+        for field in fields:
+            setattr(obj, field, getattr(obj, f'real_{field}'))
+        obj.updated = now
+        batch.append(obj)
+        if len(batch) == BATCH_SIZE:
+            repaired += _save_batch(queryset.model, batch, fields, dry_run)
+            batch = []
+    repaired += _save_batch(queryset.model, batch, fields, dry_run)
+    return repaired
+
+
+def _save_batch(model, batch, fields, dry_run):
+    if batch and not dry_run:
+        with transaction.atomic():
+            model.objects.bulk_update(batch, fields + ('updated',))
+    return len(batch)
+
+
+def repair_user_counters(user_ids=None, dry_run=False):
+    """Пересчитывает счётчики пользователей и исправляет расхождения.
+
+    Возвращает пару (создано строк, исправлено строк).
+    """
+    users = User.objects.filter(counters__isnull=True)
+    counters = UserCounters.objects.all()
+    if user_ids is not None:
+        users = users.filter(pk__in=user_ids)
+        counters = counters.filter(pk__in=user_ids)
+    missing = [UserCounters(user_id=pk)
+               for pk in users.values_list('pk', flat=True)]
+    if missing and not dry_run:
+        UserCounters.objects.bulk_create(missing, batch_size=BATCH_SIZE,
+                                         ignore_conflicts=True)
+
+    drifted = counters.annotate(
+        real_followers_count=_related_count(Follow, 'author'),
+        real_following_count=_related_count(Follow, 'user'),
+        real_posts_count=_related_count(Post, 'author'),
+    ).exclude(
+        followers_count=F('real_followers_count'),
+        following_count=F('real_following_count'),
+        posts_count=F('real_posts_count'),
+    )
+    repaired = _bulk_repair(
+        drifted, ('followers_count', 'following_count', 'posts_count'),
+        dry_run
+    )
+    return len(missing), repaired
+
+
+def repair_post_counters(post_ids=None, dry_run=False):
+    """Пересчитывает comment_count у постов. Возвращает число исправлений."""
+    posts = Post.objects.all()
+    if post_ids is not None:
+        posts = posts.filter(pk__in=post_ids)
+    drifted = posts.only('pk', 'comment_count', 'updated').annotate(
+        real_comment_count=_related_count(Comment, 'post'),
+    ).exclude(comment_count=F('real_comment_count'))
+    return _bulk_repair(drifted, ('comment_count',), dry_run)
@@ -0,0 +1,246 @@
+"""Деградация публичных страниц при проблемах с базой.
+
+Декоратор serve_stale_on_error запоминает последний удачный ответ
+страницы для анонимного посетителя. Копия перезаписывается, только
+когда у страницы сменился ETag, и не реже раза в POSTS_DEGRADE_REFRESH
+секунд; ответ без ETag пишется не чаще этого. Если база падает с
+ошибкой или
+страница не укладывается в бюджет времени на запросы к базе, вместо
+зависшего воркера отдаётся этот ответ с заголовками Age и Warning,
+а если его нет - 503 с Retry-After. Копия общая для всех, поэтому
+в деградации авторизованные пользователи тоже видят анонимную версию.
+
+Бюджет проверяется перед каждым SQL-запросом, а в SQLite ещё и во
+время запроса (progress handler прерывает его). Для PostgreSQL
+долгий запрос ограничивается statement_timeout в OPTIONS базы.
+
+Предохранитель (CircuitBreaker) размыкается после нескольких сбоев
+подряд: пока он разомкнут, страницы сразу отдаются из копии без
+обращения к базе. Через POSTS_BREAKER_RESET секунд один запрос
+пропускается пробным, и если он прошёл, предохранитель замыкается.
+
+Настройки:
+    POSTS_DEGRADE_BUDGET - бюджет страницы на запросы к базе в
+        миллисекундах, 0 - без бюджета (по умолчанию);
+    POSTS_DEGRADE_KEEP - сколько секунд хранить последнюю удачную
+        копию страницы;
+    POSTS_DEGRADE_REFRESH - через сколько секунд перезаписывать копию
+        с тем же ETag;
+    POSTS_BREAKER_FAILURES - сколько сбоев подряд размыкают
+        предохранитель;
+    POSTS_BREAKER_RESET - через сколько секунд пробовать базу снова.
+"""
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.http import HttpResponse
+
+from .page_cache import get_cache, page_key
+
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'degrade'
+BUDGET_MS = 0
+KEEP_SECONDS = 24 * 60 * 60
+REFRESH_SECONDS = 5 * 60
+BREAKER_FAILURES = 5
+BREAKER_RESET = 30
+# Ответы, которые уже взяты из кэша страниц, а не посчитаны заново
+CACHED_STATES = ('hit', 'stale', 'coalesced')
+SKIPPED_HEADERS = ('ETag', 'Last-Modified', 'X-Page-Cache')
+SQLITE_CHECK_STEPS = 10000
+
+
+class DatabaseOverloaded(Exception):
+    pass
+
+
+def budget():
+    return getattr(settings, 'POSTS_DEGRADE_BUDGET', BUDGET_MS) / 1000
+
+
+def keep_seconds():
+    return getattr(settings, 'POSTS_DEGRADE_KEEP', KEEP_SECONDS)
+
+
+def refresh_seconds():
+    return getattr(settings, 'POSTS_DEGRADE_REFRESH', REFRESH_SECONDS)
+
+
+class CircuitBreaker:
+    """Предохранитель: closed - работаем, open - не трогаем базу,
+    half-open - пробный запрос уже идёт."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if self.probing else 'open'
+
+    def allow(self):
+        """Можно ли идти в базу. Разомкнутый предохранитель пропускает
+        один пробный запрос раз в POSTS_BREAKER_RESET секунд."""
+        reset = getattr(settings, 'POSTS_BREAKER_RESET', BREAKER_RESET)
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.monotonic() - self.opened_at < reset:
+                return False
+            self.probing = True
+            return True
+
+    def succeeded(self):
+        with self._lock:
+            if self.opened_at is not None and not self.probing:
+                return
+            if self.opened_at is not None:
+                logger.warning('База снова отвечает, предохранитель '
+                               'замкнут.')
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def failed(self):
+        limit = getattr(settings, 'POSTS_BREAKER_FAILURES', BREAKER_FAILURES)
+        with self._lock:
+            self.failures += 1
+            if self.probing or (self.opened_at is None
+                                and self.failures >= limit):
+                if self.opened_at is None:
+                    logger.error('Предохранитель разомкнут после %s сбоев '
+                                 'базы подряд.', self.failures)
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+
+breaker = CircuitBreaker()
+
+
+@contextmanager
+def db_deadline(seconds):
+    """Выбрасывает DatabaseOverloaded, если запросы к базе внутри блока
+    выходят за seconds секунд от его начала."""
+    if not seconds:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    interrupted = set()
+
+    def past_deadline():
+        return time.monotonic() > deadline
+
+    def check(execute, sql, params, many, context):
+        if past_deadline():
+            raise DatabaseOverloaded(
+                f'Бюджет {seconds * 1000:.0f} мс на запросы исчерпан'
+            )
+        db = context['connection']
+        if db.vendor == 'sqlite' and db.connection not in interrupted:
+            db.connection.set_progress_handler(past_deadline,
+                                               SQLITE_CHECK_STEPS)
+            interrupted.add(db.connection)
+        return execute(sql, params, many, context)
+
+    try:
+        with ExitStack() as stack:
+            for db in connections.all():
+                stack.enter_context(db.execute_wrapper(check))
+            yield
+    finally:
+        for raw in interrupted:
+            raw.set_progress_handler(None, 0)
+
+
+def _key(request):
+    return f'{KEY_PREFIX}:{page_key(request)}'
+
+
+def _remember(request, response):
+    if (request.user.is_authenticated
+            or response.status_code != 200
+            or response.streaming
+            or response.cookies
+            or response.get('X-Page-Cache') in CACHED_STATES):
+        return
+    cache = get_cache()
+    # Маленький ключ с ETag записанной копии избавляет от записи тела
+    # на каждый просмотр. Он живёт меньше копии, поэтому копию,
+    # вытесненную из кэша раньше срока, следующий ответ запишет снова.
+    marker = f'{_key(request)}:etag'
+    etag = response.get('ETag', '')
+    if cache.get(marker) == etag:
+        return
+    cache.set(marker, etag, min(refresh_seconds(), keep_seconds()))
+    cache.set(_key(request), {
+        'stored': time.time(),
+        'headers': [item for item in response.items()
+                    if item[0] not in SKIPPED_HEADERS],
+        'content': response.content,
+    }, keep_seconds())
+
+
+def stale_response(request, reason):
+    """Последняя удачная копия страницы или 503."""
+    entry = get_cache().get(_key(request))
+    if entry is None:
+        retry = getattr(settings, 'POSTS_BREAKER_RESET', BREAKER_RESET)
+        response = HttpResponse('Сайт временно перегружен, попробуйте '
+                                'обновить страницу чуть позже.',
+                                status=503,
+                                content_type='text/plain; charset=utf-8')
+        response['Retry-After'] = retry
+        return response
+    response = HttpResponse(entry['content'])
+    for header, value in entry['headers']:
+        response[header] = value
+    response['Age'] = max(0, int(time.time() - entry['stored']))
+    response['Warning'] = '110 - "Response is Stale"'
+    response['X-Degraded'] = reason
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+def serve_stale_on_error(view):
+    """Отдаёт последнюю удачную копию страницы, если база подвела."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        if not breaker.allow():
+            return stale_response(request, 'circuit open')
+        try:
+            with db_deadline(budget()):
+                response = view(request, *args, **kwargs)
+        except (DatabaseOverloaded, DatabaseError) as error:
+            logger.warning('%s: база не ответила: %s', request.path, error)
+            breaker.failed()
+            # SQLite сообщает о прерванном по бюджету запросе так
+            slow = (isinstance(error, DatabaseOverloaded)
+                    or 'interrupted' in str(error))
+            return stale_response(request, 'database slow' if slow
+                                  else 'database error')
+        except Exception:
+            # Http404 и прочие ошибки не из базы: она ответила, и пробный
+            # запрос не должен оставить предохранитель полуоткрытым
+            breaker.succeeded()
+            raise
+        breaker.succeeded()
+        _remember(request, response)
+        return response
+    return wrapper
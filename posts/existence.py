@@ -0,0 +1,271 @@
+"""Фильтр Блума по именам пользователей и slug групп.
+
+Адреса <username>/, <username>/<post_id>/ и group/<slug>/ ловят любой
+путь, и боты перебирают их тысячами: каждый промах стоил запроса
+к базе перед страницей 404. Декоратор require_existing сначала
+спрашивает фильтр: если имени в нём точно нет, 404 отдаётся сразу.
+Ложноположительные ответы (около FALSE_POSITIVE_RATE) просто доходят
+до базы, как раньше.
+
+Фильтр строится в памяти процесса одним проходом по таблице при первом
+обращении и перестраивается раз в POSTS_EXISTENCE_REBUILD секунд,
+чтобы забыть удалённые имена и вырасти вместе с таблицей. Строит его
+один поток процесса: при плановой перестройке остальные пока
+пользуются старым фильтром, а если старого нет или в нём могут
+не хватать имён, ждут построенного. Новые имена
+(регистрация, новая группа, переименование) добавляются сигналами
+сразу и через кэш попадают в фильтры остальных процессов: каждое
+добавление получает номер поколения, и процесс, отставший по номеру,
+догружает пропущенные имена, а если они уже вытеснены из кэша,
+перестраивает фильтр.
+
+Сколько запросов отсечено и сколько пропущено к базе, показывает
+stats() и manage.py existence_stats (счётчики уходят в кэш пачками,
+см. posts.stats).
+
+Настройки:
+    POSTS_EXISTENCE_FILTER - включить фильтр (по умолчанию True);
+    POSTS_EXISTENCE_REBUILD - период перестройки в секундах.
+"""
+import hashlib
+import math
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+from django.http import Http404
+
+from .models import Group, User
+from .stats import SharedCounters
+
+
+KEY_PREFIX = 'existence'
+FALSE_POSITIVE_RATE = 0.01
+MIN_CAPACITY = 1000
+REBUILD_SECONDS = 60 * 60
+# Сколько добавленных имён хранить в кэше для догоняющих процессов
+ADDED_TIMEOUT = 24 * 60 * 60
+# Если отстали сильнее, дешевле перестроить фильтр
+MAX_CATCH_UP = 1000
+STATS = ('rejected', 'passed')
+
+# kind -> (модель, поле)
+SOURCES = {
+    'username': (User, 'username'),
+    'group': (Group, 'slug'),
+}
+
+
+class BloomFilter:
+    """Фильтр Блума на bytearray с двойным хешированием."""
+
+    def __init__(self, capacity, error_rate=FALSE_POSITIVE_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate)
+                               / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size
+                for i in range(self.hashes))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(value))
+
+
+class _State:
+    def __init__(self, bloom, generation):
+        self.bloom = bloom
+        self.generation = generation
+        self.built = time.monotonic()
+
+
+_states = {}
+_lock = threading.Lock()
+_build_locks = {kind: threading.Lock() for kind in SOURCES}
+
+
+def is_enabled():
+    return getattr(settings, 'POSTS_EXISTENCE_FILTER', True)
+
+
+def rebuild_seconds():
+    return getattr(settings, 'POSTS_EXISTENCE_REBUILD', REBUILD_SECONDS)
+
+
+def _generation_key(kind):
+    return f'{KEY_PREFIX}:gen:{kind}'
+
+
+def _added_key(kind, generation):
+    return f'{KEY_PREFIX}:added:{kind}:{generation}'
+
+
+def _shared_generation(kind):
+    key = _generation_key(kind)
+    # Как в page_cache: начинаем со времени, чтобы после потери ключа
+    # номера не совпали с уже виденными
+    cache.add(key, int(time.time() * 1000), None)
+    return cache.get(key, 0)
+
+
+def build(kind):
+    """Строит фильтр kind заново по таблице."""
+    generation = _shared_generation(kind)
+    model, field = SOURCES[kind]
+    values = model.objects.db_manager(DEFAULT_DB_ALIAS).values_list(
+        field, flat=True
+    )
+    bloom = BloomFilter(max(MIN_CAPACITY, 2 * values.count()))
+    for value in values.iterator():
+        bloom.add(value)
+    state = _State(bloom, generation)
+    with _lock:
+        _states[kind] = state
+    return state
+
+
+def _rebuild(kind, state, wait):
+    """Перестраивает фильтр kind, заменяющий state, одним потоком.
+
+    Остальные потоки ждут его (wait=True) или сразу получают state.
+    """
+    lock = _build_locks[kind]
+    if not lock.acquire(blocking=wait):
+        return state
+    try:
+        with _lock:
+            current = _states.get(kind)
+        if current is not None and current is not state:
+            # Пока ждали блокировку, фильтр перестроил другой поток
+            return current
+        return build(kind)
+    finally:
+        lock.release()
+
+
+def _catch_up(kind, state, generation):
+    """Добавляет имена, записанные другими процессами."""
+    keys = [_added_key(kind, number)
+            for number in range(state.generation + 1, generation + 1)]
+    found = cache.get_many(keys)
+    if len(found) < len(keys):
+        return _rebuild(kind, state, wait=True)
+    for value in found.values():
+        state.bloom.add(value)
+    state.generation = generation
+    return state
+
+
+def _state(kind):
+    with _lock:
+        state = _states.get(kind)
+    if state is None:
+        return _rebuild(kind, None, wait=True)
+    if time.monotonic() - state.built > rebuild_seconds():
+        state = _rebuild(kind, state, wait=False)
+    generation = _shared_generation(kind)
+    if generation == state.generation:
+        return state
+    if not 0 < generation - state.generation <= MAX_CATCH_UP:
+        return _rebuild(kind, state, wait=True)
+    return _catch_up(kind, state, generation)
+
+
+def might_exist(kind, value):
+    """False - значения точно нет в таблице, True - возможно есть."""
+    if not is_enabled():
+        return True
+    return value in _state(kind).bloom
+
+
+def added(kind, value):
+    """Добавляет новое значение во все фильтры kind.
+
+    Внутри транзакции значение добавляется ещё раз после коммита:
+    фильтр, перестроенный до коммита, уже получил новое поколение,
+    но ещё не видел строку.
+    """
+    if not is_enabled():
+        return
+    _add(kind, value)
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: _add(kind, value))
+
+
+def _add(kind, value):
+    _shared_generation(kind)
+    try:
+        generation = cache.incr(_generation_key(kind))
+    except ValueError:
+        # Ключ вытеснен: скачок номера заставит всех перестроить фильтр
+        generation = None
+        cache.set(_generation_key(kind), int(time.time() * 1000), None)
+    else:
+        cache.set(_added_key(kind, generation), value, ADDED_TIMEOUT)
+    with _lock:
+        state = _states.get(kind)
+        if state is not None:
+            state.bloom.add(value)
+            if generation and state.generation == generation - 1:
+                state.generation = generation
+
+
+def _reset(kinds):
+    for kind in kinds:
+        cache.set(_generation_key(kind), int(time.time() * 1000), None)
+        with _lock:
+            _states.pop(kind, None)
+
+
+def reset(*kinds):
+    """Перестраивает фильтры kinds во всех процессах: нужно после
+    массовой вставки без сигналов."""
+    kinds = kinds or tuple(SOURCES)
+    _reset(kinds)
+    # И после коммита: до него фильтр могли построить без новых строк
+    transaction.on_commit(lambda: _reset(kinds))
+
+
+_stats = SharedCounters(KEY_PREFIX, STATS, lambda: cache)
+
+
+def record(name):
+    _stats.record(name)
+
+
+def stats():
+    return _stats.values()
+
+
+def reset_stats():
+    _stats.reset()
+
+
+def require_existing(kind, argument):
+    """Отдаёт 404 без запроса к базе, если значения аргумента view
+    argument точно нет среди kind."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not is_enabled():
+                return view(request, *args, **kwargs)
+            if not might_exist(kind, kwargs[argument]):
+                record('rejected')
+                raise Http404
+            record('passed')
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,111 @@
+"""Планы запросов лент для manage.py feed_explain.
+
+Для каждой ленты строится тот же queryset, что и во view, и для него
+выполняется EXPLAIN. В плане ищутся полные просмотры таблиц и
+сортировки без индекса - признаки того, что запросу не хватает
+составного индекса.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Count
+
+from . import timeline
+from .constants import COMMENT_ORDERING, COMMENTS_PER_PAGE, POSTS_PER_PAGE
+from .models import Follow, Group, Post, User
+
+
+FEED_ORDERING = ('-pub_date', '-id')
+
+# Признаки проблем в планах разных СУБД: (регулярное выражение, описание)
+PROBLEMS = {
+    'sqlite': [
+        (r'\bSCAN (?:TABLE )?(\w+)(?! USING)(?:\s|$)',
+         'полный просмотр таблицы {0}'),
+        (r'USE TEMP B-TREE FOR (?:ORDER BY|RIGHT PART OF ORDER BY)',
+         'сортировка без индекса'),
+    ],
+    'postgresql': [
+        (r'Seq Scan on (\w+)', 'полный просмотр таблицы {0}'),
+        (r'(?<![\w ])Sort\b', 'сортировка без индекса'),
+    ],
+    'mysql': [
+        (r'Using filesort', 'сортировка без индекса'),
+        (r'\bALL\b', 'полный просмотр таблицы'),
+    ],
+}
+
+# Лента подписок собирает посты нескольких авторов, поэтому отобранные
+# строки приходится сортировать; полных просмотров в ней быть не должно.
+ALLOWED = {
+    'follow': {'сортировка без индекса'},
+}
+
+
+def problems(plan, vendor=None):
+    """Список найденных в плане проблем."""
+    found = []
+    for pattern, message in PROBLEMS.get(vendor or connection.vendor, []):
+        for match in re.finditer(pattern, plan, re.MULTILINE):
+            text = message.format(*match.groups())
+            if text not in found:
+                found.append(text)
+    return found
+
+
+def _busiest(queryset, relation):
+    return queryset.annotate(
+        total=Count(relation)
+    ).order_by('-total').first()
+
+
+def feed_querysets(group=None, user=None):
+    """Запросы первых страниц лент: {название: queryset}.
+
+    Для групп, профилей и лент подписок берутся самые наполненные
+    группа, автор и подписчик, если они не заданы явно.
+    """
+    group = group or _busiest(Group.objects.all(), 'posts')
+    author = user or _busiest(User.objects.all(), 'posts')
+    follower = user or _busiest(User.objects.all(), 'follower')
+    post = Post.objects.annotate(total=Count('comments')).order_by(
+        '-total'
+    ).first()
+
+    feeds = {'index': Post.objects.for_feed()}
+    if group is not None:
+        feeds['group'] = group.posts.for_feed()
+    if author is not None:
+        feeds['profile'] = author.posts.for_feed()
+    if follower is not None:
+        feeds['follow'] = timeline.follow_feed(follower)
+
+    querysets = {}
+    for name, posts in feeds.items():
+        querysets[f'{name} (страницы)'] = posts[:POSTS_PER_PAGE]
+        querysets[f'{name} (курсор)'] = posts.order_by(
+            *FEED_ORDERING
+        )[:POSTS_PER_PAGE + 1]
+    if post is not None:
+        querysets['comments'] = post.comments.select_related(
+            'author'
+        ).order_by(*COMMENT_ORDERING)[:COMMENTS_PER_PAGE + 1]
+    if follower is not None:
+        querysets['following check'] = Follow.objects.filter(
+            user=follower, author=author
+        )
+    return querysets
+
+
+def explain(querysets):
+    """[(название, план, проблемы), ...] для каждого queryset.
+
+    Допустимые для ленты проблемы (см. ALLOWED) в список не попадают.
+    """
+    result = []
+    for name, queryset in querysets.items():
+        plan = queryset.explain()
+        allowed = ALLOWED.get(name.split(' ')[0], set())
+        found = [item for item in problems(plan) if item not in allowed]
+        result.append((name, plan, found))
+    return result
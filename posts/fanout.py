@@ -0,0 +1,87 @@
+"""Параллельное выполнение независимых запросов одной страницы.
+
+Yatube работает на Django 2.2, где нет ASGI и асинхронных
+представлений, поэтому медленная база держит поток воркера. Чтобы
+страница ждала самый долгий из своих независимых запросов, а не их
+сумму, такие запросы можно передать в gather(): первый выполняется
+в потоке запроса, остальные - в общем пуле потоков. Смысл это имеет,
+только если каждый из них заметно ждёт базу и пул включён. Профиль
+и пост gather() не используют: проверка подписки там - чтение графа
+posts.follow_graph или один запрос по уникальному индексу.
+
+У каждого потока пула своё соединение с базой. Перед вызовом в поток
+переносятся обёртки запросов вызывающего потока (замеры
+posts.budgets, задержки бенчмарка) и выбранная реплика posts.replicas,
+после вызова соединения закрываются по тем же правилам, что и в конце
+HTTP-запроса (CONN_MAX_AGE).
+
+Внутри транзакции запросы выполняются по очереди: другие соединения
+не видят её незакоммиченных данных.
+
+Настройки:
+    POSTS_QUERY_WORKERS - размер пула; 0 (по умолчанию) - всё
+        выполняется по очереди в потоке запроса.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import close_old_connections, connection, connections
+
+from . import replicas
+
+
+_lock = threading.Lock()
+_executor = None
+_executor_size = 0
+
+
+def workers():
+    return getattr(settings, 'POSTS_QUERY_WORKERS', 0)
+
+
+def executor():
+    global _executor, _executor_size
+    size = workers()
+    with _lock:
+        if _executor is None or _executor_size != size:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ThreadPoolExecutor(size,
+                                           thread_name_prefix='posts-query')
+            _executor_size = size
+        return _executor
+
+
+def _run(call, replica, wrappers):
+    try:
+        with ExitStack() as stack:
+            for alias, alias_wrappers in wrappers.items():
+                for wrapper in alias_wrappers:
+                    stack.enter_context(
+                        connections[alias].execute_wrapper(wrapper)
+                    )
+            stack.enter_context(replicas.reading_from(replica))
+            return call()
+    finally:
+        close_old_connections()
+
+
+def gather(*calls):
+    """Вызывает calls без аргументов и возвращает список результатов
+    в том же порядке. Исключение первого упавшего вызова
+    пробрасывается."""
+    if not workers() or len(calls) < 2 or connection.in_atomic_block:
+        return [call() for call in calls]
+    wrappers = {db.alias: list(db.execute_wrappers)
+                for db in connections.all() if db.execute_wrappers}
+    pool = executor()
+    futures = [pool.submit(_run, call, replicas.current_replica(), wrappers)
+               for call in calls[1:]]
+    try:
+        first = calls[0]()
+    finally:
+        # Не отпускаем запрос, пока пул работает с его объектами
+        wait(futures)
+    return [first, *(future.result() for future in futures)]
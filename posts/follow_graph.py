@@ -0,0 +1,191 @@
+"""Граф подписок в памяти процесса.
+
+Для каждого пользователя хранится отсортированный массив id авторов,
+на которых он подписан (array('q'), 8 байт на подписку). Массив
+загружается из основной базы одним запросом при первом обращении,
+а warm() загружает сразу многих. Проверка подписки - бинарный поиск,
+без запроса к базе.
+
+Подписки и отписки обновляют массив после коммита транзакции
+(on_commit): signals.py - для одиночных, follows.py - для массовых.
+Чтобы другие процессы не читали устаревший массив, у каждого
+пользователя есть версия в кэше: изменение увеличивает её, а массив
+с другой версией загружается заново.
+
+Версии видны другим процессам, только если кэш общий, поэтому по
+умолчанию граф включается лишь с таким кэшем (не LocMemCache и не
+DummyCache). Кроме того, массив живёт не дольше
+POSTS_FOLLOW_GRAPH_MAX_AGE секунд с загрузки из базы: так подписка,
+версия которой не дошла до процесса, видна хотя бы с этой задержкой.
+
+Внутри транзакции граф не используется: она может видеть ещё не
+закоммиченные подписки, которые нельзя запоминать.
+
+Настройки:
+    POSTS_FOLLOW_GRAPH - включить граф (по умолчанию - если кэш общий
+        для процессов);
+    POSTS_FOLLOW_GRAPH_USERS - сколько пользователей держать в памяти,
+        давно не читавшиеся вытесняются;
+    POSTS_FOLLOW_GRAPH_MAX_AGE - сколько секунд массив живёт после
+        загрузки из базы.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+
+from .models import Follow
+
+
+KEY_PREFIX = 'follow_graph'
+MAX_USERS = 10000
+MAX_AGE = 5 * 60
+TYPECODE = 'q'
+# Кэши, которые у каждого процесса свои
+LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',
+                'django.core.cache.backends.dummy.DummyCache')
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+
+
+def cache_is_shared():
+    backend = settings.CACHES.get(DEFAULT_CACHE_ALIAS, {}).get('BACKEND')
+    return backend not in LOCAL_CACHES
+
+
+def is_enabled():
+    return getattr(settings, 'POSTS_FOLLOW_GRAPH', cache_is_shared())
+
+
+def max_users():
+    return getattr(settings, 'POSTS_FOLLOW_GRAPH_USERS', MAX_USERS)
+
+
+def max_age():
+    return getattr(settings, 'POSTS_FOLLOW_GRAPH_MAX_AGE', MAX_AGE)
+
+
+def _version_key(user_id):
+    return f'{KEY_PREFIX}:v:{user_id}'
+
+
+def _versions(user_ids):
+    keys = {_version_key(user_id): user_id for user_id in user_ids}
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    for key in missing:
+        # Как в page_cache: начинаем со времени, чтобы потерянный
+        # ключ не вернул версию, под которой уже лежит старый массив
+        cache.add(key, int(time.time() * 1000), None)
+    if missing:
+        found.update(cache.get_many(missing))
+    return {keys[key]: value for key, value in found.items()}
+
+
+def _bump(user_id):
+    key = _version_key(user_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = int(time.time() * 1000)
+        cache.set(key, version, None)
+        return version
+
+
+def _store(user_id, version, authors):
+    with _lock:
+        _entries[user_id] = (version, authors, time.monotonic())
+        _entries.move_to_end(user_id)
+        while len(_entries) > max_users():
+            _entries.popitem(last=False)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def is_active():
+    return is_enabled() and not connection.in_atomic_block
+
+
+def warm(user_ids):
+    """Загружает подписки пользователей одним запросом."""
+    user_ids = set(user_ids)
+    versions = _versions(user_ids)
+    loaded = {user_id: array(TYPECODE) for user_id in user_ids}
+    rows = Follow.objects.db_manager(DEFAULT_DB_ALIAS).filter(
+        user_id__in=user_ids
+    ).order_by('user_id', 'author_id').values_list('user_id', 'author_id')
+    for user_id, author_id in rows.iterator():
+        loaded[user_id].append(author_id)
+    for user_id, authors in loaded.items():
+        _store(user_id, versions[user_id], authors)
+    return loaded
+
+
+def followees(user_id):
+    """Отсортированный массив id авторов, на которых подписан user_id."""
+    if not is_active():
+        return array(TYPECODE, Follow.objects.filter(
+            user_id=user_id
+        ).order_by('author_id').values_list('author_id', flat=True))
+    version = _versions([user_id])[user_id]
+    with _lock:
+        entry = _entries.get(user_id)
+        if (entry is not None and entry[0] == version
+                and time.monotonic() - entry[2] < max_age()):
+            _entries.move_to_end(user_id)
+            return entry[1]
+    return warm([user_id])[user_id]
+
+
+def is_following(user_id, author_id):
+    if not is_active():
+        return Follow.objects.filter(user_id=user_id,
+                                     author_id=author_id).exists()
+    authors = followees(user_id)
+    position = bisect_left(authors, author_id)
+    return position < len(authors) and authors[position] == author_id
+
+
+def _apply(user_id, author_id, follow):
+    version = _bump(user_id)
+    with _lock:
+        entry = _entries.get(user_id)
+        if entry is None:
+            return
+        if entry[0] != version - 1:
+            # Пропустили чужое изменение - загрузим заново
+            del _entries[user_id]
+            return
+        # Новый массив вместо правки на месте: старый могут читать
+        # другие потоки
+        authors = array(TYPECODE, entry[1])
+        position = bisect_left(authors, author_id)
+        present = position < len(authors) and authors[position] == author_id
+        if follow and not present:
+            insort(authors, author_id)
+        elif not follow and present:
+            del authors[position]
+        # Возраст считается от загрузки из базы, а не от правки
+        _entries[user_id] = (version, authors, entry[2])
+
+
+def changed(pairs, follow):
+    """Отмечает подписку (follow=True) или отписку по парам
+    (user_id, author_id) после коммита текущей транзакции."""
+    pairs = list(pairs)
+    if not pairs:
+        return
+
+    def apply():
+        for user_id, author_id in pairs:
+            _apply(user_id, author_id, follow)
+    transaction.on_commit(apply)
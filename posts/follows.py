@@ -0,0 +1,120 @@
+"""Массовые подписки и отписки.
+
+Пары (подписчик, автор) вставляются пачками через
+bulk_create(ignore_conflicts=True): дубликаты отсекает уникальный индекс
+unique_follow, каждая пачка - отдельная транзакция. bulk_create не
+вызывает сигналы, поэтому счётчики, ленты подписок, граф подписок
+и кэш профилей обновляются здесь же одним проходом на пачку.
+"""
+from django.db import connection, transaction
+
+from . import counters, follow_graph, timeline
+from .models import Follow, User
+from .signals import invalidate_profiles
+
+
+CHUNK_SIZE = 500
+
+
+def chunks(iterable, size=CHUNK_SIZE):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def resolve_usernames(names, chunk_size=CHUNK_SIZE):
+    """{username: id} для существующих пользователей из names."""
+    found = {}
+    for chunk in chunks(set(names), chunk_size):
+        found.update(User.objects.filter(
+            username__in=chunk
+        ).values_list('username', 'pk'))
+    return found
+
+
+def _existing(pairs):
+    """Существующие подписки из pairs: {(user_id, author_id): pk}.
+
+    Выбирает по IN на обе колонки, а точные пары отбирает в Python:
+    длинная цепочка OR упирается в ограничения SQLite на глубину
+    выражения.
+    """
+    rows = Follow.objects.filter(
+        user_id__in={user_id for user_id, _ in pairs},
+        author_id__in={author_id for _, author_id in pairs},
+    ).values_list('user_id', 'author_id', 'pk')
+    return {(user_id, author_id): pk for user_id, author_id, pk in rows
+            if (user_id, author_id) in pairs}
+
+
+def _delete(pks):
+    """Удаляет подписки по первичным ключам одним DELETE.
+
+    Запрос выполняется напрямую, а не через QuerySet.delete(): тот
+    отправил бы post_delete на каждую подписку, и сигналы сдвинули бы
+    счётчики, которые unfollow_many пересчитывает сам. На подписки
+    никто не ссылается, так что каскада здесь нет.
+    """
+    if not pks:
+        return
+    placeholders = ', '.join(['%s'] * len(pks))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {Follow._meta.db_table} '
+            f'WHERE {Follow._meta.pk.column} IN ({placeholders})',
+            list(pks)
+        )
+
+
+def _after_change(pairs):
+    user_ids = {user_id for pair in pairs for user_id in pair}
+    counters.repair_user_counters(user_ids)
+    invalidate_profiles(*user_ids)
+
+
+def follow_many(pairs, chunk_size=CHUNK_SIZE):
+    """Создаёт подписки из пар (user_id, author_id).
+
+    Подписки на себя и уже существующие пропускаются.
+    Возвращает число созданных подписок.
+    """
+    created = 0
+    for chunk in chunks(pairs, chunk_size):
+        chunk = {(user_id, author_id) for user_id, author_id in chunk
+                 if user_id != author_id}
+        if not chunk:
+            continue
+        with transaction.atomic():
+            new = chunk - set(_existing(chunk))
+            Follow.objects.bulk_create(
+                [Follow(user_id=user_id, author_id=author_id)
+                 for user_id, author_id in new],
+                ignore_conflicts=True,
+            )
+            for user_id, author_id in new:
+                timeline.backfill(user_id, author_id)
+            follow_graph.changed(new, follow=True)
+            _after_change(new)
+        created += len(new)
+    return created
+
+
+def unfollow_many(pairs, chunk_size=CHUNK_SIZE):
+    """Удаляет подписки из пар (user_id, author_id). Возвращает число."""
+    deleted = 0
+    for chunk in chunks(pairs, chunk_size):
+        with transaction.atomic():
+            existing = _existing(set(chunk))
+            gone = list(existing)
+            _delete(existing.values())
+            for user_id, author_id in gone:
+                timeline.prune(user_id, author_id)
+            follow_graph.changed(gone, follow=False)
+            _after_change(gone)
+        deleted += len(gone)
+    return deleted
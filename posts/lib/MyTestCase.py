@@ -2,9 +2,11 @@ import shutil
 import tempfile
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase
 
+from posts import budgets
 from posts.models import Comment, Follow, Group, Post, User
 
 
@@ -84,6 +86,10 @@ class MyTestCase(TestCase):
         shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
 
     def setUp(self):
+        # Кэш страниц и фрагментов общий для всех тестов процесса
+        cache.clear()
+        self.addCleanup(cache.clear)
+
         self.guest_client = Client()
 
         self.authorized_client = Client()
@@ -97,3 +103,16 @@ class MyTestCase(TestCase):
 
         self.non_follower_client = Client()
         self.non_follower_client.force_login(self.non_follower)
+
+    def assertWithinBudget(self, client, url, budget=None):
+        """Запрашивает url и проверяет метрики по бюджету страницы."""
+        with budgets.measure() as measurement:
+            response = client.get(url)
+        measurement.finish(response.wsgi_request, response)
+        breaches = measurement.breaches(budget)
+        self.assertFalse(
+            breaches,
+            f'Превышен бюджет страницы {measurement.url_name}: '
+            + ', '.join(breaches)
+        )
+        return response
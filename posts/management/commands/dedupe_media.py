@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from posts.media import delete_unused, migrate_legacy
+
+
+class Command(BaseCommand):
+    help = ('Переносит картинки постов в хранилище по хешу содержимого, '
+            'удаляет дубликаты и файлы без ссылок.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать, ничего не перенося и не удаляя.'
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        moved, duplicates, reclaimed = migrate_legacy(dry_run=dry_run)
+        unused, unused_size = (0, 0) if dry_run else delete_unused()
+        self.stdout.write(f'Перенесено файлов: {moved}')
+        self.stdout.write(f'Из них дубликатов: {duplicates}')
+        self.stdout.write(f'Удалено файлов без ссылок: {unused}')
+        total = (reclaimed + unused_size) / 1024 / 1024
+        verb = 'Можно освободить' if dry_run else 'Освобождено'
+        self.stdout.write(f'{verb}: {total:.2f} МБ')
+        self.stdout.write(self.style.SUCCESS('Готово'))
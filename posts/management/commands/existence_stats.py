@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from posts import existence
+
+
+class Command(BaseCommand):
+    help = ('Показывает, сколько запросов к страницам пользователей и '
+            'групп фильтр Блума отсёк без обращения к базе.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Перестроить фильтры во всех процессах.')
+        parser.add_argument('--reset', action='store_true',
+                            help='Обнулить счётчики после вывода.')
+
+    def handle(self, *args, **options):
+        values = existence.stats()
+        total = values['rejected'] + values['passed']
+        self.stdout.write(f'Отсечено без базы: {values["rejected"]}')
+        self.stdout.write(f'Пропущено к базе: {values["passed"]}')
+        if total:
+            self.stdout.write(
+                f'Доля отсечённых: {values["rejected"] / total:.1%}'
+            )
+        if options['rebuild']:
+            existence.reset()
+            self.stdout.write('Фильтры будут перестроены.')
+        if options['reset']:
+            existence.reset_stats()
+            self.stdout.write('Счётчики обнулены.')
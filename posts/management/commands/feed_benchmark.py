@@ -0,0 +1,145 @@
+import json
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from posts import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный прогон страниц лент: перцентили времени ответа, '
+            'SQL-запросы на запрос и память. По умолчанию данные '
+            'создаются во временной тестовой базе. Чтобы сравнить '
+            'последовательную и параллельную выборку при медленной базе, '
+            'запустите с --io-delay 20 --query-workers 0 --output sync.json, '
+            'затем с --io-delay 20 --query-workers 4 --compare sync.json.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--current-db', action='store_true',
+            help='Гонять на настроенной базе, а не на временной.'
+        )
+        parser.add_argument(
+            '--seed', action='store_true',
+            help='Создать данные в настроенной базе (с --current-db).'
+        )
+        for name, default in (('users', 50), ('groups', 5), ('posts', 500),
+                              ('comments', 1000), ('follows', 500),
+                              ('images', 10)):
+            parser.add_argument(f'--{name}', type=int, default=default,
+                                help=f'Сколько создать ({default}).')
+        parser.add_argument('--random-seed', type=int, default=0)
+        parser.add_argument('--scenario', action='append',
+                            choices=benchmark.SCENARIOS,
+                            help='Сценарий, можно несколько; по умолчанию '
+                                 'все.')
+        parser.add_argument('--requests', type=int, default=100,
+                            help='Запросов на сценарий.')
+        parser.add_argument('--warmup', type=int, default=5,
+                            help='Прогревочных запросов на сценарий.')
+        parser.add_argument('--driver', choices=sorted(benchmark.DRIVERS),
+                            default='client',
+                            help='Тестовый клиент или локальный WSGI-сервер.')
+        parser.add_argument('--io-delay', type=float, default=0,
+                            help='Задержка каждого SQL-запроса, мс.')
+        parser.add_argument('--query-workers', type=int,
+                            help='POSTS_QUERY_WORKERS на время прогона.')
+        parser.add_argument('--output', help='Записать результат в JSON.')
+        parser.add_argument('--compare',
+                            help='JSON прошлого прогона для сравнения.')
+
+    def handle(self, *args, **options):
+        previous = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as source:
+                    previous = json.load(source)
+            except (OSError, ValueError) as error:
+                raise CommandError(f'Не удалось прочитать: {error}')
+
+        if options['current_db']:
+            if options['seed']:
+                self.seed(options)
+            result = self.run(options)
+        else:
+            result = self.run_in_test_db(options)
+
+        self.report(result['results'])
+        if previous is not None:
+            self.report_changes(benchmark.compare(previous, result))
+        if options['output']:
+            with open(options['output'], 'w') as target:
+                json.dump(result, target, indent=2, ensure_ascii=False)
+            self.stdout.write(f'Результат записан в {options["output"]}')
+
+    def seed(self, options):
+        try:
+            created = benchmark.seed(
+                users=options['users'], groups=options['groups'],
+                posts=options['posts'], comments=options['comments'],
+                follows=options['follows'], images=options['images'],
+                random_seed=options['random_seed'],
+            )
+        except ValueError as error:
+            raise CommandError(error)
+        self.stdout.write('Создано: ' + ', '.join(
+            f'{name} {count}' for name, count in created.items()
+        ))
+
+    def run(self, options):
+        overrides = {}
+        if options['query_workers'] is not None:
+            overrides['POSTS_QUERY_WORKERS'] = options['query_workers']
+        try:
+            with override_settings(**overrides):
+                return benchmark.run(
+                    options['scenario'] or benchmark.SCENARIOS,
+                    requests=options['requests'], warmup=options['warmup'],
+                    driver=options['driver'],
+                    random_seed=options['random_seed'],
+                    io_delay=options['io_delay'] / 1000,
+                )
+        except ValueError as error:
+            raise CommandError(error)
+
+    def run_in_test_db(self, options):
+        media = tempfile.mkdtemp()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(MEDIA_ROOT=media):
+                self.seed(options)
+                result = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(media, ignore_errors=True)
+        result['meta']['dataset'] = {
+            name: options[name] for name in ('users', 'groups', 'posts',
+                                             'comments', 'follows', 'images')
+        }
+        return result
+
+    def report(self, results):
+        self.stdout.write(
+            f'{"сценарий":<14}{"rps":>8}{"p50":>9}{"p95":>9}{"p99":>9}'
+            f'{"SQL":>6}{"ответ, КБ":>11}{"RSS, КБ":>9}{"ошибок":>8}'
+        )
+        for scenario, row in results.items():
+            self.stdout.write(
+                f'{scenario:<14}{row["rps"]:>8.1f}{row["p50_ms"]:>9.2f}'
+                f'{row["p95_ms"]:>9.2f}{row["p99_ms"]:>9.2f}'
+                f'{row["queries_avg"]:>6.1f}'
+                f'{row.get("bytes_avg", 0) / 1024:>11.1f}'
+                f'{row["rss_growth_kb"]:>9}{row["errors"]:>8}'
+            )
+
+    def report_changes(self, rows):
+        self.stdout.write('Изменения относительно прошлого прогона:')
+        for scenario, metric, was, now, change in rows:
+            line = (f'  {scenario} {metric}: {was:.2f} -> {now:.2f} '
+                    f'({change:+.1f}%)')
+            style = self.style.WARNING if change > 10 else self.style.SUCCESS
+            self.stdout.write(style(line))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.explain import explain, feed_querysets
+from posts.models import Group, User
+
+
+class Command(BaseCommand):
+    help = ('Выполняет EXPLAIN для запросов лент и отмечает полные '
+            'просмотры таблиц и сортировки без индекса.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--group', help='slug группы для примера.')
+        parser.add_argument('--user', help='Имя пользователя для примера.')
+        parser.add_argument('--verbose-plans', action='store_true',
+                            help='Печатать планы целиком.')
+        parser.add_argument(
+            '--fail', action='store_true',
+            help='Завершиться с ошибкой, если найдены проблемы.'
+        )
+
+    def handle(self, *args, **options):
+        group = user = None
+        if options['group']:
+            group = Group.objects.filter(slug=options['group']).first()
+            if group is None:
+                raise CommandError('Группа не найдена.')
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError('Пользователь не найден.')
+
+        failed = 0
+        for name, plan, problems in explain(feed_querysets(group, user)):
+            if problems:
+                failed += 1
+                self.stdout.write(self.style.WARNING(
+                    f'{name}: ' + '; '.join(problems)
+                ))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'{name}: ok'))
+            if problems or options['verbose_plans']:
+                for line in plan.splitlines():
+                    self.stdout.write(f'    {line}')
+
+        if failed and options['fail']:
+            raise CommandError(f'Запросов с проблемами: {failed}')
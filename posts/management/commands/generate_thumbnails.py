@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from posts.thumbnails import backfill
+
+
+class Command(BaseCommand):
+    help = ('Строит варианты картинок постов (ширины и форматы), '
+            'у которых их ещё нет.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Сколько картинок обрабатывать параллельно.')
+        parser.add_argument('--force', action='store_true',
+                            help='Перестроить и уже готовые варианты.')
+
+    def handle(self, *args, **options):
+        built, failed = backfill(force=options['force'],
+                                 threads=options['workers'])
+        self.stdout.write(f'Обработано картинок: {built}')
+        if failed:
+            self.stdout.write(self.style.WARNING(
+                f'Не удалось построить: {failed}'
+            ))
+        self.stdout.write(self.style.SUCCESS('Готово'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from posts.thumbnails import stats
+
+
+def kilobytes(size):
+    return f'{size / 1024:.1f} КБ'
+
+
+class Command(BaseCommand):
+    help = ('Показывает, сколько байт экономит каждый вариант картинок '
+            'по сравнению с исходниками.')
+
+    def handle(self, *args, **options):
+        rows = stats()
+        if not rows:
+            self.stdout.write('Вариантов картинок ещё нет, запустите '
+                              'generate_thumbnails.')
+            return
+        self.stdout.write(f'{"формат":>8} {"ширина":>7} {"штук":>6} '
+                          f'{"варианты":>12} {"исходники":>12} '
+                          f'{"экономия":>12} {"%":>6}')
+        for (name, width), (count, size, original) in sorted(rows.items()):
+            saved = original - size
+            percent = 100 * saved / original if original else 0
+            self.stdout.write(
+                f'{name:>8} {width:>7} {count:>6} {kilobytes(size):>12} '
+                f'{kilobytes(original):>12} {kilobytes(saved):>12} '
+                f'{percent:>5.1f}%'
+            )
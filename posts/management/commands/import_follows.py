@@ -0,0 +1,74 @@
+import csv
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.follows import (CHUNK_SIZE, chunks, follow_many,
+                           resolve_usernames)
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = ('Импортирует подписки из CSV с парами "подписчик,автор" '
+            'пачками и показывает скорость.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV-файл или - для stdin.')
+        parser.add_argument('--ids', action='store_true',
+                            help='В файле id пользователей, а не имена.')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Сколько пар вставлять в одной транзакции.')
+
+    def resolve(self, chunk, chunk_size, use_ids):
+        """{значение из файла: id} для существующих пользователей."""
+        values = {value for pair in chunk for value in pair}
+        if not use_ids:
+            return resolve_usernames(values, chunk_size)
+        try:
+            ids = {int(value) for value in values}
+        except ValueError:
+            raise CommandError('Ожидались числовые id пользователей.')
+        existing = set(User.objects.filter(
+            pk__in=ids
+        ).values_list('pk', flat=True))
+        return {value: int(value) for value in values
+                if int(value) in existing}
+
+    def pairs(self, rows, chunk_size, use_ids):
+        for chunk in chunks(rows, chunk_size):
+            found = self.resolve(chunk, chunk_size, use_ids)
+            for user, author in chunk:
+                if user in found and author in found:
+                    yield found[user], found[author]
+                else:
+                    self.unknown += 1
+
+    def read(self, source):
+        for row in csv.reader(source):
+            if len(row) < 2 or row[0].startswith('#'):
+                continue
+            self.total += 1
+            yield row[0].strip(), row[1].strip()
+
+    def handle(self, *args, **options):
+        self.total = self.unknown = 0
+        source = (sys.stdin if options['path'] == '-'
+                  else open(options['path'], newline='', encoding='utf-8'))
+        started = time.perf_counter()
+        try:
+            created = follow_many(
+                self.pairs(self.read(source), options['chunk_size'],
+                           options['ids']),
+                options['chunk_size'],
+            )
+        finally:
+            if source is not sys.stdin:
+                source.close()
+        elapsed = time.perf_counter() - started
+        rate = self.total / elapsed if elapsed else 0
+        self.stdout.write(f'Прочитано пар: {self.total}')
+        self.stdout.write(f'Создано подписок: {created}')
+        self.stdout.write(f'Неизвестных пользователей: {self.unknown}')
+        self.stdout.write(f'Время: {elapsed:.2f} с, {rate:.0f} пар/с')
+        self.stdout.write(self.style.SUCCESS('Готово'))
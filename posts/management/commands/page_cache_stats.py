@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from posts import page_cache
+
+
+class Command(BaseCommand):
+    help = ('Показывает, сколько анонимных страниц посчитано и сколько '
+            'одинаковых запросов склеено с ними.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help='Обнулить счётчики после вывода.')
+
+    def handle(self, *args, **options):
+        values = page_cache.stats()
+        collapsed = values['coalesced'] + values['coalesced_remote']
+        total = values['computed'] + collapsed
+        self.stdout.write(f'Посчитано страниц: {values["computed"]}')
+        self.stdout.write(f'Склеено в процессе: {values["coalesced"]}')
+        self.stdout.write('Дождались другого процесса: '
+                          f'{values["coalesced_remote"]}')
+        if total:
+            self.stdout.write(f'Доля склеенных: {collapsed / total:.1%}')
+        if options['reset']:
+            page_cache.reset_stats()
+            self.stdout.write('Счётчики обнулены.')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import timeline
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает материализованные ленты подписок.'
+
+    def handle(self, *args, **options):
+        if not timeline.is_enabled():
+            raise CommandError('Ленты выключены: POSTS_TIMELINE_ENABLED '
+                               'не установлена.')
+        total = timeline.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово, записей в лентах: {total}'
+        ))
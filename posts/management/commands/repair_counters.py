@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import repair_post_counters, repair_user_counters
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счётчики подписчиков, подписок, записей '
+            'и комментариев и исправляет расхождения.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать расхождения, ничего не сохраняя.'
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        created, users = repair_user_counters(dry_run=dry_run)
+        posts = repair_post_counters(dry_run=dry_run)
+        verb = 'Найдено' if dry_run else 'Исправлено'
+        self.stdout.write(f'Создано счётчиков пользователей: {created}')
+        self.stdout.write(f'{verb} счётчиков пользователей: {users}')
+        self.stdout.write(f'{verb} счётчиков комментариев: {posts}')
+        self.stdout.write(self.style.SUCCESS('Готово'))
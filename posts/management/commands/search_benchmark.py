@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает время поиска по индексу и через icontains '
+            'на текущих данных.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='+', help='Поисковые запросы.')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Сколько раз повторить каждый запрос.')
+        parser.add_argument('--per-page', type=int, default=10,
+                            help='Размер первой страницы результатов.')
+
+    def measure(self, backend, query, repeat, per_page):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            results = search.SearchResults(backend, query)
+            results.count()
+            list(results[:per_page])
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        return timings[len(timings) // 2], timings[-1], results.count()
+
+    def handle(self, *args, **options):
+        backends = [search.FallbackBackend()]
+        indexed = search.get_backend()
+        if not isinstance(indexed, search.FallbackBackend):
+            backends.append(indexed)
+        for query in options['queries']:
+            for backend in backends:
+                median, worst, found = self.measure(
+                    backend, query, options['repeat'], options['per_page']
+                )
+                self.stdout.write(
+                    f'{backend.name:>10} {query!r}: найдено {found}, '
+                    f'медиана {median * 1000:.2f} мс, '
+                    f'максимум {worst * 1000:.2f} мс'
+                )
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает поисковый индекс постов и комментариев.'
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        if isinstance(backend, search.FallbackBackend):
+            self.stdout.write(self.style.WARNING(
+                'Таблицы поискового индекса нет, поиск работает через '
+                'icontains. Примените миграции.'
+            ))
+            return
+        total = search.reindex()
+        self.stdout.write(f'Проиндексировано документов: {total}')
+        self.stdout.write(self.style.SUCCESS('Готово'))
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from posts import seed
+
+
+class Command(BaseCommand):
+    help = ('Создаёт синтетических пользователей, группы, посты, '
+            'комментарии и подписки с реалистичными распределениями.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--comments', type=int, default=200000)
+        parser.add_argument('--follows', type=int, default=20000,
+                            help='Примерное число подписок.')
+        parser.add_argument('--days', type=int, default=365,
+                            help='За сколько дней до сейчас разнести посты.')
+        parser.add_argument(
+            '--end', help='Дата последнего поста, например 2024-01-01T00:00; '
+                          'по умолчанию - сейчас.'
+        )
+        parser.add_argument('--random-seed', type=int, default=0,
+                            help='Одинаковый seed даёт одинаковые данные.')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Число процессов для генерации порций.')
+        parser.add_argument('--prefix', default='seed',
+                            help='Префикс имён пользователей и slug групп.')
+        parser.add_argument(
+            '--skip-finish', action='store_true',
+            help='Не пересчитывать счётчики, поисковый индекс и ленты.'
+        )
+
+    def handle(self, *args, **options):
+        end = None
+        if options['end']:
+            end = parse_datetime(options['end'])
+            if end is None:
+                raise CommandError('Неверный формат --end.')
+            if timezone.is_naive(end):
+                end = timezone.make_aware(end)
+        try:
+            plan, created, elapsed = seed.generate(
+                users=options['users'], groups=options['groups'],
+                posts=options['posts'], comments=options['comments'],
+                follows=options['follows'],
+                random_seed=options['random_seed'],
+                processes=options['processes'], days=options['days'],
+                prefix=options['prefix'], end=end,
+                progress=self.progress if options['verbosity'] > 1 else None,
+            )
+        except ValueError as error:
+            raise CommandError(error)
+
+        rows = sum(created.values())
+        self.stdout.write(', '.join(f'{kind}: {count}'
+                                    for kind, count in created.items()))
+        self.stdout.write(f'Вставлено {rows} строк за {elapsed:.1f} с, '
+                          f'{rows / elapsed:.0f} строк/с')
+        if not options['skip_finish']:
+            seed.finish(plan)
+            self.stdout.write('Счётчики, индекс и ленты пересчитаны')
+        self.stdout.write(self.style.SUCCESS('Готово'))
+
+    def progress(self, kind, rows):
+        self.stdout.write(f'  {kind}: +{rows}')
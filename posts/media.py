@@ -0,0 +1,116 @@
+"""Счётчики ссылок на картинки в хранилище по хешу.
+
+Пост, сохранённый с картинкой, увеличивает refs у MediaFile, удаление
+поста или смена картинки - уменьшает. Когда ссылок не остаётся, файл
+вместе с его вариантами из posts.thumbnails удаляется после коммита
+транзакции. Пока на файл ссылается хотя бы
+один пост, удаление других постов его не трогает.
+"""
+from django.db import transaction
+from django.db.models import Count, F
+
+from . import thumbnails
+from .models import MediaFile, Post
+from .storage import content_hash, hashed_name, source_hash
+
+
+def storage():
+    return Post._meta.get_field('image').storage
+
+
+def _size(name):
+    try:
+        return storage().size(name)
+    except Exception:
+        return 0
+
+
+def acquire(name):
+    # Старые имена (до хранилища по хешу) не считаются, см. migrate_legacy
+    if not source_hash(name):
+        return
+    media, created = MediaFile.objects.get_or_create(
+        name=name, defaults={'size': _size(name), 'refs': 1}
+    )
+    if not created:
+        MediaFile.objects.filter(pk=media.pk).update(refs=F('refs') + 1)
+
+
+def release(name):
+    if not source_hash(name):
+        return
+    MediaFile.objects.filter(name=name, refs__gt=0).update(
+        refs=F('refs') - 1
+    )
+    transaction.on_commit(lambda: delete_unused([name]))
+
+
+def delete_unused(names=None):
+    """Удаляет файлы без ссылок и их варианты.
+
+    Возвращает (файлов, байт), варианты входят в оба числа.
+    """
+    unused = MediaFile.objects.filter(refs=0)
+    if names is not None:
+        unused = unused.filter(name__in=names)
+    files = size = 0
+    for media in unused:
+        if Post.objects.filter(image=media.name).exists():
+            continue
+        storage().delete(media.name)
+        media.delete()
+        renditions, renditions_size = thumbnails.delete_renditions(
+            media.name
+        )
+        files += 1 + renditions
+        size += media.size + renditions_size
+    return files, size
+
+
+def recount():
+    """Пересчитывает refs по постам и заводит недостающие MediaFile."""
+    counts = dict(Post.objects.exclude(image='').exclude(
+        image__isnull=True
+    ).values_list('image').annotate(total=Count('pk')).order_by())
+    for media in MediaFile.objects.all():
+        refs = counts.pop(media.name, 0)
+        if media.refs != refs:
+            MediaFile.objects.filter(pk=media.pk).update(refs=refs)
+    MediaFile.objects.bulk_create(
+        [MediaFile(name=name, size=_size(name), refs=refs)
+         for name, refs in counts.items() if source_hash(name)],
+        ignore_conflicts=True,
+    )
+
+
+def migrate_legacy(dry_run=False):
+    """Переносит картинки со старыми именами в хранилище по хешу.
+
+    Посты переключаются на новое имя, старый файл удаляется.
+    Возвращает (перенесено файлов, дубликатов, освобождено байт).
+    """
+    store = storage()
+    names = Post.objects.exclude(image='').exclude(
+        image__isnull=True
+    ).values_list('image', flat=True).distinct().order_by()
+    seen = set()
+    moved = duplicates = reclaimed = 0
+    for name in names:
+        if source_hash(name) or not store.exists(name):
+            continue
+        with store.open(name, 'rb') as content:
+            new_name = hashed_name(name, content_hash(content))
+            duplicate = new_name in seen or store.exists(new_name)
+            if not dry_run and not duplicate:
+                new_name = store.save(name, content)
+        seen.add(new_name)
+        moved += 1
+        if duplicate:
+            duplicates += 1
+            reclaimed += store.size(name)
+        if not dry_run:
+            Post.objects.filter(image=name).update(image=new_name)
+            store.delete(name)
+    if not dry_run:
+        recount()
+    return moved, duplicates, reclaimed
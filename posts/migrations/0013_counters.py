@@ -0,0 +1,57 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_counters(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    UserCounters = apps.get_model('posts', 'UserCounters')
+    Post = apps.get_model('posts', 'Post')
+    users = User.objects.annotate(
+        followers=models.Count('following', distinct=True),
+        followings=models.Count('follower', distinct=True),
+        posts_total=models.Count('posts', distinct=True),
+    )
+    UserCounters.objects.bulk_create(
+        [UserCounters(user_id=user.pk,
+                      followers_count=user.followers,
+                      following_count=user.followings,
+                      posts_count=user.posts_total)
+         for user in users.iterator()],
+        batch_size=1000,
+    )
+    posts = Post.objects.annotate(total=models.Count('comments'))
+    for post in posts.filter(total__gt=0).iterator():
+        Post.objects.filter(pk=post.pk).update(comment_count=post.total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0012_auto_20210115_1829'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserCounters',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counters', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('followers_count', models.PositiveIntegerField(default=0, verbose_name='Подписчиков')),
+                ('following_count', models.PositiveIntegerField(default=0, verbose_name='Подписок')),
+                ('posts_count', models.PositiveIntegerField(default=0, verbose_name='Записей')),
+            ],
+            options={
+                'verbose_name': 'Счётчики пользователя',
+                'verbose_name_plural': 'Счётчики пользователей',
+            },
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Комментариев'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
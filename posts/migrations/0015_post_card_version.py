@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_timeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='card_version',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Версия карточки'),
+        ),
+    ]
@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.db import migrations
+
+
+SQLITE_CREATE = (
+    "CREATE VIRTUAL TABLE posts_search_index USING fts5("
+    "text, post_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')"
+)
+POSTGRES_CREATE = (
+    'CREATE TABLE posts_search_index ('
+    'rowid bigint PRIMARY KEY, post_id integer NOT NULL, '
+    'document tsvector NOT NULL)',
+    'CREATE INDEX posts_search_index_document '
+    'ON posts_search_index USING GIN (document)',
+)
+# rowid = id * 2 для поста и id * 2 + 1 для комментария, см. posts.search
+SQLITE_FILL = (
+    'INSERT INTO posts_search_index (rowid, text, post_id) '
+    'SELECT id * 2, text, id FROM posts_post',
+    'INSERT INTO posts_search_index (rowid, text, post_id) '
+    'SELECT id * 2 + 1, text, post_id FROM posts_comment',
+)
+POSTGRES_FILL = (
+    'INSERT INTO posts_search_index (rowid, post_id, document) '
+    'SELECT id * 2, id, to_tsvector(%s, text) FROM posts_post',
+    'INSERT INTO posts_search_index (rowid, post_id, document) '
+    'SELECT id * 2 + 1, post_id, to_tsvector(%s, text) FROM posts_comment',
+)
+
+
+def create_index(apps, schema_editor):
+    """Создаёт таблицу-индекс поиска, если СУБД это умеет.
+
+    Для остальных СУБД и SQLite без FTS5 поиск работает через icontains,
+    см. posts.search.
+    """
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(SQLITE_CREATE)
+        except Exception:
+            # SQLite собран без FTS5
+            return
+        for statement in SQLITE_FILL:
+            schema_editor.execute(statement)
+    elif connection.vendor == 'postgresql':
+        config = getattr(settings, 'POSTS_SEARCH_CONFIG', 'russian')
+        for statement in POSTGRES_CREATE:
+            schema_editor.execute(statement)
+        for statement in POSTGRES_FILL:
+            schema_editor.execute(statement, [config])
+
+
+def drop_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if 'posts_search_index' in connection.introspection.table_names():
+        schema_editor.execute('DROP TABLE posts_search_index')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_updated'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
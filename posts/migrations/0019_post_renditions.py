@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_post_thumbnail_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='renditions',
+            field=models.TextField(blank=True, editable=False, verbose_name='Варианты картинки'),
+        ),
+    ]
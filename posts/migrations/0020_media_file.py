@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:07
+
+from django.db import migrations, models
+import posts.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_post_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Имя файла')),
+                ('size', models.PositiveIntegerField(default=0, verbose_name='Размер')),
+                ('refs', models.PositiveIntegerField(default=0, verbose_name='Ссылок')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Дата загрузки')),
+            ],
+            options={
+                'verbose_name': 'Медиафайл',
+                'verbose_name_plural': 'Медиафайлы',
+            },
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=posts.storage.ContentAddressedStorage(), upload_to='posts/', verbose_name='Заглавная картинка'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:10
+
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+CHUNK_SIZE = 500
+
+
+def _follow_count(Follow, field):
+    counts = Follow.objects.filter(
+        **{field: OuterRef('pk')}
+    ).order_by().values(field).annotate(total=Count('id')).values('total')
+    return Coalesce(Subquery(counts), 0)
+
+
+def remove_duplicates(apps, schema_editor):
+    """Оставляет по одной подписке на пару перед уникальным индексом.
+
+    Удаление идёт через историческую модель без сигналов, поэтому
+    счётчики подписок и подписчиков затронутых пользователей
+    пересчитываются здесь же, как в counters.repair_user_counters.
+    """
+    Follow = apps.get_model('posts', 'Follow')
+    UserCounters = apps.get_model('posts', 'UserCounters')
+    duplicates = Follow.objects.values('user_id', 'author_id').annotate(
+        first=Min('id'), total=Count('id')
+    ).filter(total__gt=1).order_by()
+    affected = set()
+    for row in duplicates:
+        Follow.objects.filter(
+            user_id=row['user_id'], author_id=row['author_id']
+        ).exclude(id=row['first']).delete()
+        affected.update((row['user_id'], row['author_id']))
+    affected = sorted(affected)
+    for start in range(0, len(affected), CHUNK_SIZE):
+        UserCounters.objects.filter(
+            pk__in=affected[start:start + CHUNK_SIZE]
+        ).update(
+            followers_count=_follow_count(Follow, 'author'),
+            following_count=_follow_count(Follow, 'user'),
+            updated=timezone.now(),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0020_media_file'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('user', 'author'), name='unique_follow'),
+        ),
+    ]
@@ -1,6 +1,10 @@
+import json
+
 from django.contrib.auth import get_user_model
 from django.db import models
 
+from .storage import ContentAddressedStorage
+
 
 User = get_user_model()
 
@@ -20,32 +24,91 @@ class Group(models.Model):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """Посты для ленты со всем, что нужно карточке поста.
+
+        Автор и группа подтягиваются тем же запросом, а количество
+        комментариев хранится в самом посте (comment_count), поэтому
+        шаблон includes/post_item.html не делает запросов на каждый пост.
+        """
+        return self.select_related('author', 'group')
+
+
 class Post(models.Model):
     text = models.TextField(verbose_name='Текст',
                             help_text='Текст публикации')
     pub_date = models.DateTimeField(auto_now_add=True,
-                                    db_index=True,
                                     verbose_name='Дата публикации')
+    # Отдельные индексы по author и group не нужны: их покрывают
+    # составные post_author_pub_date и post_group_pub_date
     author = models.ForeignKey(User, on_delete=models.CASCADE,
-                               related_name='posts')
+                               related_name='posts', db_index=False)
     group = models.ForeignKey(Group, blank=True, null=True,
-                              on_delete=models.SET_NULL,
+                              on_delete=models.SET_NULL, db_index=False,
                               related_name='posts', verbose_name='Группа')
     image = models.ImageField(upload_to='posts/', blank=True, null=True,
+                              storage=ContentAddressedStorage(),
                               verbose_name='Заглавная картинка')
+    thumbnail_url = models.CharField(max_length=255, blank=True,
+                                     editable=False,
+                                     verbose_name='Миниатюра картинки')
+    renditions = models.TextField(blank=True, editable=False,
+                                  verbose_name='Варианты картинки')
+    comment_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Комментариев'
+    )
+    card_version = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Версия карточки'
+    )
+    updated = models.DateTimeField(auto_now=True,
+                                   verbose_name='Дата изменения')
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        # Ленты выбирают посты по группе, автору или всем подряд
+        # и сортируют по (pub_date, id), см. manage.py feed_explain
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='post_pub_date'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_pub_date'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_pub_date'),
+        ]
 
     def __str__(self):
         return self.text[:15]
 
+    @property
+    def image_sources(self):
+        """Элементы <source> для <picture>: [{'type', 'srcset'}, ...].
+
+        Варианты строит posts.thumbnails, форматы идут в порядке
+        предпочтения, ширины - по возрастанию.
+        """
+        if not self.renditions:
+            return []
+        result = {}
+        for item in json.loads(self.renditions)['items']:
+            result.setdefault(item['format'], []).append(item)
+        return [{
+            'type': f'image/{name}',
+            'srcset': ', '.join(
+                f'{item["url"]} {item["width"]}w'
+                for item in sorted(items, key=lambda item: item['width'])
+            ),
+        } for name, items in result.items()]
+
 
 class Comment(models.Model):
+    # Индекс по post покрывает составной comment_post_created
     post = models.ForeignKey(Post, on_delete=models.CASCADE,
-                             related_name='comments')
+                             related_name='comments', db_index=False)
     author = models.ForeignKey(User, on_delete=models.CASCADE,
                                related_name='comments')
     text = models.TextField(verbose_name='Текст комментария',
@@ -58,20 +121,126 @@ class Comment(models.Model):
         ordering = ['-created']
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
+        indexes = [
+            models.Index(fields=['post', '-created', '-id'],
+                         name='comment_post_created'),
+        ]
 
     def __str__(self):
         return f'{self.author.username} {self.text[:15]}'
 
 
 class Follow(models.Model):
+    # Индекс по user покрывает уникальное ограничение unique_follow
     user = models.ForeignKey(User, on_delete=models.CASCADE,
-                             related_name='follower')
+                             related_name='follower', db_index=False)
     author = models.ForeignKey(User, on_delete=models.CASCADE,
                                related_name='following')
 
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'author'],
+                                    name='unique_follow'),
+        ]
 
     def __str__(self):
         return f'{self.user} -> {self.author}'
+
+
+class UserCounters(models.Model):
+    """Счётчики пользователя, которые иначе пришлось бы считать COUNT(*).
+
+    Поддерживаются сигналами из posts.signals, расхождения исправляет
+    команда manage.py repair_counters.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+                                primary_key=True, related_name='counters')
+    followers_count = models.PositiveIntegerField(
+        default=0, verbose_name='Подписчиков'
+    )
+    following_count = models.PositiveIntegerField(
+        default=0, verbose_name='Подписок'
+    )
+    posts_count = models.PositiveIntegerField(default=0,
+                                              verbose_name='Записей')
+    updated = models.DateTimeField(auto_now=True,
+                                   verbose_name='Дата изменения')
+
+    class Meta:
+        verbose_name = 'Счётчики пользователя'
+        verbose_name_plural = 'Счётчики пользователей'
+
+    def __str__(self):
+        return f'{self.user}: {self.followers_count}/' \
+               f'{self.following_count}/{self.posts_count}'
+
+
+class TimelineEntry(models.Model):
+    """Запись материализованной ленты подписок пользователя.
+
+    Заполняется при публикации поста (fan-out on write) и при подписке,
+    см. posts.timeline.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='timeline')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             related_name='timeline_entries')
+    author = models.ForeignKey(User, on_delete=models.CASCADE,
+                               related_name='+')
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        unique_together = ('user', 'post')
+        # Страница ленты читается диапазоном по первому индексу
+        # в порядке (-pub_date, -post_id) без сортировки
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='timeline_user_pub_date'),
+            models.Index(fields=['user', 'author'],
+                         name='timeline_user_author'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} <- {self.post_id}'
+
+
+class TimelinePull(models.Model):
+    """Автор, чьи посты не раскладывались по лентам подписчиков.
+
+    Посты такого автора подмешиваются в ленту при чтении, даже когда
+    подписчиков у него стало меньше порога, см. posts.timeline.
+    """
+    author = models.OneToOneField(User, on_delete=models.CASCADE,
+                                  primary_key=True,
+                                  related_name='timeline_pull')
+
+    class Meta:
+        verbose_name = 'Автор без раскладки'
+        verbose_name_plural = 'Авторы без раскладки'
+
+    def __str__(self):
+        return str(self.author)
+
+
+class MediaFile(models.Model):
+    """Файл в хранилище по хешу и число постов, которые на него ссылаются.
+
+    Файл удаляется, когда на него не остаётся ссылок, см. posts.media.
+    """
+    name = models.CharField(max_length=255, unique=True,
+                            verbose_name='Имя файла')
+    size = models.PositiveIntegerField(default=0, verbose_name='Размер')
+    refs = models.PositiveIntegerField(default=0, verbose_name='Ссылок')
+    created = models.DateTimeField(auto_now_add=True,
+                                   verbose_name='Дата загрузки')
+
+    class Meta:
+        verbose_name = 'Медиафайл'
+        verbose_name_plural = 'Медиафайлы'
+
+    def __str__(self):
+        return f'{self.name} ({self.refs})'
@@ -0,0 +1,292 @@
+"""Кэш целых страниц лент для анонимных посетителей.
+
+Ключ строится из пути и параметров page/cursor. Вместе со страницей
+хранятся поколения областей, от которых она зависит ('feed' и, например,
+'user:<username>'). События (новый пост, правка, комментарий, подписка)
+увеличивают поколение, и записи с устаревшим поколением считаются
+протухшими. Протухшую запись пересчитывает один запрос, взявший
+блокировку, а остальные в это время получают старую копию, поэтому
+истечение популярного ключа не вызывает лавину одинаковых запросов.
+
+Если старой копии нет (страницу ещё не кэшировали), одинаковые
+запросы склеиваются (single flight): в процессе страницу считает
+первый запрос, а остальные ждут его и получают копию ответа
+с X-Page-Cache: coalesced. По умолчанию склейка включена вместе
+с кэшем, но её можно включить и без него.
+Между процессами запрос, не взявший блокировку, может подождать
+готовую страницу в кэше (POSTS_PAGE_COALESCE_WAIT). Сколько запросов
+склеено, видно в stats() и manage.py page_cache_stats (счётчики
+уходят в кэш пачками, см. posts.stats).
+
+Настройки:
+    POSTS_PAGE_CACHE_TIMEOUT - время жизни страницы в секундах,
+        0 выключает кэш (по умолчанию);
+    POSTS_PAGE_CACHE_GRACE - сколько ещё секунд хранить протухшую
+        копию для раздачи во время пересчёта;
+    POSTS_PAGE_CACHE_ALIAS - алиас кэша из CACHES;
+    POSTS_PAGE_COALESCE - склеивать одинаковые запросы в процессе
+        (по умолчанию - если включён кэш);
+    POSTS_PAGE_COALESCE_WAIT - сколько секунд ждать страницу, которую
+        считает другой процесс, 0 - не ждать (по умолчанию).
+"""
+import hashlib
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+from .stats import SharedCounters
+
+
+KEY_PREFIX = 'page_cache'
+LOCK_TIMEOUT = 30
+CACHED_PARAMS = ('page', 'cursor')
+POLL_INTERVAL = 0.05
+# computed - посчитано, coalesced - склеено в процессе,
+# coalesced_remote - дождались страницу другого процесса
+STATS = ('computed', 'coalesced', 'coalesced_remote')
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def timeout():
+    return getattr(settings, 'POSTS_PAGE_CACHE_TIMEOUT', 0)
+
+
+def is_enabled():
+    return bool(timeout())
+
+
+def is_coalescing():
+    return getattr(settings, 'POSTS_PAGE_COALESCE', is_enabled())
+
+
+def coalesce_wait():
+    return getattr(settings, 'POSTS_PAGE_COALESCE_WAIT', 0)
+
+
+def get_cache():
+    return caches[getattr(settings, 'POSTS_PAGE_CACHE_ALIAS', 'default')]
+
+
+_stats = SharedCounters(KEY_PREFIX, STATS, get_cache)
+
+
+def record(name):
+    """Увеличивает счётчик склейки, общий для всех процессов."""
+    _stats.record(name)
+
+
+def stats():
+    return _stats.values()
+
+
+def reset_stats():
+    _stats.reset()
+
+
+def _generation_key(scope):
+    return f'{KEY_PREFIX}:gen:{scope}'
+
+
+def generation(scope):
+    cache = get_cache()
+    key = _generation_key(scope)
+    value = cache.get(key)
+    if value is None:
+        # Начинаем со времени, чтобы после потери ключа не вернуться
+        # к поколению, под которым уже лежат старые страницы.
+        cache.add(key, int(time.time() * 1000), None)
+        value = cache.get(key)
+    return value
+
+
+def invalidate(*scopes):
+    """Сбрасывает все страницы, зависящие от указанных областей.
+
+    Внутри транзакции поколения увеличиваются ещё раз после коммита:
+    запрос из другого соединения, посчитавший страницу по данным до
+    коммита, сохранил её уже под новым поколением.
+    """
+    if not is_enabled():
+        return
+    _bump(scopes)
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: _bump(scopes))
+
+
+def _bump(scopes):
+    cache = get_cache()
+    for scope in scopes:
+        key = _generation_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, int(time.time() * 1000), None)
+
+
+def page_key(request):
+    params = '&'.join(f'{name}={request.GET.get(name, "")}'
+                      for name in CACHED_PARAMS)
+    digest = hashlib.md5(f'{request.path}?{params}'.encode()).hexdigest()
+    return f'{KEY_PREFIX}:page:{digest}'
+
+
+def _is_cacheable(response):
+    return (response.status_code == 200
+            and not response.streaming
+            and not response.cookies
+            and 'private' not in response.get('Cache-Control', ''))
+
+
+def _to_entry(response, generations):
+    return {
+        'generations': generations,
+        'expires': time.time() + timeout(),
+        'status': response.status_code,
+        'headers': list(response.items()),
+        'content': response.content,
+    }
+
+
+def _from_entry(entry, state):
+    response = HttpResponse(entry['content'], status=entry['status'])
+    for header, value in entry['headers']:
+        response[header] = value
+    response['X-Page-Cache'] = state
+    return response
+
+
+def _answer(request, response):
+    """Отвечает 304 на условный GET по ETag и Last-Modified копии.
+
+    Валидаторы сохраняются вместе со страницей (их ставит
+    feed_condition), поэтому копия из кэша проверяется без запросов
+    к базе.
+    """
+    modified = response.get('Last-Modified')
+    return get_conditional_response(
+        request, etag=response.get('ETag'),
+        last_modified=modified and parse_http_date_safe(modified),
+        response=response,
+    )
+
+
+def _counted(response):
+    record('computed')
+    return response
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+
+
+def single_flight(key, compute):
+    """Вызывает compute() один раз на все одновременные вызовы с key.
+
+    Первый вызов считает ответ, остальные ждут его и получают копию.
+    Если ответ нельзя раздавать (ошибка, не 200), ждавшие считают
+    его сами.
+    """
+    if not is_coalescing():
+        return compute()
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+    if not leader:
+        flight.done.wait(LOCK_TIMEOUT)
+        if flight.entry is None:
+            return compute()
+        record('coalesced')
+        return _from_entry(flight.entry, 'coalesced')
+    try:
+        response = compute()
+        if _is_cacheable(response):
+            flight.entry = _to_entry(response, None)
+        return response
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+
+
+def _wait_for_entry(cache, key, generations):
+    """Ждёт страницу, которую считает другой процесс."""
+    deadline = time.monotonic() + coalesce_wait()
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None and entry['generations'] == generations:
+            return entry
+    return None
+
+
+def cache_anonymous_page(*scopes):
+    """Кэширует GET-ответы view для анонимных посетителей.
+
+    scopes - области, от которых зависит страница, помимо общей 'feed'.
+    Строки форматируются аргументами view: 'user:{username}'.
+    Декоратор ставится снаружи feed_condition: попадание в кэш
+    отвечает, не вычисляя валидатор страницы.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (not (is_enabled() or is_coalescing())
+                    or request.method not in ('GET', 'HEAD')
+                    or request.user.is_authenticated):
+                return view(request, *args, **kwargs)
+
+            key = page_key(request)
+            if not is_enabled():
+                return _answer(request, single_flight(
+                    key, lambda: _counted(view(request, *args, **kwargs))
+                ))
+
+            cache = get_cache()
+            generations = [generation('feed')] + [
+                generation(scope.format(**kwargs)) for scope in scopes
+            ]
+            entry = cache.get(key)
+            if (entry is not None
+                    and entry['generations'] == generations
+                    and entry['expires'] > time.time()):
+                return _answer(request, _from_entry(entry, 'hit'))
+
+            def compute():
+                lock = f'{key}:lock'
+                locked = cache.add(lock, 1, LOCK_TIMEOUT)
+                if entry is not None and not locked:
+                    return _from_entry(entry, 'stale')
+                if not locked and coalesce_wait():
+                    ready = _wait_for_entry(cache, key, generations)
+                    if ready is not None:
+                        record('coalesced_remote')
+                        return _from_entry(ready, 'coalesced')
+                try:
+                    response = _counted(view(request, *args, **kwargs))
+                    if _is_cacheable(response):
+                        grace = getattr(settings, 'POSTS_PAGE_CACHE_GRACE',
+                                        60)
+                        cache.set(key, _to_entry(response, generations),
+                                  timeout() + grace)
+                        response['X-Page-Cache'] = 'miss'
+                    return response
+                finally:
+                    if locked:
+                        cache.delete(lock)
+
+            return _answer(request, single_flight(key, compute))
+        return wrapper
+    return decorator
@@ -0,0 +1,164 @@
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from django.utils.encoding import force_str
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+
+CURSOR_SEPARATOR = '|'
+
+
+class InvalidCursor(InvalidPage):
+    pass
+
+
+class CursorPage:
+    """Страница ленты, полученная по курсору.
+
+    Повторяет интерфейс django.core.paginator.Page в той мере, в какой
+    он нужен шаблонам: итерация, индексация, has_next/has_previous.
+    """
+
+    is_cursor = True
+
+    def __init__(self, object_list, paginator, cursor, has_next,
+                 has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.cursor = cursor or ''
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f'<Cursor page {self.cursor!r}>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if not self._has_next or not self.object_list:
+            return None
+        return self.paginator.encode_cursor(self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous or not self.object_list:
+            return None
+        return self.paginator.encode_cursor(self.object_list[0],
+                                            reverse=True)
+
+
+class CursorPaginator:
+    """Паджинатор по ключу (keyset) без COUNT(*) и OFFSET.
+
+    Записи упорядочиваются по полям ordering (по умолчанию
+    -pub_date, -id), а курсор хранит значения этих полей у крайней
+    записи страницы. Следующая страница выбирается условием
+    "строго после курсора", поэтому стоимость запроса не зависит
+    от глубины пролистывания.
+    """
+
+    is_cursor = True
+
+    def __init__(self, object_list, per_page, ordering=('-pub_date', '-id')):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+
+    def _value(self, obj, field):
+        if isinstance(obj, dict):
+            return obj[field]
+        return getattr(obj, field)
+
+    def encode_cursor(self, obj, reverse=False):
+        values = []
+        for field in self.fields:
+            value = self._value(obj, field)
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            values.append(force_str(value))
+        raw = ('p' if reverse else 'n') + CURSOR_SEPARATOR.join(values)
+        return urlsafe_base64_encode(raw.encode())
+
+    def decode_cursor(self, cursor):
+        """Возвращает (reverse, values) или бросает InvalidCursor."""
+        try:
+            raw = force_str(urlsafe_base64_decode(cursor))
+        except (ValueError, UnicodeDecodeError):
+            raise InvalidCursor('Некорректный курсор')
+        direction, raw = raw[:1], raw[1:]
+        parts = raw.split(CURSOR_SEPARATOR)
+        if direction not in ('n', 'p') or len(parts) != len(self.fields):
+            raise InvalidCursor('Некорректный курсор')
+        opts = self.object_list.model._meta
+        try:
+            values = [opts.get_field(field).to_python(part)
+                      for field, part in zip(self.fields, parts)]
+        except Exception:
+            raise InvalidCursor('Некорректный курсор')
+        if any(value is None for value in values):
+            raise InvalidCursor('Некорректный курсор')
+        return direction == 'p', values
+
+    def _keyset_filter(self, values, reverse):
+        """Условие "строго после курсора" в порядке ordering.
+
+        Для ordering (-a, -b) и курсора (x, y) это
+        a < x OR (a = x AND b < y).
+        """
+        condition = Q()
+        for position, name in enumerate(self.ordering):
+            field = self.fields[position]
+            descending = name.startswith('-') != reverse
+            lookup = f'{field}__lt' if descending else f'{field}__gt'
+            term = Q(**{lookup: values[position]})
+            for prev_field, prev_value in zip(self.fields[:position],
+                                              values[:position]):
+                term &= Q(**{prev_field: prev_value})
+            condition |= term
+        return condition
+
+    def page(self, cursor):
+        """Возвращает страницу, начинающуюся сразу после курсора."""
+        queryset = self.object_list
+        reverse = False
+        if cursor:
+            reverse, values = self.decode_cursor(cursor)
+            queryset = queryset.filter(self._keyset_filter(values, reverse))
+        if reverse:
+            ordering = [name[1:] if name.startswith('-') else f'-{name}'
+                        for name in self.ordering]
+        else:
+            ordering = self.ordering
+        rows = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+            return CursorPage(rows, self, cursor, has_next=True,
+                              has_previous=has_more)
+        return CursorPage(rows, self, cursor, has_next=has_more,
+                          has_previous=bool(cursor))
+
+    def get_page(self, cursor):
+        """Как page(), но при некорректном курсоре отдаёт первую страницу."""
+        try:
+            return self.page(cursor)
+        except InvalidCursor:
+            return self.page(None)
@@ -0,0 +1,117 @@
+"""Чтение лент с реплик базы данных.
+
+Страницы, которые только читают (ленты, профиль, пост), помечаются
+декоратором read_replica: пока такая страница выполняется,
+ReadReplicaRouter отправляет чтение моделей из REPLICA_APPS на одну
+из реплик. Всё остальное, в том числе сессии и запись, идёт
+в основную базу. Пишущие страницы этим декоратором не помечаются.
+
+Реплики отстают, поэтому после записи пользователь какое-то время
+читает из основной базы: декоратор pin_primary на пишущих страницах
+ставит короткоживущую cookie, и пока она жива, read_replica реплики
+не включает. Так автор сразу видит свой новый пост или комментарий.
+
+Подключение:
+    DATABASE_ROUTERS = ['posts.replicas.ReadReplicaRouter']
+
+Настройки:
+    POSTS_READ_REPLICAS - алиасы реплик из DATABASES, пустой список
+        (по умолчанию) выключает чтение с реплик;
+    POSTS_REPLICA_PIN_SECONDS - сколько секунд после записи читать
+        из основной базы.
+"""
+import random
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+PIN_COOKIE = 'primary_pin'
+PIN_SECONDS = 5
+REPLICA_APPS = {'posts', 'auth'}
+
+_local = threading.local()
+
+
+def replicas():
+    return list(getattr(settings, 'POSTS_READ_REPLICAS', []))
+
+
+def pin_seconds():
+    return getattr(settings, 'POSTS_REPLICA_PIN_SECONDS', PIN_SECONDS)
+
+
+def is_pinned(request):
+    return PIN_COOKIE in request.COOKIES
+
+
+def current_replica():
+    """Реплика для чтения в текущем потоке или None."""
+    return getattr(_local, 'replica', None)
+
+
+@contextmanager
+def reading_from(alias):
+    """Читает с реплики alias внутри блока (None - из основной базы)."""
+    previous = current_replica()
+    _local.replica = alias
+    try:
+        yield
+    finally:
+        _local.replica = previous
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replica = current_replica()
+        if replica is None or model._meta.app_label not in REPLICA_APPS:
+            return None
+        return replica
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        allowed = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in allowed and obj2._state.db in allowed:
+            return True
+        return None
+
+
+def read_replica(view):
+    """Читает модели лент с реплики, если пользователь не закреплён
+    за основной базой после недавней записи."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        aliases = replicas()
+        if not aliases or is_pinned(request):
+            return view(request, *args, **kwargs)
+        # Пользователя из сессии достаём из основной базы: только что
+        # зарегистрированного реплика может ещё не знать
+        if hasattr(request, 'user'):
+            request.user.is_authenticated
+        with reading_from(random.choice(aliases)):
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+def pin_primary(view):
+    """Закрепляет пользователя за основной базой после записи.
+
+    Страница могла что-то записать, если это POST или ответ -
+    перенаправление (подписка и отписка в Yatube делаются GET).
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        wrote = request.method == 'POST' or response.status_code in (
+            301, 302, 303, 307, 308
+        )
+        if wrote and replicas():
+            response.set_cookie(PIN_COOKIE, '1', max_age=pin_seconds(),
+                                httponly=True, samesite='Lax')
+        return response
+    return wrapper
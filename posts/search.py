@@ -0,0 +1,233 @@
+"""Полнотекстовый поиск по постам и комментариям.
+
+Тексты постов и комментариев лежат в отдельной таблице-индексе
+posts_search_index: в SQLite это виртуальная таблица FTS5, в PostgreSQL -
+таблица с колонкой tsvector и GIN-индексом. Таблицу создаёт миграция
+0017_search_index, обновляют сигналы при сохранении и удалении,
+а перестраивает целиком manage.py search_reindex. Если индекса нет
+(другая СУБД или SQLite без FTS5), поиск откатывается к icontains.
+
+Строка индекса идентифицируется rowid = id * 2 для поста и
+id * 2 + 1 для комментария, поэтому обновление и удаление идут по
+первичному ключу, а не перебором таблицы.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from .models import Comment, Post
+
+
+TABLE = 'posts_search_index'
+BATCH_SIZE = 1000
+
+
+def document_id(obj):
+    return obj.pk * 2 + (1 if isinstance(obj, Comment) else 0)
+
+
+def document_post_id(obj):
+    return obj.post_id if isinstance(obj, Comment) else obj.pk
+
+
+class SearchResults:
+    """Ленивый список найденных постов для Paginator."""
+
+    def __init__(self, backend, query):
+        self.backend = backend
+        self.query = query
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = self.backend.count(self.query)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        offset = key.start or 0
+        limit = (key.stop - offset) if key.stop is not None else None
+        ids = self.backend.ranked_ids(self.query, offset, limit)
+        posts = Post.objects.for_feed().in_bulk(ids)
+        return [posts[pk] for pk in ids if pk in posts]
+
+
+class FallbackBackend:
+    """Поиск без индекса: icontains по постам и комментариям."""
+
+    name = 'icontains'
+
+    def posts(self, query):
+        return Post.objects.filter(
+            Q(text__icontains=query) | Q(comments__text__icontains=query)
+        ).distinct().order_by('-pub_date', '-id')
+
+    def count(self, query):
+        return self.posts(query).count()
+
+    def ranked_ids(self, query, offset, limit):
+        ids = self.posts(query).values_list('pk', flat=True)
+        stop = offset + limit if limit is not None else None
+        return list(ids[offset:stop])
+
+    def update(self, objects):
+        pass
+
+    def remove(self, objects):
+        pass
+
+    def clear(self):
+        pass
+
+
+class IndexBackend:
+    """Общая часть бэкендов с таблицей-индексом."""
+
+    def _execute(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall() if cursor.description else None
+
+    def remove(self, objects):
+        ids = [(document_id(obj),) for obj in objects]
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {TABLE} WHERE rowid = %s', ids)
+
+    def clear(self):
+        self._execute(f'DELETE FROM {TABLE}')
+
+    def count(self, query):
+        match = self.prepare(query)
+        if not match:
+            return 0
+        return self._execute(self.count_sql, self.params(match))[0][0]
+
+    def ranked_ids(self, query, offset, limit):
+        match = self.prepare(query)
+        if not match:
+            return []
+        limit = -1 if limit is None else limit
+        rows = self._execute(self.search_sql,
+                             self.params(match) + [limit, offset])
+        return [row[0] for row in rows]
+
+
+class SqliteBackend(IndexBackend):
+    name = 'fts5'
+    count_sql = (f'SELECT COUNT(DISTINCT post_id) FROM {TABLE} '
+                 f'WHERE {TABLE} MATCH %s')
+    # rank в FTS5 - это bm25, чем меньше, тем релевантнее
+    search_sql = (f'SELECT post_id, MIN(rank) AS score FROM {TABLE} '
+                  f'WHERE {TABLE} MATCH %s GROUP BY post_id '
+                  f'ORDER BY score, post_id DESC LIMIT %s OFFSET %s')
+
+    def prepare(self, query):
+        words = re.findall(r'\w+', query)
+        return ' '.join('"{}"*'.format(word) for word in words)
+
+    def params(self, match):
+        return [match]
+
+    def update(self, objects):
+        rows = [(document_id(obj), obj.text, document_post_id(obj))
+                for obj in objects]
+        self.remove(objects)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {TABLE} (rowid, text, post_id) '
+                f'VALUES (%s, %s, %s)', rows
+            )
+
+
+class PostgresBackend(IndexBackend):
+    name = 'tsvector'
+    count_sql = (f'SELECT COUNT(DISTINCT post_id) FROM {TABLE}, '
+                 f'plainto_tsquery(%s, %s) query WHERE document @@ query')
+    search_sql = (f'SELECT post_id, MAX(ts_rank(document, query)) AS score '
+                  f'FROM {TABLE}, plainto_tsquery(%s, %s) query '
+                  f'WHERE document @@ query GROUP BY post_id '
+                  f'ORDER BY score DESC, post_id DESC LIMIT %s OFFSET %s')
+
+    @property
+    def config(self):
+        return getattr(settings, 'POSTS_SEARCH_CONFIG', 'russian')
+
+    def prepare(self, query):
+        return query.strip()
+
+    def params(self, match):
+        return [self.config, match]
+
+    def update(self, objects):
+        rows = [(document_id(obj), document_post_id(obj), self.config,
+                 obj.text) for obj in objects]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {TABLE} (rowid, post_id, document) '
+                f'VALUES (%s, %s, to_tsvector(%s, %s)) '
+                f'ON CONFLICT (rowid) DO UPDATE '
+                f'SET post_id = EXCLUDED.post_id, '
+                f'document = EXCLUDED.document', rows
+            )
+
+
+BACKENDS = {
+    'sqlite': SqliteBackend,
+    'postgresql': PostgresBackend,
+}
+
+
+_has_index = {}
+
+
+def has_index():
+    """Есть ли таблица-индекс в текущей базе. Проверяется один раз."""
+    key = (connection.vendor, connection.settings_dict['NAME'])
+    if key not in _has_index:
+        _has_index[key] = TABLE in connection.introspection.table_names()
+    return _has_index[key]
+
+
+def get_backend():
+    backend = BACKENDS.get(connection.vendor)
+    if backend is None or not has_index():
+        return FallbackBackend()
+    return backend()
+
+
+def search(query):
+    return SearchResults(get_backend(), query)
+
+
+def update(objects):
+    get_backend().update(objects)
+
+
+def remove(objects):
+    get_backend().remove(objects)
+
+
+def reindex():
+    """Перестраивает индекс целиком. Возвращает число документов."""
+    backend = get_backend()
+    backend.clear()
+    total = 0
+    querysets = (Post.objects.only('pk', 'text'),
+                 Comment.objects.only('pk', 'text', 'post_id'))
+    for queryset in querysets:
+        batch = []
+        for obj in queryset.iterator():
+            batch.append(obj)
+            if len(batch) == BATCH_SIZE:
+                backend.update(batch)
+                total += len(batch)
+                batch = []
+        backend.update(batch)
+        total += len(batch)
+    return total
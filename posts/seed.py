@@ -0,0 +1,400 @@
+"""Быстрое создание синтетических данных для manage.py seed.
+
+Первичные ключи пользователей, групп, постов и комментариев
+назначаются заранее, начиная с максимального id в таблице. Поэтому
+комментарии и подписки ссылаются на посты и пользователей без
+перечитывания базы, а результат для одного и того же random_seed
+одинаков при любом числе процессов: каждая порция строк генерируется
+своим Random от (random_seed, вид, номер порции).
+
+Пользователи и группы создаются через bulk_create. Постов, комментариев
+и подписок миллионы, и там большую часть времени bulk_create тратит на
+подготовку каждого значения компилятором запросов, поэтому эти порции
+собираются сразу кортежами и вставляются одним executemany на порцию
+(как в posts.search). Порции могут собирать дочерние процессы, а пишет
+в базу только основной: SQLite всё равно не пускает двух писателей.
+
+Распределения:
+    подписчики - степенной закон: немногие авторы собирают
+        большинство подписок, число подписок пользователя
+        экспоненциальное;
+    посты - активность авторов тоже степенная, а время публикации
+        собрано во всплески: посты идут сериями с интервалом в минуты,
+        между сериями - часы и дни; id постов растут вместе с датой;
+    комментарии - чаще к свежим постам, через минуты-часы после
+        публикации;
+    группы - несколько популярных, часть постов без группы.
+
+Вставка не вызывает сигналы, поэтому finish() пересчитывает счётчики,
+поисковый индекс и ленты подписок.
+"""
+import multiprocessing
+import random
+import time
+from array import array
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.utils import timezone
+
+from . import existence, page_cache, search, timeline
+from .models import Comment, Follow, Group, Post, User, UserCounters
+
+
+CHUNK_SIZE = 10000
+TEXTS = 4096
+# Отрицательное значение cache_size в SQLite - килобайты
+SQLITE_CACHE_KB = -256 * 1024
+POST_FIELDS = ('id', 'text', 'pub_date', 'updated', 'author', 'group',
+               'image', 'thumbnail_url', 'renditions', 'comment_count',
+               'card_version')
+COMMENT_FIELDS = ('id', 'post', 'author', 'text', 'created')
+FOLLOW_FIELDS = ('user', 'author')
+# Чем больше показатель, тем сильнее перекос к первым элементам
+AUTHOR_SKEW = 3
+ACTIVITY_SKEW = 2
+GROUP_SKEW = 2
+COMMENT_SKEW = 4
+NO_GROUP_SHARE = 0.3
+BURST_SIZE = 8
+BURST_GAP_MINUTES = 10
+COMMENT_DELAY_HOURS = 6
+WORDS = ('лента', 'пост', 'картинка', 'подписка', 'группа', 'комментарий',
+         'автор', 'текст', 'страница', 'кэш', 'запрос', 'индекс', 'день',
+         'город', 'книга', 'фото', 'новость', 'вечер', 'утро', 'дорога')
+
+
+def skewed(rng, size, skew=1):
+    """Индекс от 0 до size - 1 со степенным перекосом к началу.
+
+    skew=1 - равномерно; быстрее rng.randrange и rng.choice.
+    """
+    return int(size * rng.random() ** skew)
+
+
+def text(rng, low, high):
+    return ' '.join(rng.choices(WORDS, k=rng.randint(low, high)))
+
+
+def insert_rows(model, fields, rows):
+    """Вставляет кортежи значений полей fields одним executemany."""
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(name).column)
+                        for name in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {quote(model._meta.db_table)} ({columns}) '
+            f'VALUES ({placeholders})', rows
+        )
+
+
+class Plan:
+    """Что и с какими id создавать; порции генерируются независимо."""
+
+    def __init__(self, users, groups, posts, comments, follows,
+                 random_seed=0, days=365, prefix='seed', end=None):
+        self.users, self.groups = users, groups
+        self.posts, self.comments, self.follows = posts, comments, follows
+        self.random_seed = random_seed
+        self.prefix = prefix
+        self.end = end or timezone.now()
+        self.start = self.end - timedelta(days=days)
+        # В SQLite Django хранит наивное время в UTC строкой; формировать
+        # её напрямую заметно быстрее, чем adapt_datetimefield_value.
+        self.naive_start = None
+        if connection.vendor == 'sqlite':
+            self.naive_start = (timezone.make_naive(self.start, timezone.utc)
+                                if settings.USE_TZ else self.start)
+        self.user_base = self._next_id(User)
+        self.group_base = self._next_id(Group)
+        self.post_base = self._next_id(Post)
+        self.comment_base = self._next_id(Comment)
+        self.span = days * 86400
+        self.post_times = self._post_times(self.span)
+        rng = self.rng('texts', 0)
+        self.post_texts = [text(rng, 5, 60) for _ in range(TEXTS)]
+        self.comment_texts = [text(rng, 3, 25) for _ in range(TEXTS)]
+
+    @staticmethod
+    def _next_id(model):
+        return (model.objects.aggregate(top=Max('pk'))['top'] or 0) + 1
+
+    def rng(self, kind, number):
+        return random.Random(f'{self.random_seed}:{kind}:{number}')
+
+    def _post_times(self, span):
+        """Секунды от начала периода для каждого поста, по возрастанию."""
+        rng = self.rng('times', 0)
+        bursts = max(1, self.posts // BURST_SIZE)
+        gap = BURST_GAP_MINUTES * 60
+        latest = max(0, span - gap * BURST_SIZE)
+        starts = [rng.random() * latest for _ in range(bursts)]
+        return array('d', sorted(
+            min(span, rng.choice(starts) + rng.expovariate(1 / gap))
+            for _ in range(self.posts)
+        ))
+
+    def date(self, seconds):
+        if self.naive_start is not None:
+            return str(self.naive_start + timedelta(seconds=seconds))
+        return self.start + timedelta(seconds=seconds)
+
+    def chunks(self, total):
+        return range((total + CHUNK_SIZE - 1) // CHUNK_SIZE)
+
+    def tasks(self):
+        """Задачи по фазам: посты ссылаются на пользователей и группы,
+        комментарии и подписки - на посты и пользователей."""
+        # Подписки раздаются порциями по пользователям
+        follow_chunks = self.chunks(self.users) if self.follows else ()
+        return [
+            [('users', number) for number in self.chunks(self.users)]
+            + [('groups', 0)],
+            [('posts', number) for number in self.chunks(self.posts)],
+            [('comments', number) for number in self.chunks(self.comments)]
+            + [('follows', number) for number in follow_chunks],
+        ]
+
+    def build(self, kind, number):
+        """(модель, поля, строки) порции; поля None - строки это модели."""
+        return getattr(self, f'build_{kind}')(number)
+
+    def _range(self, total, number):
+        return range(number * CHUNK_SIZE,
+                     min(total, (number + 1) * CHUNK_SIZE))
+
+    def build_users(self, number):
+        return User, None, [
+            User(id=self.user_base + index,
+                 username=f'{self.prefix}_{self.random_seed}_{index}',
+                 password='!', date_joined=self.start)
+            for index in self._range(self.users, number)
+        ]
+
+    def build_groups(self, number):
+        rng = self.rng('groups', number)
+        return Group, None, [
+            Group(id=self.group_base + index, title=f'Группа {index}',
+                  slug=f'{self.prefix}-{self.random_seed}-{index}',
+                  description=text(rng, 5, 20))
+            for index in range(self.groups)
+        ]
+
+    def build_posts(self, number):
+        rng = self.rng('posts', number)
+        # Самые активные авторы - не те, у кого больше всех подписчиков
+        activity = list(range(self.users))
+        self.rng('activity', 0).shuffle(activity)
+        rows = []
+        for index in self._range(self.posts, number):
+            group = None
+            if self.groups and rng.random() > NO_GROUP_SHARE:
+                group = self.group_base + skewed(rng, self.groups,
+                                                 GROUP_SKEW)
+            date = self.date(self.post_times[index])
+            author = activity[skewed(rng, self.users, ACTIVITY_SKEW)]
+            rows.append((self.post_base + index,
+                         self.post_texts[skewed(rng, TEXTS)],
+                         date, date, self.user_base + author, group,
+                         '', '', '', 0, 0))
+        return Post, POST_FIELDS, rows
+
+    def build_comments(self, number):
+        rng = self.rng('comments', number)
+        span = self.span
+        delay = COMMENT_DELAY_HOURS * 3600
+        rows = []
+        for index in self._range(self.comments, number):
+            post = self.posts - 1 - skewed(rng, self.posts, COMMENT_SKEW)
+            seconds = self.post_times[post] + rng.expovariate(1 / delay)
+            if seconds > span:
+                # Комментарий не может быть из будущего
+                seconds = span - rng.random() * (span - self.post_times[post])
+            rows.append((self.comment_base + index, self.post_base + post,
+                         self.user_base + skewed(rng, self.users),
+                         self.comment_texts[skewed(rng, TEXTS)],
+                         self.date(seconds)))
+        return Comment, COMMENT_FIELDS, rows
+
+    def build_follows(self, number):
+        rng = self.rng('follows', number)
+        mean = self.follows / self.users
+        rows = []
+        for user in self._range(self.users, number):
+            wanted = min(self.users - 1, int(rng.expovariate(1 / mean)))
+            authors = set()
+            for _ in range(wanted * 2):
+                if len(authors) == wanted:
+                    break
+                author = skewed(rng, self.users, AUTHOR_SKEW)
+                if author != user:
+                    authors.add(author)
+            rows.extend((self.user_base + user, self.user_base + author)
+                        for author in sorted(authors))
+        return Follow, FOLLOW_FIELDS, rows
+
+
+_plan = None
+
+
+@contextmanager
+def fast_sqlite():
+    """Большой кэш страниц и запись без fsync на время вставки в SQLite.
+
+    Внутри транзакции synchronous не меняется, и тогда ничего не делаем.
+    """
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        yield
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA cache_size')
+        cache_size = cursor.fetchone()[0]
+        cursor.execute('PRAGMA synchronous')
+        synchronous = cursor.fetchone()[0]
+        cursor.execute(f'PRAGMA cache_size = {SQLITE_CACHE_KB}')
+        cursor.execute('PRAGMA synchronous = OFF')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA cache_size = {int(cache_size)}')
+            cursor.execute(f'PRAGMA synchronous = {int(synchronous)}')
+
+
+def _build(task):
+    return _plan.build(*task)
+
+
+def _insert(model, fields, rows):
+    """Модели вставляются через bulk_create, кортежи - через executemany."""
+    with transaction.atomic():
+        if fields is None:
+            model.objects.bulk_create(rows)
+        else:
+            insert_rows(model, fields, rows)
+    return len(rows)
+
+
+def reset_sequences():
+    """Сдвигает последовательности id после вставки с явными id."""
+    statements = connection.ops.sequence_reset_sql(
+        no_style(), [User, Group, Post, Comment, Follow]
+    )
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def _counts(queryset, field):
+    return dict(queryset.order_by().values(field).annotate(
+        total=Count('pk')
+    ).values_list(field, 'total').iterator())
+
+
+def create_counters(plan):
+    """Создаёт счётчики новых пользователей сразу с итоговыми
+    значениями и пересчитывает комментарии новых постов.
+
+    Новые посты, комментарии и подписки касаются только новых
+    пользователей и постов, поэтому старые счётчики не трогаем.
+    """
+    base = plan.user_base
+    followers = _counts(Follow.objects.filter(author_id__gte=base),
+                        'author')
+    following = _counts(Follow.objects.filter(user_id__gte=base), 'user')
+    posts = _counts(Post.objects.filter(pk__gte=plan.post_base), 'author')
+    UserCounters.objects.bulk_create(
+        UserCounters(user_id=pk, followers_count=followers.get(pk, 0),
+                     following_count=following.get(pk, 0),
+                     posts_count=posts.get(pk, 0))
+        for pk in range(base, base + plan.users)
+    )
+    comments = Comment.objects.filter(
+        post=OuterRef('pk')
+    ).order_by().values('post').annotate(total=Count('pk')).values('total')
+    # Посты вставлены с comment_count=0, трогаем только прокомментированные
+    Post.objects.filter(pk__in=Comment.objects.filter(
+        post_id__gte=plan.post_base
+    ).values('post')).update(comment_count=Subquery(comments))
+
+
+def finish(plan):
+    """Проверяет внешние ключи и пересчитывает то, что обычно
+    поддерживают сигналы."""
+    connection.check_constraints(table_names=[
+        model._meta.db_table for model in (Post, Comment, Follow)
+    ])
+    create_counters(plan)
+    # Одна транзакция вместо фиксации каждой строки индекса
+    with transaction.atomic():
+        search.reindex()
+    if timeline.is_enabled():
+        timeline.rebuild()
+    page_cache.invalidate('feed')
+    existence.reset()
+
+
+def generate(users=1000, groups=20, posts=100000, comments=200000,
+             follows=20000, random_seed=0, processes=1, days=365,
+             prefix='seed', end=None, progress=None):
+    """Создаёт данные. Возвращает (план, {вид: строк}, секунд на вставку).
+
+    processes > 1 собирает порции в дочерних процессах (fork),
+    а вставляет их основной процесс. Даты отсчитываются назад от end
+    (по умолчанию - от текущего момента).
+    progress(kind, rows) вызывается после каждой порции.
+    """
+    global _plan
+    counts = {'groups': groups, 'posts': posts, 'comments': comments,
+              'follows': follows}
+    negative = [name for name, count in counts.items() if count < 0]
+    if negative:
+        raise ValueError('Количество не может быть отрицательным: '
+                         + ', '.join(negative) + '.')
+    if users < 2:
+        raise ValueError('Нужно хотя бы два пользователя.')
+    if comments and not posts:
+        raise ValueError('Комментариям нужны посты: без постов '
+                         'комментариев должно быть 0.')
+    if days < 1:
+        raise ValueError('Период должен быть не меньше дня.')
+    _plan = Plan(users, groups, posts, comments, follows,
+                 random_seed=random_seed, days=days, prefix=prefix, end=end)
+    names = User.objects.filter(
+        username__startswith=f'{prefix}_{random_seed}_'
+    )
+    if names.exists():
+        raise ValueError(f'Данные с префиксом {prefix}_{random_seed}_ '
+                         f'уже есть.')
+
+    created = {}
+    started = time.perf_counter()
+    pool = None
+    if processes > 1:
+        # Дочерние процессы только собирают строки и к базе
+        # не обращаются, поэтому соединение можно не закрывать.
+        pool = multiprocessing.get_context('fork').Pool(processes)
+    try:
+        with fast_sqlite(), connection.constraint_checks_disabled():
+            for phase in _plan.tasks():
+                # imap сохраняет порядок порций, поэтому вставка
+                # детерминирована
+                batches = (pool.imap(_build, phase) if pool
+                           else map(_build, phase))
+                for (kind, _), batch in zip(phase, batches):
+                    rows = _insert(*batch)
+                    created[kind] = created.get(kind, 0) + rows
+                    if progress:
+                        progress(kind, rows)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    elapsed = time.perf_counter() - started
+    reset_sequences()
+    return _plan, created, elapsed
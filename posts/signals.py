@@ -0,0 +1,135 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import (cards, counters, existence, follow_graph, media, page_cache,
+               search, thumbnails, timeline)
+from .models import Comment, Follow, Group, Post, User, UserCounters
+
+
+def invalidate_profiles(*user_ids):
+    if page_cache.is_enabled():
+        usernames = User.objects.filter(
+            pk__in=user_ids
+        ).values_list('username', flat=True)
+        page_cache.invalidate(*(f'user:{name}' for name in usernames))
+
+
+@receiver(post_save, sender=User)
+def create_user_counters(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserCounters.objects.get_or_create(user=instance)
+
+
+@receiver(pre_save, sender=User)
+def user_before_save(sender, instance, raw=False, update_fields=None,
+                     **kwargs):
+    if not raw:
+        cards.remember_fields(instance, ('username',), update_fields)
+
+
+@receiver(post_save, sender=User)
+def user_renamed(sender, instance, created, raw=False, **kwargs):
+    if not created and cards.fields_changed(instance):
+        cards.bump(Post.objects.filter(author=instance))
+        page_cache.invalidate('feed')
+
+
+@receiver(post_save, sender=User)
+def remember_username(sender, instance, created, raw=False,
+                      update_fields=None, **kwargs):
+    if created or update_fields is None or 'username' in update_fields:
+        existence.added('username', instance.username)
+
+
+@receiver(post_save, sender=Group)
+def remember_group_slug(sender, instance, created, raw=False,
+                        update_fields=None, **kwargs):
+    if created or update_fields is None or 'slug' in update_fields:
+        existence.added('group', instance.slug)
+
+
+@receiver(pre_save, sender=Group)
+def group_before_save(sender, instance, raw=False, update_fields=None,
+                      **kwargs):
+    if not raw:
+        cards.remember_fields(instance, ('title', 'slug'), update_fields)
+
+
+@receiver(post_save, sender=Group)
+def group_renamed(sender, instance, created, raw=False, **kwargs):
+    if not created and cards.fields_changed(instance):
+        cards.bump(Post.objects.filter(group=instance))
+        page_cache.invalidate('feed')
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.change_user_counter(instance.author_id,
+                                     'followers_count', 1)
+        counters.change_user_counter(instance.user_id, 'following_count', 1)
+        timeline.backfill(instance.user_id, instance.author_id)
+        follow_graph.changed([(instance.user_id, instance.author_id)],
+                             follow=True)
+        invalidate_profiles(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.change_user_counter(instance.author_id, 'followers_count', -1)
+    counters.change_user_counter(instance.user_id, 'following_count', -1)
+    timeline.prune(instance.user_id, instance.author_id)
+    follow_graph.changed([(instance.user_id, instance.author_id)],
+                         follow=False)
+    invalidate_profiles(instance.user_id, instance.author_id)
+
+
+@receiver(pre_save, sender=Post)
+def post_edited(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    thumbnails.remember_image(instance, update_fields)
+    cards.bump_on_save(instance, update_fields)
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    cards.reload_version(instance)
+    if created:
+        counters.change_user_counter(instance.author_id, 'posts_count', 1)
+        timeline.fan_out(instance)
+    if thumbnails.image_changed(instance):
+        media.release(thumbnails.old_image(instance))
+        media.acquire(instance.image.name)
+        thumbnails.schedule(instance)
+    search.update([instance])
+    page_cache.invalidate('feed')
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.change_user_counter(instance.author_id, 'posts_count', -1)
+    media.release(instance.image.name)
+    search.remove([instance])
+    page_cache.invalidate('feed')
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    search.update([instance])
+    if created:
+        counters.change_comment_count(instance.post_id, 1)
+        cards.bump_post(instance.post_id)
+        page_cache.invalidate('feed')
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.change_comment_count(instance.post_id, -1)
+    search.remove([instance])
+    cards.bump_post(instance.post_id)
+    page_cache.invalidate('feed')
@@ -0,0 +1,69 @@
+"""Счётчики событий, общие для всех процессов.
+
+Событие сначала считается в памяти процесса, а в кэш прибавляется
+пачкой: раз в FLUSH_EVENTS событий или не реже FLUSH_SECONDS секунд.
+Поэтому запрос страницы не обращается к общему кэшу ради счётчика,
+а команды manage.py *_stats видят все процессы с небольшой задержкой.
+"""
+import threading
+import time
+from collections import Counter
+
+
+FLUSH_EVENTS = 100
+FLUSH_SECONDS = 10
+
+
+class SharedCounters:
+    """Счётчики names в кэше get_cache() с ключами prefix:stats:<имя>."""
+
+    def __init__(self, prefix, names, get_cache):
+        self.prefix = prefix
+        self.names = names
+        self.get_cache = get_cache
+        self._pending = Counter()
+        self._events = 0
+        self._flushed = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _key(self, name):
+        return f'{self.prefix}:stats:{name}'
+
+    def _take(self):
+        with self._lock:
+            pending = dict(self._pending)
+            self._pending.clear()
+            self._events = 0
+            self._flushed = time.monotonic()
+        return pending
+
+    def _add(self, pending):
+        cache = self.get_cache()
+        for name, count in pending.items():
+            key = self._key(name)
+            try:
+                cache.incr(key, count)
+            except ValueError:
+                if not cache.add(key, count, None):
+                    cache.incr(key, count)
+
+    def record(self, name):
+        with self._lock:
+            self._pending[name] += 1
+            self._events += 1
+            if (self._events < FLUSH_EVENTS
+                    and time.monotonic() - self._flushed < FLUSH_SECONDS):
+                return
+        self._add(self._take())
+
+    def values(self):
+        """Счётчики всех процессов вместе с ещё не отправленными."""
+        self._add(self._take())
+        keys = {self._key(name): name for name in self.names}
+        found = self.get_cache().get_many(keys)
+        return {name: found.get(key, 0) for key, name in keys.items()}
+
+    def reset(self):
+        self._take()
+        self.get_cache().delete_many([self._key(name)
+                                      for name in self.names])
@@ -0,0 +1,54 @@
+"""Хранилище, которое называет файлы по хешу содержимого.
+
+Имя файла - sha256 содержимого, разложенный по подкаталогам:
+posts/ab/cd/abcd...ef.png. Одинаковые картинки, загруженные несколько
+раз, лежат на диске один раз; сколько постов ссылается на файл,
+хранит модель MediaFile (см. posts.media).
+"""
+import hashlib
+import os
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+HASHED_NAME = re.compile(
+    r'(^|/)[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})\.\w+$'
+)
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hashed_name(name, digest):
+    """posts/photo.JPG -> posts/ab/cd/abcd...ef.jpg"""
+    directory, filename = os.path.split(name)
+    extension = os.path.splitext(filename)[1].lower()
+    return os.path.join(directory, digest[:2], digest[2:4],
+                        digest + extension)
+
+
+def source_hash(name):
+    """Хеш содержимого из имени файла или None для старых имён."""
+    match = HASHED_NAME.search(name or '')
+    return match.group(2) if match else None
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = hashed_name(name, content_hash(content))
+        if self.exists(name):
+            # Такой файл уже есть: содержимое совпадает по определению
+            return name
+        return self._save(name, content)
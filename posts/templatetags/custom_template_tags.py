@@ -30,3 +30,14 @@ def set_var(parser, token):
             '"set" tag must be of the form: {% set <var_name> = <var_value> %}'
         )
     return SetVarNode(parts[1], parts[3])
+
+
+@register.filter
+def viewer_role(post, user):
+    """Кем зритель приходится посту: author, user или guest.
+
+    Входит в ключ кэша карточки: кнопки в ней зависят только от этого.
+    """
+    if not user.is_authenticated:
+        return 'guest'
+    return 'author' if user.pk == post.author_id else 'user'
@@ -0,0 +1,56 @@
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+
+class FollowUniqueMigrationTests(TransactionTestCase):
+    """0021_follow_unique удаляет дубликаты подписок и пересчитывает
+    счётчики затронутых пользователей."""
+
+    migrate_from = [('posts', '0020_media_file')]
+    migrate_to = [('posts', '0021_follow_unique')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def setUp(self):
+        latest = MigrationExecutor(connection).loader.graph.leaf_nodes()
+        self.addCleanup(self.migrate, latest)
+        apps = self.migrate(self.migrate_from)
+        User = apps.get_model('auth', 'User')
+        Follow = apps.get_model('posts', 'Follow')
+        UserCounters = apps.get_model('posts', 'UserCounters')
+        reader, author, other = (
+            User.objects.create(username=name)
+            for name in ('reader', 'author', 'other')
+        )
+        Follow.objects.bulk_create([
+            Follow(user=reader, author=author),
+            Follow(user=reader, author=author),
+            Follow(user=other, author=author),
+        ])
+        # Сигналы посчитали каждую подписку, включая дубликат
+        UserCounters.objects.bulk_create([
+            UserCounters(user=reader, following_count=2),
+            UserCounters(user=author, followers_count=3),
+            UserCounters(user=other, following_count=1),
+        ])
+        self.ids = {user.username: user.pk for user in (reader, author,
+                                                        other)}
+
+    def test_duplicates_removed_and_counters_recomputed(self):
+        apps = self.migrate(self.migrate_to)
+        Follow = apps.get_model('posts', 'Follow')
+        UserCounters = apps.get_model('posts', 'UserCounters')
+        self.assertEqual(Follow.objects.count(), 2)
+        counters = {
+            row.user_id: (row.followers_count, row.following_count)
+            for row in UserCounters.objects.all()
+        }
+        self.assertEqual(counters, {
+            self.ids['reader']: (0, 1),
+            self.ids['author']: (2, 0),
+            self.ids['other']: (0, 1),
+        })
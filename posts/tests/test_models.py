@@ -1,4 +1,10 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+
 from posts.lib.MyTestCase import MyTestCase
+from posts.models import Comment, Follow, Post, User, UserCounters
 
 
 class PostModelTest(MyTestCase):
@@ -95,3 +101,63 @@ class PostModelTest(MyTestCase):
             f'{PostModelTest.test_user.username} -> '
             f'{PostModelTest.test_author.username}'
         )
+
+
+class CountersTest(MyTestCase):
+    def counters(self, user):
+        return UserCounters.objects.get(user=user)
+
+    def test_counters_follow_writes(self):
+        """Подписка и отписка меняют счётчики обоих пользователей."""
+        self.assertEqual(self.counters(self.test_author).followers_count, 1)
+        Follow.objects.create(user=self.non_author, author=self.test_author)
+        self.assertEqual(self.counters(self.test_author).followers_count, 2)
+        self.assertEqual(self.counters(self.non_author).following_count, 1)
+
+        Follow.objects.filter(user=self.non_author).delete()
+        self.assertEqual(self.counters(self.test_author).followers_count, 1)
+        self.assertEqual(self.counters(self.non_author).following_count, 0)
+
+    def test_follow_pair_is_unique(self):
+        """Повторная подписка на того же автора не создаёт дубликат."""
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Follow.objects.create(user=self.test_user,
+                                  author=self.test_author)
+        self.assertEqual(self.counters(self.test_author).followers_count, 1)
+
+    def test_counters_posts_and_comments(self):
+        """Записи и комментарии учитываются, в том числе при каскаде."""
+        self.assertEqual(self.counters(self.test_user).posts_count, 1)
+        self.test_post.refresh_from_db()
+        self.assertEqual(self.test_post.comment_count, 1)
+
+        Comment.objects.create(post=self.test_post, author=self.test_author,
+                               text='Ещё комментарий')
+        self.test_post.refresh_from_db()
+        self.assertEqual(self.test_post.comment_count, 2)
+
+        Post.objects.filter(pk=self.test_post.pk).delete()
+        self.assertEqual(self.counters(self.test_user).posts_count, 0)
+
+    def test_counters_user_delete_cascade(self):
+        """Удаление пользователя уменьшает счётчики его подписок."""
+        User.objects.filter(pk=self.test_user.pk).delete()
+        self.assertEqual(self.counters(self.test_author).followers_count, 0)
+        self.assertFalse(
+            UserCounters.objects.filter(user_id=self.test_user.pk).exists()
+        )
+
+    def test_repair_counters_command(self):
+        """Команда repair_counters исправляет расхождения."""
+        UserCounters.objects.filter(user=self.test_author).update(
+            followers_count=42
+        )
+        UserCounters.objects.filter(user=self.non_author).delete()
+        Post.objects.filter(pk=self.test_post.pk).update(comment_count=7)
+
+        call_command('repair_counters', stdout=StringIO())
+
+        self.assertEqual(self.counters(self.test_author).followers_count, 1)
+        self.assertEqual(self.counters(self.non_author).posts_count, 0)
+        self.test_post.refresh_from_db()
+        self.assertEqual(self.test_post.comment_count, 1)
@@ -1,12 +1,39 @@
+import json
+import os
+import tempfile
+import threading
 import time
+from io import BytesIO, StringIO
+from unittest import mock
 
 from django import forms
+from django.conf import settings
+from django.contrib.sessions.models import Session
 from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import (OperationalError, connection, connections,
+                       transaction)
+from django.http import HttpResponse, JsonResponse
+from django.template.base import Template
+from django.test import (RequestFactory, TransactionTestCase,
+                         modify_settings, override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import dateformat, timezone
+from PIL import Image
 
+from posts import (benchmark, budgets, degrade, existence, explain,
+                   fanout, follow_graph, follows, media, page_cache,
+                   replicas, search, seed, thumbnails, timeline)
+from posts.constants import COMMENTS_PER_PAGE, POSTS_PER_PAGE
 from posts.lib.MyTestCase import MyTestCase
-from posts.models import Comment, Follow, Post
-from posts.views import POSTS_PER_PAGE
+from posts.models import (Comment, Follow, Group, MediaFile, Post,
+                          TimelineEntry, TimelinePull, User, UserCounters)
+from posts.storage import source_hash
 
 
 class PostsPagesTests(MyTestCase):
@@ -118,6 +145,859 @@ class PaginatorViewsTest(MyTestCase):
         self.assertEqual(len(response.context.get('page').object_list), 3)
 
 
+class FeedQueryCountTests(MyTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for i in range(12):
+            post = Post.objects.create(
+                group=cls.test_group,
+                text=f'Тестовый текст {i}',
+                author=cls.test_user,
+            )
+            Comment.objects.create(post=post, author=cls.test_author,
+                                   text=f'Комментарий {i}')
+        Follow.objects.create(user=cls.test_author, author=cls.test_user)
+
+    def count_queries(self, client, url, per_page):
+        with mock.patch('posts.views.POSTS_PER_PAGE', per_page):
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_feed_query_count_does_not_depend_on_page_size(self):
+        """Число запросов ленты не растёт вместе с размером страницы."""
+        urls = {
+            reverse('group', kwargs={'slug': 'test_group'}): self.guest_client,
+            reverse('profile', kwargs={'username': 'test_user'}):
+                self.guest_client,
+            reverse('follow_index'): self.author_client,
+        }
+        for url, client in urls.items():
+            with self.subTest(url=url):
+                # прогреваем кэш миниатюр sorl
+                self.count_queries(client, url, 13)
+                self.assertEqual(self.count_queries(client, url, 1),
+                                 self.count_queries(client, url, 13))
+
+
+class FeedExplainTests(MyTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        post = Post.objects.create(group=cls.test_group, text='Текст',
+                                   author=cls.test_user)
+        Comment.objects.create(post=post, author=cls.test_author,
+                               text='Комментарий')
+        Follow.objects.create(user=cls.test_author, author=cls.test_user)
+
+    def test_feed_queries_use_indexes(self):
+        """Запросы лент не читают таблицы целиком и не сортируют их."""
+        for name, plan, problems in explain.explain(
+                explain.feed_querysets()):
+            with self.subTest(feed=name):
+                self.assertEqual(problems, [], plan)
+
+    def test_foreign_keys_use_covering_indexes(self):
+        """Внешние ключи без своих индексов ищутся по составным."""
+        lookups = {
+            'post.author': Post.objects.filter(author=self.test_user),
+            'post.group': Post.objects.filter(group=self.test_group),
+            'comment.post': Comment.objects.filter(post=self.test_post),
+            'follow.user': Follow.objects.filter(user=self.test_user),
+        }
+        for name, queryset in lookups.items():
+            with self.subTest(foreign_key=name):
+                plan = queryset.order_by().explain()
+                self.assertEqual(explain.problems(plan), [], plan)
+
+    def test_problems_found_in_plan(self):
+        plan = 'SCAN posts_post\nUSE TEMP B-TREE FOR ORDER BY'
+        self.assertEqual(explain.problems(plan, 'sqlite'),
+                         ['полный просмотр таблицы posts_post',
+                          'сортировка без индекса'])
+        self.assertEqual(
+            explain.problems('SCAN posts_post USING INDEX x', 'sqlite'), []
+        )
+
+    def test_feed_explain_command(self):
+        out = StringIO()
+        call_command('feed_explain', '--fail', stdout=out)
+        self.assertIn('comments: ok', out.getvalue())
+
+
+class FeedBenchmarkTests(MyTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_benchmark_writes_json(self):
+        output = os.path.join(settings.MEDIA_ROOT, 'benchmark.json')
+        args = ['--current-db', '--seed', '--users', '5', '--posts', '20',
+                '--comments', '20', '--follows', '10', '--images', '1',
+                '--requests', '3', '--warmup', '0']
+        call_command('feed_benchmark', *args, '--output', output,
+                     stdout=StringIO())
+        with open(output) as source:
+            result = json.load(source)
+        self.assertEqual(set(result['results']), set(benchmark.SCENARIOS))
+        for scenario, row in result['results'].items():
+            with self.subTest(scenario=scenario):
+                self.assertEqual(row['errors'], 0)
+                self.assertEqual(row['requests'], 3)
+                self.assertGreater(row['queries_avg'], 0)
+                self.assertLessEqual(row['p50_ms'], row['p99_ms'])
+
+        out = StringIO()
+        call_command('feed_benchmark', '--current-db', '--requests', '3',
+                     '--scenario', 'index', '--compare', output, stdout=out)
+        self.assertIn('index p95_ms', out.getvalue())
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(values, 50), 50)
+        self.assertEqual(benchmark.percentile(values, 99), 99)
+        self.assertEqual(benchmark.percentile([7], 95), 7)
+
+
+class SeedTests(MyTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_seed_is_deterministic(self):
+        end = timezone.now()
+        first = seed.Plan(20, 3, 200, 300, 60, random_seed=1, end=end)
+        second = seed.Plan(20, 3, 200, 300, 60, random_seed=1, end=end)
+        for kind in ('posts', 'comments', 'follows'):
+            with self.subTest(kind=kind):
+                self.assertEqual(first.build(kind, 0)[2],
+                                 second.build(kind, 0)[2])
+
+    def test_seed_command(self):
+        out = StringIO()
+        call_command('seed', '--users', '20', '--groups', '3', '--posts',
+                     '200', '--comments', '300', '--follows', '60',
+                     '--processes', '2', stdout=out)
+        self.assertIn('строк/с', out.getvalue())
+        posts = Post.objects.filter(author__username__startswith='seed_0_')
+        self.assertEqual(posts.count(), 200)
+        self.assertEqual(
+            Comment.objects.filter(post__in=posts).count(), 300
+        )
+        # id постов растут вместе с датой публикации
+        ids = list(posts.order_by('pub_date', 'id').values_list('id',
+                                                               flat=True))
+        self.assertEqual(ids, sorted(ids))
+        out = StringIO()
+        call_command('repair_counters', '--dry-run', stdout=out)
+        self.assertIn('Найдено счётчиков пользователей: 0', out.getvalue())
+        self.assertIn('Найдено счётчиков комментариев: 0', out.getvalue())
+        self.assertEqual(search.search('лента').count(),
+                         search.FallbackBackend().count('лента'))
+
+        with self.assertRaises(CommandError):
+            call_command('seed', '--users', '20', stdout=StringIO())
+
+    def test_seed_edge_counts(self):
+        call_command('seed', '--users', '5', '--posts', '10', '--comments',
+                     '0', '--follows', '0', '--prefix', 'empty',
+                     stdout=StringIO())
+        seeded = User.objects.filter(username__startswith='empty_')
+        self.assertEqual(seeded.count(), 5)
+        self.assertFalse(Follow.objects.filter(user__in=seeded).exists())
+
+        for args in (['--posts', '0', '--comments', '5'],
+                     ['--follows', '-1']):
+            with self.subTest(args=args):
+                with self.assertRaises(CommandError):
+                    call_command('seed', '--users', '5', '--prefix',
+                                 'broken', *args, stdout=StringIO())
+                self.assertFalse(User.objects.filter(
+                    username__startswith='broken_'
+                ).exists())
+
+
+class BudgetTests(MyTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for i in range(15):
+            post = Post.objects.create(group=cls.test_group,
+                                       text=f'Тестовый текст {i}',
+                                       author=cls.test_author)
+            Comment.objects.create(post=post, author=cls.test_user,
+                                   text=f'Комментарий {i}')
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_pages_within_budget(self):
+        urls = [
+            reverse('index'),
+            reverse('group', kwargs={'slug': 'test_group'}),
+            reverse('profile', kwargs={'username': 'test_author'}),
+            reverse('follow_index'),
+            reverse('post', kwargs={'username': 'test_user', 'post_id': 1}),
+            reverse('post_comments',
+                    kwargs={'username': 'test_user', 'post_id': 1}),
+            reverse('search') + '?q=текст',
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertWithinBudget(self.authorized_client, url)
+
+    def test_breach_fails_test(self):
+        with self.assertRaises(AssertionError):
+            self.assertWithinBudget(self.guest_client, reverse('index'),
+                                    budget={'queries': 0})
+
+    @modify_settings(MIDDLEWARE={'prepend':
+                                 'posts.budgets.BudgetMiddleware'})
+    @override_settings(POSTS_VIEW_BUDGETS={'index': {'queries': 0}})
+    def test_middleware_reports_breach(self):
+        with self.assertLogs('posts.budgets', 'WARNING') as logs:
+            response = self.guest_client.get(reverse('index'))
+        self.assertIn('index', logs.output[0])
+        self.assertIn('db;dur=', response['Server-Timing'])
+        with override_settings(POSTS_BUDGET_RAISE=True):
+            with self.assertRaises(budgets.BudgetExceeded):
+                self.guest_client.get(reverse('index'))
+
+    def test_template_timer_only_while_measuring(self):
+        original = Template.render
+        with budgets.measure() as measurement:
+            self.assertIsNot(Template.render, original)
+            self.guest_client.get(reverse('index'))
+        self.assertIs(Template.render, original)
+        self.assertGreater(measurement.template_time, 0)
+
+
+class ReplicaRoutingTests(MyTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.router = replicas.ReadReplicaRouter()
+
+    def routed_view(self, request):
+        self.routed = (self.router.db_for_read(Post),
+                       self.router.db_for_read(Session))
+        return JsonResponse({})
+
+    @override_settings(POSTS_READ_REPLICAS=['replica'])
+    def test_read_views_use_replica(self):
+        request = RequestFactory().get('/')
+        replicas.read_replica(self.routed_view)(request)
+        self.assertEqual(self.routed, ('replica', None))
+        self.assertIsNone(self.router.db_for_read(Post))
+        self.assertEqual(self.router.db_for_write(Post), 'default')
+
+    @override_settings(POSTS_READ_REPLICAS=['replica'])
+    def test_pinned_user_reads_primary(self):
+        request = RequestFactory().get('/')
+        request.COOKIES[replicas.PIN_COOKIE] = '1'
+        replicas.read_replica(self.routed_view)(request)
+        self.assertEqual(self.routed, (None, None))
+
+    def test_disabled_without_replicas(self):
+        request = RequestFactory().get('/')
+        replicas.read_replica(self.routed_view)(request)
+        self.assertEqual(self.routed, (None, None))
+        response = self.authorized_client.get(
+            reverse('profile_follow', kwargs={'username': 'non_author'})
+        )
+        self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
+
+    @override_settings(POSTS_READ_REPLICAS=['replica'])
+    def test_writes_pin_primary(self):
+        response = self.authorized_client.get(reverse('new_post'))
+        self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
+        response = self.authorized_client.post(
+            reverse('add_comment',
+                    kwargs={'username': 'test_user', 'post_id': 1}),
+            {'text': 'Новый комментарий'}
+        )
+        self.assertEqual(response.cookies[replicas.PIN_COOKIE]['max-age'],
+                         replicas.PIN_SECONDS)
+        response = self.authorized_client.get(
+            reverse('profile_follow', kwargs={'username': 'non_author'})
+        )
+        self.assertIn(replicas.PIN_COOKIE, response.cookies)
+
+
+@override_settings(POSTS_READ_REPLICAS=['replica'],
+                   DATABASE_ROUTERS=['posts.replicas.ReadReplicaRouter'])
+class ReplicaDatabaseTests(MyTestCase):
+    """Реплика - зеркало основной базы (TEST MIRROR) на её же
+    соединении: иначе она не видела бы данных незакоммиченной
+    транзакции теста. Куда ушло чтение, видно по _state.db объектов."""
+
+    databases = {'default', 'replica'}
+
+    @classmethod
+    def setUpClass(cls):
+        default = connections['default']
+        connections.databases['replica'] = {
+            **default.settings_dict,
+            'TEST': {**default.settings_dict['TEST'], 'MIRROR': 'default'},
+        }
+        connections['replica'] = default
+        try:
+            super().setUpClass()
+        except Exception:
+            cls.remove_replica()
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.remove_replica()
+
+    @classmethod
+    def remove_replica(cls):
+        del connections['replica']
+        del connections.databases['replica']
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def read_from(self, response):
+        """Базы, из которых view загрузил автора, пост и комментарии."""
+        context = response.context
+        loaded = [context['profile']]
+        if 'comments_page' in context:
+            loaded += [context['post'], *context['comments_page']]
+        return {obj._state.db for obj in loaded}
+
+    def test_feeds_read_replica_until_write(self):
+        profile = reverse('profile', kwargs={'username': 'test_user'})
+        post = reverse('post', kwargs={'username': 'test_user',
+                                       'post_id': self.test_post.id})
+        Comment.objects.create(post=self.test_post, author=self.test_user,
+                               text='Первый комментарий')
+        for url in (profile, post):
+            with self.subTest(url=url):
+                response = self.authorized_client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.read_from(response), {'replica'})
+
+        response = self.authorized_client.post(
+            reverse('add_comment',
+                    kwargs={'username': 'test_user',
+                            'post_id': self.test_post.id}),
+            {'text': 'Новый комментарий'}
+        )
+        self.assertIn(replicas.PIN_COOKIE, response.cookies)
+        for url in (profile, post):
+            with self.subTest(url=url, pinned=True):
+                response = self.authorized_client.get(url)
+                self.assertEqual(self.read_from(response), {'default'})
+        self.assertContains(response, 'Новый комментарий')
+
+        del self.authorized_client.cookies[replicas.PIN_COOKIE]
+        response = self.authorized_client.get(post)
+        self.assertEqual(self.read_from(response), {'replica'})
+
+
+@override_settings(POSTS_QUERY_WORKERS=2)
+class FanoutTests(TransactionTestCase):
+    """Вне транзакции теста, иначе gather() работает по очереди."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='fanout_author')
+        self.post = Post.objects.create(author=self.author, text='Текст')
+
+    def test_gather_runs_in_pool(self):
+        def load(name):
+            return lambda: (threading.current_thread().name,
+                            User.objects.get(username=name).pk)
+
+        with budgets.measure() as measurement:
+            (first, _), (second, pk) = fanout.gather(load('fanout_author'),
+                                                     load('fanout_author'))
+        self.assertEqual(first, threading.current_thread().name)
+        self.assertTrue(second.startswith('posts-query'))
+        self.assertEqual(pk, self.author.pk)
+        self.assertEqual(measurement.queries, 2)
+
+    def test_gather_raises(self):
+        with self.assertRaises(Post.DoesNotExist):
+            fanout.gather(lambda: None, lambda: Post.objects.get(pk=0))
+
+    def test_pages_with_pool(self):
+        urls = [
+            reverse('profile', kwargs={'username': 'fanout_author'}),
+            reverse('post', kwargs={'username': 'fanout_author',
+                                    'post_id': self.post.pk}),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertContains(self.client.get(url), 'Текст')
+
+
+class ApiTests(MyTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for i in range(12):
+            Post.objects.create(group=cls.test_group, author=cls.test_author,
+                                text=f'Пост {i}')
+
+    def test_posts_cursor_pagination(self):
+        url = reverse('api_posts')
+        response = self.guest_client.get(url, {'limit': 5})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        data = response.json()
+        self.assertEqual([post['text'] for post in data['results']],
+                         [f'Пост {i}' for i in range(11, 6, -1)])
+        self.assertIsNone(data['previous'])
+        seen = [post['id'] for post in data['results']]
+        while data['next']:
+            data = self.guest_client.get(
+                url, {'limit': 5, 'cursor': data['next']}
+            ).json()
+            seen += [post['id'] for post in data['results']]
+        self.assertEqual(seen, list(Post.objects.order_by(
+            '-pub_date', '-id'
+        ).values_list('id', flat=True)))
+
+    def test_fields_selection(self):
+        response = self.guest_client.get(
+            reverse('api_user_posts', kwargs={'username': 'test_author'}),
+            {'fields': 'id,author', 'limit': 1}
+        )
+        post = Post.objects.filter(author=self.test_author).first()
+        self.assertEqual(response.json()['results'],
+                         [{'id': post.id, 'author': 'test_author'}])
+        self.assertNotIn(b'\\u', response.content)
+        response = self.guest_client.get(reverse('api_posts'),
+                                         {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('password', response.json()['error'])
+
+    def test_errors(self):
+        cases = [
+            (reverse('api_posts'), {'cursor': 'плохой'}, 400),
+            (reverse('api_posts'), {'limit': 1000}, 400),
+            (reverse('api_post', kwargs={'post_id': 999}), {}, 404),
+            (reverse('api_group_posts', kwargs={'slug': 'nope'}), {}, 404),
+            (reverse('api_follow'), {}, 401),
+        ]
+        for url, params, status in cases:
+            with self.subTest(url=url, params=params):
+                response = self.guest_client.get(url, params)
+                self.assertEqual(response.status_code, status)
+                self.assertIn('error', response.json())
+
+    def test_other_resources(self):
+        data = self.authorized_client.get(reverse('api_follow')).json()
+        self.assertEqual(len(data['results']), POSTS_PER_PAGE)
+        self.assertEqual(data['results'][0]['author'], 'test_author')
+        data = self.guest_client.get(reverse('api_groups')).json()
+        self.assertEqual(data['results'][0]['slug'], 'test_group')
+        data = self.guest_client.get(
+            reverse('api_group_posts', kwargs={'slug': 'test_group'})
+        ).json()
+        self.assertEqual(len(data['results']), POSTS_PER_PAGE)
+        data = self.guest_client.get(
+            reverse('api_post_comments', kwargs={'post_id': 1})
+        ).json()
+        self.assertEqual(data['results'][0]['text'], 'Тестовый комментарий')
+        data = self.guest_client.get(
+            reverse('api_post', kwargs={'post_id': 1}), {'fields': 'group'}
+        ).json()
+        self.assertEqual(data, {'group': 'test_group'})
+
+    def test_within_budget(self):
+        for url in (reverse('api_posts'), reverse('api_follow'),
+                    reverse('api_user_posts',
+                            kwargs={'username': 'test_author'})):
+            with self.subTest(url=url):
+                self.assertWithinBudget(self.authorized_client, url)
+
+
+class DegradationTests(MyTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        degrade.breaker.reset()
+        self.addCleanup(degrade.breaker.reset)
+        self.url = reverse('profile', kwargs={'username': 'test_user'})
+
+    def failing_db(self, execute, sql, params, many, context):
+        raise OperationalError('database is locked')
+
+    def slow_db(self, execute, sql, params, many, context):
+        time.sleep(0.02)
+        return execute(sql, params, many, context)
+
+    def test_stale_copy_on_error(self):
+        """При ошибке базы отдаётся последняя удачная копия."""
+        fresh = self.guest_client.get(self.url)
+        with connection.execute_wrapper(self.failing_db):
+            with self.assertLogs('posts.degrade', 'WARNING'):
+                response = self.authorized_client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, fresh.content)
+        self.assertEqual(response['X-Degraded'], 'database error')
+        self.assertIn('110', response['Warning'])
+        self.assertEqual(int(response['Age']), 0)
+
+    @override_settings(POSTS_DEGRADE_BUDGET=10)
+    def test_stale_copy_when_over_budget(self):
+        """Страница, не уложившаяся в бюджет, отдаётся из копии."""
+        self.guest_client.get(self.url)
+        with connection.execute_wrapper(self.slow_db):
+            with self.assertLogs('posts.degrade', 'WARNING'):
+                response = self.guest_client.get(self.url)
+        self.assertEqual(response['X-Degraded'], 'database slow')
+
+    def test_budget_is_off_by_default(self):
+        with connection.execute_wrapper(self.slow_db):
+            response = self.guest_client.get(self.url)
+        self.assertFalse(response.has_header('X-Degraded'))
+
+    def test_copy_is_written_when_page_changes(self):
+        """Копия не перезаписывается, пока ETag страницы прежний."""
+        self.guest_client.get(self.url)
+        store = page_cache.get_cache()
+        key = degrade._key(RequestFactory().get(self.url))
+
+        def copies(written):
+            return [call for call in written.call_args_list
+                    if call[0][0] == key]
+
+        with mock.patch.object(store, 'set', wraps=store.set) as written:
+            self.guest_client.get(self.url)
+            self.assertEqual(copies(written), [])
+            Post.objects.create(text='Новый пост', author=self.test_user)
+            with override_settings(POSTS_DEGRADE_REFRESH=0):
+                self.guest_client.get(self.url)
+            self.assertEqual(len(copies(written)), 1)
+            # ключ с ETag истёк: копия с тем же ETag пишется снова
+            self.guest_client.get(self.url)
+            self.assertEqual(len(copies(written)), 2)
+            self.guest_client.get(self.url)
+            self.assertEqual(len(copies(written)), 2)
+
+    def test_no_copy_gives_503(self):
+        with connection.execute_wrapper(self.failing_db):
+            with self.assertLogs('posts.degrade', 'WARNING'):
+                response = self.guest_client.get(reverse('index'))
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+
+    @override_settings(POSTS_BREAKER_FAILURES=2, POSTS_BREAKER_RESET=30)
+    def test_circuit_breaker_opens_and_probes(self):
+        """После сбоев подряд база не трогается до пробного запроса."""
+        self.guest_client.get(self.url)
+        with connection.execute_wrapper(self.failing_db):
+            with self.assertLogs('posts.degrade', 'WARNING'):
+                for _ in range(2):
+                    self.guest_client.get(self.url)
+        self.assertEqual(degrade.breaker.state, 'open')
+
+        with self.assertNumQueries(0):
+            response = self.guest_client.get(self.url)
+        self.assertEqual(response['X-Degraded'], 'circuit open')
+
+        degrade.breaker.opened_at -= 30
+        with self.assertLogs('posts.degrade', 'WARNING'):
+            response = self.guest_client.get(self.url)
+        self.assertFalse(response.has_header('X-Degraded'))
+        self.assertEqual(degrade.breaker.state, 'closed')
+
+    @override_settings(POSTS_BREAKER_FAILURES=1, POSTS_BREAKER_RESET=30)
+    def test_probe_with_404_closes_breaker(self):
+        """Пробный запрос, ответивший 404, замыкает предохранитель."""
+        self.guest_client.get(self.url)
+        with connection.execute_wrapper(self.failing_db):
+            with self.assertLogs('posts.degrade', 'WARNING'):
+                self.guest_client.get(self.url)
+        self.assertEqual(degrade.breaker.state, 'open')
+        degrade.breaker.opened_at -= 30
+        missing = reverse('post', kwargs={'username': 'test_user',
+                                          'post_id': 999999})
+        with self.assertLogs('posts.degrade', 'WARNING'):
+            response = self.guest_client.get(missing)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(degrade.breaker.state, 'closed')
+        response = self.guest_client.get(self.url)
+        self.assertFalse(response.has_header('X-Degraded'))
+
+
+@override_settings(POSTS_FOLLOW_GRAPH=True)
+class FollowGraphTests(TransactionTestCase):
+    """Вне транзакции теста: внутри неё граф не используется."""
+
+    def setUp(self):
+        cache.clear()
+        follow_graph.clear()
+        self.addCleanup(follow_graph.clear)
+        self.reader, self.author, self.other = (
+            User.objects.create_user(username=name)
+            for name in ('graph_reader', 'graph_author', 'graph_other')
+        )
+        Follow.objects.create(user=self.reader, author=self.author)
+
+    def test_lookups_avoid_db(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(follow_graph.is_following(self.reader.pk,
+                                                      self.author.pk))
+        with self.assertNumQueries(0):
+            self.assertFalse(follow_graph.is_following(self.reader.pk,
+                                                       self.other.pk))
+            self.assertEqual(list(follow_graph.followees(self.reader.pk)),
+                             [self.author.pk])
+
+    def test_incremental_updates(self):
+        follow_graph.followees(self.reader.pk)
+        Follow.objects.create(user=self.reader, author=self.other)
+        with self.assertNumQueries(0):
+            self.assertEqual(list(follow_graph.followees(self.reader.pk)),
+                             sorted([self.author.pk, self.other.pk]))
+        Follow.objects.filter(user=self.reader, author=self.author).delete()
+        follows.unfollow_many([(self.reader.pk, self.other.pk)])
+        with self.assertNumQueries(0):
+            self.assertEqual(list(follow_graph.followees(self.reader.pk)),
+                             [])
+        follows.follow_many([(self.reader.pk, self.author.pk)])
+        with self.assertNumQueries(0):
+            self.assertTrue(follow_graph.is_following(self.reader.pk,
+                                                      self.author.pk))
+
+    def test_change_in_other_process_reloads(self):
+        follow_graph.followees(self.reader.pk)
+        # другой процесс подписался и увеличил версию
+        Follow.objects.bulk_create([Follow(user=self.reader,
+                                           author=self.other)])
+        follow_graph._bump(self.reader.pk)
+        with self.assertNumQueries(1):
+            self.assertTrue(follow_graph.is_following(self.reader.pk,
+                                                      self.other.pk))
+
+    def test_old_entry_reloads(self):
+        follow_graph.followees(self.reader.pk)
+        # версия другого процесса сюда не дошла
+        Follow.objects.bulk_create([Follow(user=self.reader,
+                                           author=self.other)])
+        with self.assertNumQueries(0):
+            self.assertFalse(follow_graph.is_following(self.reader.pk,
+                                                       self.other.pk))
+        with override_settings(POSTS_FOLLOW_GRAPH_MAX_AGE=0):
+            with self.assertNumQueries(1):
+                self.assertTrue(follow_graph.is_following(self.reader.pk,
+                                                          self.other.pk))
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }})
+    def test_needs_shared_cache(self):
+        del settings.POSTS_FOLLOW_GRAPH
+        self.assertFalse(follow_graph.is_enabled())
+        with self.settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'cache_table',
+        }}):
+            self.assertTrue(follow_graph.is_enabled())
+
+    def test_views_use_graph(self):
+        Post.objects.create(author=self.author, text='Пост автора')
+        Post.objects.create(author=self.other, text='Чужой пост')
+        self.client.force_login(self.reader)
+        response = self.client.get(reverse('follow_index'))
+        self.assertContains(response, 'Пост автора')
+        self.assertNotContains(response, 'Чужой пост')
+        response = self.client.get(
+            reverse('profile', kwargs={'username': 'graph_author'})
+        )
+        self.assertTrue(response.context['following'])
+
+
+class ExistenceFilterTests(MyTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        existence.reset_stats()
+
+    def test_bloom_filter(self):
+        bloom = existence.BloomFilter(1000)
+        names = [f'user_{i}' for i in range(1000)]
+        for name in names:
+            bloom.add(name)
+        self.assertTrue(all(name in bloom for name in names))
+        false_positives = sum(f'bot_{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_unknown_names_skip_db(self):
+        urls = [
+            reverse('profile', kwargs={'username': 'no_such_user'}),
+            reverse('post', kwargs={'username': 'no_such_user',
+                                    'post_id': 1}),
+            reverse('group', kwargs={'slug': 'no-such-group'}),
+            reverse('api_user_posts', kwargs={'username': 'no_such_user'}),
+        ]
+        existence.build('username')
+        existence.build('group')
+        for url in urls:
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.guest_client.get(url)
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(len(queries), 0)
+        self.assertEqual(existence.stats()['rejected'], 4)
+        out = StringIO()
+        call_command('existence_stats', '--reset', stdout=out)
+        self.assertIn('Отсечено без базы: 4', out.getvalue())
+
+    def test_new_names_are_added(self):
+        existence.build('username')
+        existence.build('group')
+        User.objects.create_user(username='fresh_user')
+        Group.objects.create(title='Новая', slug='fresh-group')
+        response = self.guest_client.get(
+            reverse('profile', kwargs={'username': 'fresh_user'})
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.guest_client.get(
+            reverse('group', kwargs={'slug': 'fresh-group'})
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_one_thread_builds_filter(self):
+        """Одновременные запросы строят фильтр один раз, а во время
+        плановой перестройки остальные берут старый."""
+        builds = []
+        started = threading.Event()
+
+        def slow_build(kind):
+            builds.append(kind)
+            started.set()
+            time.sleep(0.1)
+            state = existence._State(existence.BloomFilter(10),
+                                     existence._shared_generation(kind))
+            existence._states[kind] = state
+            return state
+
+        def ask_in_threads():
+            threads = [threading.Thread(target=existence.might_exist,
+                                        args=('group', 'slug'))
+                       for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            return threads
+
+        self.addCleanup(existence._reset, ['group'])
+        with mock.patch('posts.existence.build', slow_build):
+            for thread in ask_in_threads():
+                thread.join()
+            self.assertEqual(builds, ['group'])
+
+            old = existence._states['group']
+            old.built -= existence.rebuild_seconds() + 1
+            started.clear()
+            threads = ask_in_threads()
+            started.wait(1)
+            # перестройка идёт, а запрос получает старый фильтр
+            self.assertFalse(existence.might_exist('group', 'slug'))
+            for thread in threads:
+                thread.join()
+        self.assertEqual(builds, ['group', 'group'])
+        self.assertIsNot(existence._states['group'], old)
+
+    def test_names_added_by_other_process(self):
+        existence.build('username')
+        # другой процесс зарегистрировал пользователя
+        User.objects.bulk_create([User(username='remote_user')])
+        generation = cache.incr(existence._generation_key('username'))
+        cache.set(existence._added_key('username', generation),
+                  'remote_user')
+        response = self.guest_client.get(
+            reverse('profile', kwargs={'username': 'remote_user'})
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class ExistenceCommitTests(TransactionTestCase):
+    """Вне транзакции теста: нужен настоящий коммит."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(existence._reset, ['username'])
+
+    def test_name_added_again_after_commit(self):
+        with transaction.atomic():
+            User.objects.create_user(username='late_user')
+            # другой процесс перестроил фильтр до коммита: поколение
+            # уже новое, а строки он не видел
+            existence._states['username'] = existence._State(
+                existence.BloomFilter(10),
+                existence._shared_generation('username'),
+            )
+        self.assertTrue(existence.might_exist('username', 'late_user'))
+
+
+class CursorPaginatorViewsTest(MyTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for i in range(12):
+            Post.objects.create(
+                group=cls.test_group,
+                text=f'Тестовый текст {i}',
+                author=cls.test_user,
+            )
+
+    def test_cursor_pages_cover_feed_without_gaps(self):
+        """Листание по курсору проходит всю ленту без пропусков и повторов."""
+        response = self.client.get(reverse('index') + '?cursor=')
+        page = response.context.get('page')
+        self.assertEqual(len(page), POSTS_PER_PAGE)
+        self.assertFalse(page.has_previous())
+        seen = [post.id for post in page]
+
+        response = self.client.get(
+            reverse('index') + f'?cursor={page.next_cursor}'
+        )
+        page = response.context.get('page')
+        self.assertFalse(page.has_next())
+        seen += [post.id for post in page]
+
+        self.assertEqual(
+            seen,
+            list(Post.objects.order_by('-pub_date', '-id')
+                 .values_list('id', flat=True))
+        )
+
+    def test_previous_cursor_returns_newer_posts(self):
+        """Ссылка «Новее» возвращает на предыдущую страницу."""
+        first = self.client.get(
+            reverse('group', kwargs={'slug': 'test_group'}) + '?cursor='
+        ).context.get('page')
+        second = self.client.get(
+            reverse('group', kwargs={'slug': 'test_group'})
+            + f'?cursor={first.next_cursor}'
+        ).context.get('page')
+        back = self.client.get(
+            reverse('group', kwargs={'slug': 'test_group'})
+            + f'?cursor={second.previous_cursor}'
+        ).context.get('page')
+
+        self.assertEqual([post.id for post in back],
+                         [post.id for post in first])
+        self.assertFalse(back.has_previous())
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        """Некорректный курсор открывает первую страницу."""
+        response = self.client.get(reverse('index') + '?cursor=garbage')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context.get('page')), POSTS_PER_PAGE)
+
+
 class ProfileTests(MyTestCase):
     def test_edit_correct_form_fields(self):
         """Шаблон /edit/ сформирован с правильными полями."""
@@ -190,6 +1070,346 @@ class ProfileTests(MyTestCase):
         self.assertContains(response, '<img')
 
 
+class PostCardCacheTests(MyTestCase):
+    def setUp(self):
+        super().setUp()
+        # откат транзакции теста не откатывает кэш карточек
+        cache.clear()
+
+    def get_group_page(self, client=None):
+        return (client or self.guest_client).get(
+            reverse('group', kwargs={'slug': self.test_group.slug})
+        )
+
+    def test_card_is_served_from_cache_until_version_changes(self):
+        """Карточка берётся из кэша, пока не изменится её версия."""
+        self.get_group_page()
+        Post.objects.filter(pk=self.test_post.pk).update(text='Тихая правка')
+        self.assertNotContains(self.get_group_page(), 'Тихая правка')
+
+        self.authorized_client.post(
+            reverse('post_edit',
+                    kwargs={'username': self.test_user.username,
+                            'post_id': self.test_post.id}),
+            {'text': 'Правка через форму', 'group': self.test_group.id},
+        )
+        self.assertContains(self.get_group_page(), 'Правка через форму')
+
+    def test_edit_after_comment_gets_new_version(self):
+        """Правка не затирает версию, увеличенную комментарием."""
+        post = Post.objects.get(pk=self.test_post.pk)
+        version = post.card_version
+        Comment.objects.create(post=self.test_post, author=self.test_author,
+                               text='Комментарий до правки')
+        self.get_group_page()
+        post.text = 'Правка после комментария'
+        post.save()
+        self.assertEqual(post.card_version, version + 2)
+        self.assertContains(self.get_group_page(),
+                            'Правка после комментария')
+
+    def test_card_invalidated_by_comment_and_group_rename(self):
+        """Новый комментарий и переименование группы сбрасывают карточку."""
+        self.get_group_page()
+        Comment.objects.create(post=self.test_post, author=self.test_author,
+                               text='Ещё комментарий')
+        self.assertContains(self.get_group_page(), 'Комментариев: 2')
+
+        group = Group.objects.get(pk=self.test_group.pk)
+        group.title = 'Новое название'
+        group.save()
+        self.assertContains(self.get_group_page(), '#Новое название')
+
+    def test_whole_card_is_one_fragment(self):
+        """В кэше лежит вся карточка, от открывающего тега до закрывающего."""
+        self.get_group_page()
+        post = Post.objects.get(pk=self.test_post.pk)
+        key = make_template_fragment_key('post_card', [
+            post.id, post.card_version,
+            dateformat.format(post.pub_date, 'U.u'), 'guest',
+        ])
+        fragment = cache.get(key).strip()
+        self.assertTrue(fragment.startswith('<div class="card'), fragment)
+        self.assertTrue(fragment.endswith('</div>'), fragment)
+        self.assertEqual(fragment.count('<div'), fragment.count('</div>'))
+
+    def test_viewer_specific_buttons_are_not_cached(self):
+        """Кнопка редактирования видна только автору даже из кэша."""
+        edit_url = reverse('post_edit',
+                           kwargs={'username': self.test_user.username,
+                                   'post_id': self.test_post.id})
+        self.assertContains(self.get_group_page(self.authorized_client),
+                            edit_url)
+        self.assertNotContains(self.get_group_page(self.non_author_client),
+                               edit_url)
+        self.assertNotContains(self.get_group_page(), 'Добавить комментарий')
+
+
+@override_settings(POSTS_PAGE_CACHE_TIMEOUT=60)
+class AnonymousPageCacheTests(MyTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        page_cache.reset_stats()
+
+    @override_settings(POSTS_PAGE_CACHE_TIMEOUT=0)
+    def test_no_coalescing_without_cache(self):
+        """Без кэша страниц запрос не проходит через склейку."""
+        with mock.patch('posts.page_cache.single_flight') as flight:
+            response = self.guest_client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+        flight.assert_not_called()
+
+    def test_stats_are_sent_in_batches(self):
+        for _ in range(3):
+            page_cache.record('computed')
+        self.assertIsNone(cache.get('page_cache:stats:computed'))
+        self.assertEqual(page_cache.stats()['computed'], 3)
+
+    def test_anonymous_page_is_cached_until_event(self):
+        """Анонимная страница берётся из кэша до нового поста."""
+        url = reverse('group', kwargs={'slug': self.test_group.slug})
+        self.assertEqual(self.guest_client.get(url)['X-Page-Cache'], 'miss')
+        Post.objects.filter(pk=self.test_post.pk).update(text='Тихая правка')
+        response = self.guest_client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertNotContains(response, 'Тихая правка')
+
+        Post.objects.create(text='Новый пост', author=self.test_author,
+                            group=self.test_group)
+        response = self.guest_client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'Новый пост')
+
+    def test_hit_runs_no_queries(self):
+        """Попадание в кэш не обращается к базе ни на одной ленте."""
+        urls = (
+            reverse('index'),
+            reverse('group', kwargs={'slug': self.test_group.slug}),
+            reverse('profile', kwargs={'username': 'test_user'}),
+            reverse('post', kwargs={'username': 'test_user',
+                                    'post_id': self.test_post.id}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.guest_client.get(url)['X-Page-Cache'],
+                                 'miss')
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.guest_client.get(url)
+                self.assertEqual(response['X-Page-Cache'], 'hit')
+                self.assertEqual(
+                    [query['sql'] for query in queries], []
+                )
+
+    def test_page_parameter_is_part_of_key(self):
+        """Разные страницы паджинатора кэшируются отдельно."""
+        self.guest_client.get(reverse('index'))
+        response = self.guest_client.get(reverse('index') + '?page=2')
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+
+    def test_follow_invalidates_profile(self):
+        """Подписка сбрасывает кэш профиля автора."""
+        url = reverse('profile', kwargs={'username': 'test_author'})
+        self.assertContains(self.guest_client.get(url), 'Подписчиков: 1')
+        Follow.objects.create(user=self.non_author, author=self.test_author)
+        self.assertContains(self.guest_client.get(url), 'Подписчиков: 2')
+
+    def test_authorized_user_bypasses_cache(self):
+        """Авторизованным пользователям кэш не отдаётся."""
+        self.guest_client.get(reverse('index'))
+        response = self.authorized_client.get(reverse('index'))
+        self.assertFalse(response.has_header('X-Page-Cache'))
+
+    def test_stale_copy_is_served_while_refreshing(self):
+        """Пока страницу пересчитывают, остальным отдаётся старая копия."""
+        url = reverse('index')
+        self.guest_client.get(url)
+        Post.objects.create(text='Новый пост', author=self.test_author)
+        # страницу уже пересчитывает другой запрос
+        key = page_cache.page_key(RequestFactory().get(url))
+        cache.add(f'{key}:lock', 1)
+
+        response = self.guest_client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'stale')
+        self.assertNotContains(response, 'Новый пост')
+
+    def test_concurrent_misses_are_coalesced(self):
+        """Одновременные одинаковые запросы ждут одного пересчёта."""
+        started, release = threading.Event(), threading.Event()
+        calls, responses = [], []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return HttpResponse('страница')
+
+        def request():
+            responses.append(page_cache.single_flight('key', compute))
+
+        leader = threading.Thread(target=request)
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=request) for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        # даём ожидающим дойти до склейки
+        time.sleep(0.1)
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([response.content for response in responses],
+                         ['страница'.encode()] * 4)
+        self.assertEqual(sorted(response.get('X-Page-Cache', '')
+                                for response in responses),
+                         ['', 'coalesced', 'coalesced', 'coalesced'])
+        self.assertEqual(page_cache.stats()['coalesced'], 3)
+
+    @override_settings(POSTS_PAGE_COALESCE_WAIT=1)
+    def test_waits_for_page_of_other_process(self):
+        """Без копии в кэше запрос ждёт страницу другого процесса."""
+        url = reverse('index')
+        key = page_cache.page_key(RequestFactory().get(url))
+        cache.add(f'{key}:lock', 1)
+
+        def other_process_finished(seconds):
+            cache.set(key, {'generations': [page_cache.generation('feed')],
+                            'expires': time.time() + 60, 'status': 200,
+                            'headers': [],
+                            'content': 'готово'.encode()})
+
+        with mock.patch('posts.page_cache.time.sleep',
+                        side_effect=other_process_finished):
+            response = self.guest_client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'coalesced')
+        self.assertEqual(response.content, 'готово'.encode())
+        out = StringIO()
+        call_command('page_cache_stats', '--reset', stdout=out)
+        self.assertIn('Дождались другого процесса: 1', out.getvalue())
+        self.assertEqual(page_cache.stats()['coalesced_remote'], 0)
+
+
+@override_settings(POSTS_PAGE_CACHE_TIMEOUT=60)
+class PageCacheCommitTests(TransactionTestCase):
+    """Вне транзакции теста: нужен настоящий коммит."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='commit_author')
+
+    def test_page_rendered_before_commit_is_dropped(self):
+        url = reverse('index')
+        with transaction.atomic():
+            Post.objects.create(author=self.author, text='Новый пост')
+            # страница, посчитанная между сбросом и коммитом
+            self.assertEqual(self.client.get(url)['X-Page-Cache'], 'miss')
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'miss')
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'hit')
+
+
+class ConditionalGetTests(MyTestCase):
+    def test_matching_etag_returns_not_modified(self):
+        """Совпавший If-None-Match даёт 304 без запроса страницы."""
+        urls = (
+            reverse('index'),
+            reverse('group', kwargs={'slug': self.test_group.slug}),
+            reverse('profile', kwargs={'username': 'test_user'}),
+            reverse('post', kwargs={'username': 'test_user',
+                                    'post_id': self.test_post.id}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                etag = self.guest_client.get(url)['ETag']
+                response = self.guest_client.get(url,
+                                                 HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.templates, [])
+
+    def test_not_modified_runs_only_validator_queries(self):
+        """304 стоит строк валидатора, без страницы и COUNT(*)."""
+        cases = (
+            (reverse('index'), 1),
+            (reverse('group', kwargs={'slug': self.test_group.slug}), 2),
+            (reverse('profile', kwargs={'username': 'test_user'}), 2),
+            (reverse('post', kwargs={'username': 'test_user',
+                                     'post_id': self.test_post.id}), 1),
+        )
+        for url, expected in cases:
+            with self.subTest(url=url):
+                etag = self.guest_client.get(url)['ETag']
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.guest_client.get(
+                        url, HTTP_IF_NONE_MATCH=etag
+                    )
+                self.assertEqual(response.status_code, 304)
+                sql = [query['sql'] for query in queries]
+                self.assertEqual(len(sql), expected, sql)
+                for query in sql:
+                    self.assertNotIn('COUNT(', query)
+                    self.assertNotIn('"posts_post"."text"', query)
+
+    @override_settings(POSTS_PAGE_CACHE_TIMEOUT=60)
+    def test_cached_copy_answers_conditional_get(self):
+        """Копия из кэша страниц отвечает 304 без запросов к базе."""
+        cache.clear()
+        url = reverse('group', kwargs={'slug': self.test_group.slug})
+        etag = self.guest_client.get(url)['ETag']
+        last_modified = self.guest_client.get(url)['Last-Modified']
+        with self.assertNumQueries(0):
+            response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            response = self.guest_client.get(
+                url, HTTP_IF_MODIFIED_SINCE=last_modified
+            )
+            self.assertEqual(response.status_code, 304)
+            response = self.guest_client.get(url,
+                                             HTTP_IF_NONE_MATCH='"old"')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['X-Page-Cache'], 'hit')
+
+    def test_page_outside_feed_has_no_validator(self):
+        """Номер за пределами ленты отдаётся без ETag."""
+        response = self.guest_client.get(reverse('index'), {'page': 99})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_etag_changes_after_edit_and_comment(self):
+        """Правка поста и новый комментарий меняют ETag."""
+        url = reverse('post', kwargs={'username': 'test_user',
+                                      'post_id': self.test_post.id})
+        etag = self.guest_client.get(url)['ETag']
+        Comment.objects.create(post=self.test_post, author=self.test_author,
+                               text='Новый комментарий')
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        self.authorized_client.post(
+            reverse('post_edit', kwargs={'username': 'test_user',
+                                         'post_id': self.test_post.id}),
+            {'text': 'Правка', 'group': self.test_group.id},
+        )
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_modified_since_for_anonymous(self):
+        """Анонимный посетитель получает 304 по If-Modified-Since."""
+        url = reverse('group', kwargs={'slug': self.test_group.slug})
+        last_modified = self.guest_client.get(url)['Last-Modified']
+        response = self.guest_client.get(
+            url, HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_depends_on_viewer(self):
+        """Разные зрители получают разные ETag одной страницы."""
+        url = reverse('profile', kwargs={'username': 'test_author'})
+        self.assertNotEqual(self.guest_client.get(url)['ETag'],
+                            self.authorized_client.get(url)['ETag'])
+
+
 class CacheTests(MyTestCase):
     def test_index_cache_works_correct(self):
         """Кэш главной страницы работает корректно."""
@@ -243,8 +1463,8 @@ class FollowingTests(MyTestCase):
 
     def test_authorized_user_can_unfollow(self):
         """Авторизованный пользователь может отписываться от автора."""
-        Follow.objects.create(user=FollowingTests.test_user,
-                              author=FollowingTests.test_author)
+        Follow.objects.get_or_create(user=FollowingTests.test_user,
+                                     author=FollowingTests.test_author)
         response = self.authorized_client.get(
             reverse('profile_unfollow',
                     kwargs={'username': FollowingTests.test_author}),
@@ -271,6 +1491,445 @@ class FollowingTests(MyTestCase):
         self.assertNotContains(response, FollowingTests.test_post.text)
 
 
+class FollowBatchTests(MyTestCase):
+    def batch(self, action, *authors):
+        response = self.authorized_client.post(
+            reverse('follow_batch'), {'action': action, 'author': authors}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def counters(self, user):
+        return UserCounters.objects.get(user=user)
+
+    def test_follow_and_unfollow_many_authors(self):
+        """Подписка и отписка пачкой, повторная подписка ничего не меняет."""
+        result = self.batch('follow', 'test_author', 'non_author',
+                            'non_follower', 'test_user', 'nobody')
+        self.assertEqual(result['changed'], 2)
+        self.assertEqual(result['missing'], ['nobody'])
+        self.assertEqual(self.counters(self.test_user).following_count, 3)
+        self.assertEqual(self.counters(self.non_author).followers_count, 1)
+        self.assertEqual(
+            self.batch('follow', 'non_author')['changed'], 0
+        )
+
+        result = self.batch('unfollow', 'test_author', 'non_author')
+        self.assertEqual(result['changed'], 2)
+        self.assertEqual(
+            list(self.test_user.follower.values_list('author__username',
+                                                     flat=True)),
+            ['non_follower']
+        )
+        self.assertEqual(self.counters(self.test_user).following_count, 1)
+        self.assertEqual(self.counters(self.test_author).followers_count, 0)
+
+    def test_get_and_unknown_action_are_rejected(self):
+        self.assertEqual(
+            self.authorized_client.get(reverse('follow_batch')).status_code,
+            405
+        )
+        response = self.authorized_client.post(reverse('follow_batch'),
+                                               {'action': 'block'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_import_follows_command(self):
+        """Команда импортирует пары из CSV и пропускает повторы."""
+        with tempfile.NamedTemporaryFile('w', suffix='.csv',
+                                         delete=False) as source:
+            source.write('test_user,test_author\n'
+                         'non_author,test_author\n'
+                         'non_follower,test_user\n'
+                         'non_follower,ghost\n')
+        self.addCleanup(os.remove, source.name)
+        out = StringIO()
+        call_command('import_follows', source.name, stdout=out)
+        self.assertIn('Создано подписок: 2', out.getvalue())
+        self.assertIn('Неизвестных пользователей: 1', out.getvalue())
+        self.assertIn('пар/с', out.getvalue())
+        self.assertEqual(self.counters(self.test_author).followers_count, 2)
+
+
+@override_settings(POSTS_TIMELINE_ENABLED=True)
+class TimelineTests(MyTestCase):
+    def feed_ids(self, client):
+        response = client.get(reverse('follow_index'))
+        return [post.id for post in response.context.get('page')]
+
+    def test_follow_backfills_and_unfollow_prunes_timeline(self):
+        """Подписка заполняет ленту, отписка её очищает."""
+        self.author_client.get(
+            reverse('profile_follow',
+                    kwargs={'username': self.test_user.username})
+        )
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.test_author, post=self.test_post).exists())
+        self.assertEqual(self.feed_ids(self.author_client),
+                         [self.test_post.id])
+
+        self.author_client.get(
+            reverse('profile_unfollow',
+                    kwargs={'username': self.test_user.username})
+        )
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.test_author).exists()
+        )
+        self.assertEqual(self.feed_ids(self.author_client), [])
+
+    def test_new_post_fans_out_to_followers(self):
+        """Новый пост попадает в материализованные ленты подписчиков."""
+        post = Post.objects.create(text='Новый пост', author=self.test_author)
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.test_user, post=post).exists())
+        self.assertEqual(self.feed_ids(self.authorized_client), [post.id])
+
+    @override_settings(POSTS_TIMELINE_FANOUT_LIMIT=1)
+    def test_popular_author_is_read_on_demand(self):
+        """Посты популярного автора не раскладываются, но видны в ленте."""
+        post = Post.objects.create(text='Новый пост', author=self.test_author)
+        self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+        self.assertEqual(self.feed_ids(self.authorized_client), [post.id])
+
+    def test_posts_survive_dropping_below_limit(self):
+        """Посты, написанные выше порога, видны и после его понижения."""
+        with self.settings(POSTS_TIMELINE_FANOUT_LIMIT=1):
+            old = Post.objects.create(text='Старый', author=self.test_author)
+        new = Post.objects.create(text='Новый', author=self.test_author)
+        self.assertEqual(self.feed_ids(self.authorized_client),
+                         [new.id, old.id])
+        timeline.rebuild()
+        self.assertFalse(TimelinePull.objects.exists())
+        self.assertEqual(self.feed_ids(self.authorized_client)[:2],
+                         [new.id, old.id])
+
+    def test_page_is_read_from_entries(self):
+        """Страница - диапазон по индексу записей, посты - по ключу."""
+        posts = [Post.objects.create(text=f'Пост {i}',
+                                     author=self.test_author)
+                 for i in range(POSTS_PER_PAGE + 2)]
+        expected = [post.id for post in reversed(posts)]
+        feed = timeline.follow_feed(self.test_user)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual([post.id for post in feed[:POSTS_PER_PAGE]],
+                             expected[:POSTS_PER_PAGE])
+        entries, posts_query = (query['sql'] for query in queries)
+        self.assertNotIn('"posts_post"', entries)
+        self.assertIn('"posts_timelineentry"', entries)
+        self.assertNotIn('"posts_timelineentry"', posts_query)
+        if connection.vendor == 'sqlite':
+            plan = feed[:POSTS_PER_PAGE].explain()
+            self.assertEqual(explain.problems(plan), [], plan)
+
+        self.assertEqual(self.feed_ids(self.authorized_client),
+                         expected[:POSTS_PER_PAGE])
+        response = self.authorized_client.get(reverse('follow_index'),
+                                              {'page': 2})
+        self.assertEqual([post.id for post in response.context['page']],
+                         expected[POSTS_PER_PAGE:])
+        seen, cursor = [], ''
+        while cursor is not None:
+            page = self.authorized_client.get(
+                reverse('follow_index'), {'cursor': cursor}
+            ).context['page']
+            seen += [post.id for post in page]
+            cursor = page.next_cursor
+        self.assertEqual(seen, expected)
+        data = self.authorized_client.get(reverse('api_follow'),
+                                          {'limit': 3,
+                                           'fields': 'id,author'}).json()
+        self.assertEqual(data['results'],
+                         [{'id': pk, 'author': 'test_author'}
+                          for pk in expected[:3]])
+        data = self.authorized_client.get(
+            reverse('api_follow'), {'limit': 3, 'cursor': data['next']}
+        ).json()
+        self.assertEqual([row['id'] for row in data['results']],
+                         expected[3:6])
+
+
+class ThumbnailTests(MyTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def upload(self, name):
+        return SimpleUploadedFile(name=name, content=self.small_gif,
+                                  content_type='image/gif')
+
+    def test_new_post_gets_thumbnail(self):
+        """Миниатюра строится при публикации и выводится в ленте."""
+        self.authorized_client.post(
+            reverse('new_post'),
+            {'text': 'Пост с картинкой', 'image': self.upload('new.gif')},
+        )
+        post = Post.objects.get(text='Пост с картинкой')
+        self.assertTrue(post.image)
+        self.assertTrue(post.thumbnail_url)
+        response = self.guest_client.get(reverse('index'))
+        self.assertContains(response, post.thumbnail_url)
+
+    def test_thumbnail_follows_image(self):
+        """Правка текста сохраняет миниатюру, смена картинки - меняет."""
+        post = Post.objects.get(pk=self.test_post.pk)
+        thumbnail = post.thumbnail_url
+        self.assertTrue(thumbnail)
+        post.text = 'Новый текст'
+        post.save()
+        self.assertEqual(post.thumbnail_url, thumbnail)
+
+        buffer = BytesIO()
+        Image.new('RGB', (30, 10), 'blue').save(buffer, 'PNG')
+        post.image = SimpleUploadedFile('other.png', buffer.getvalue(),
+                                        content_type='image/png')
+        post.save()
+        post.refresh_from_db()
+        self.assertTrue(post.thumbnail_url)
+        self.assertNotEqual(post.thumbnail_url, thumbnail)
+
+    def test_generate_thumbnails_command(self):
+        """Команда достраивает недостающие миниатюры."""
+        Post.objects.update(thumbnail_url='', renditions='')
+        version = Post.objects.get(pk=self.test_post.pk).card_version
+        call_command('generate_thumbnails', '--workers', '1',
+                     stdout=StringIO())
+        post = Post.objects.get(pk=self.test_post.pk)
+        self.assertTrue(post.thumbnail_url)
+        self.assertEqual(post.card_version, version + 1)
+
+    def test_renditions_for_each_width_and_format(self):
+        """Большая картинка получает все ширины, в ленте - srcset."""
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 600), 'red').save(buffer, 'PNG')
+        post = Post.objects.create(
+            text='Большая картинка', author=self.test_user,
+            image=SimpleUploadedFile('big.png', buffer.getvalue(),
+                                     content_type='image/png'),
+        )
+        renditions = json.loads(post.renditions)
+        formats = thumbnails.formats()
+        self.assertIn('webp', formats)
+        self.assertCountEqual(
+            [(item['format'], item['width']) for item in renditions['items']],
+            [(name, width) for width in thumbnails.WIDTHS
+             for name in formats],
+        )
+        response = self.guest_client.get(reverse('index'))
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, ' 640w, ')
+
+        out = StringIO()
+        call_command('image_stats', stdout=out)
+        self.assertIn('webp', out.getvalue())
+
+
+class MediaStorageTests(MyTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.storage = Post._meta.get_field('image').storage
+
+    def create_post(self, name):
+        return Post.objects.create(
+            text='Копия картинки', author=self.test_user,
+            image=SimpleUploadedFile(name, self.small_gif,
+                                     content_type='image/gif'),
+        )
+
+    def test_same_image_is_stored_once(self):
+        """Одинаковые картинки хранятся одним файлом со счётчиком ссылок."""
+        first = self.create_post('first.gif')
+        second = self.create_post('second.gif')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(first.image.name, self.test_post.image.name)
+        self.assertTrue(source_hash(first.image.name))
+        self.assertEqual(first.renditions, second.renditions)
+        self.assertEqual(MediaFile.objects.get(name=first.image.name).refs,
+                         3)
+
+        second.delete()
+        self.assertEqual(MediaFile.objects.get(name=first.image.name).refs,
+                         2)
+        self.assertTrue(self.storage.exists(first.image.name))
+
+    def test_unused_image_is_deleted_with_renditions(self):
+        """Без ссылок удаляется и исходник, и все его варианты."""
+        buffer = BytesIO()
+        Image.new('RGB', (700, 300), 'green').save(buffer, 'PNG')
+        post = Post.objects.create(
+            text='Своя картинка', author=self.test_user,
+            image=SimpleUploadedFile('own.png', buffer.getvalue(),
+                                     content_type='image/png'),
+        )
+        name = post.image.name
+        paths = thumbnails.rendition_paths(name)
+        self.assertEqual(len(paths), len(json.loads(post.renditions)['items']))
+        post.delete()
+        # в TestCase on_commit не срабатывает
+        files, size = media.delete_unused([name])
+        self.assertEqual(files, 1 + len(paths))
+        self.assertFalse(self.storage.exists(name))
+        self.assertEqual(thumbnails.rendition_paths(name), [])
+        self.assertTrue(
+            thumbnails.rendition_paths(self.test_post.image.name)
+        )
+
+    def test_dedupe_media_command(self):
+        """Команда переносит старые файлы и удаляет дубликаты."""
+        posts = []
+        for name in ('posts/legacy1.gif', 'posts/legacy2.gif'):
+            FileSystemStorage.save(self.storage, name,
+                                   ContentFile(self.small_gif))
+            post = self.create_post('new.gif')
+            Post.objects.filter(pk=post.pk).update(image=name)
+            posts.append(post)
+
+        out = StringIO()
+        call_command('dedupe_media', stdout=out)
+        self.assertIn('Из них дубликатов: 2', out.getvalue())
+        for post in posts:
+            post.refresh_from_db()
+            self.assertEqual(post.image.name, self.test_post.image.name)
+        self.assertFalse(self.storage.exists('posts/legacy1.gif'))
+        self.assertEqual(
+            MediaFile.objects.get(name=self.test_post.image.name).refs, 3
+        )
+
+
+class UploadTests(MyTestCase):
+    def png(self, size, mode='RGB'):
+        buffer = BytesIO()
+        Image.new(mode, size).save(buffer, 'PNG')
+        return SimpleUploadedFile('upload.png', buffer.getvalue(),
+                                  content_type='image/png')
+
+    def publish(self, image):
+        return self.authorized_client.post(
+            reverse('new_post'), {'text': 'Загрузка', 'image': image}
+        )
+
+    def test_valid_upload_reports_metrics(self):
+        """Картинка сохраняется, метрики загрузки отдаются в Server-Timing."""
+        response = self.publish(self.png((40, 20)))
+        self.assertRedirects(response, reverse('index'))
+        self.assertTrue(Post.objects.get(text='Загрузка').image)
+        self.assertIn('upload;dur=', response['Server-Timing'])
+
+    @override_settings(POSTS_UPLOAD_MAX_BYTES=1024)
+    def test_oversized_file_is_rejected(self):
+        """Слишком большой файл отклоняется с ошибкой формы."""
+        image = SimpleUploadedFile('big.gif', self.small_gif * 100,
+                                   content_type='image/gif')
+        response = self.publish(image)
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response, 'form', 'image',
+                             'Файл слишком большой.')
+        self.assertFalse(Post.objects.filter(text='Загрузка').exists())
+
+    @override_settings(POSTS_UPLOAD_MAX_PIXELS=1000 * 1000)
+    def test_decompression_bomb_is_rejected(self):
+        """Маленький файл с огромным разрешением отклоняется по заголовку."""
+        response = self.publish(self.png((5000, 5000), mode='1'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(
+            response, 'form', 'image',
+            'Слишком большое разрешение картинки: 5000x5000.'
+        )
+        self.assertFalse(Post.objects.filter(text='Загрузка').exists())
+
+
+class SearchTests(MyTestCase):
+    def found_ids(self, query, **params):
+        response = self.guest_client.get(reverse('search'),
+                                         {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [post.id for post in response.context.get('page')]
+
+    def test_search_finds_posts_by_text_and_comments(self):
+        """Поиск находит посты по словам из текста и из комментариев."""
+        post = Post.objects.create(text='Про котиков', author=self.test_user)
+        Comment.objects.create(post=self.test_post, author=self.test_author,
+                               text='Котик одобряет')
+        self.assertEqual(self.found_ids('пятнадцати'), [self.test_post.id])
+        self.assertCountEqual(self.found_ids('котик'),
+                              [post.id, self.test_post.id])
+        self.assertEqual(self.found_ids('жирафы'), [])
+
+    def test_index_follows_edits_and_deletes(self):
+        """Правка и удаление поста сразу видны в поиске."""
+        post = Post.objects.create(text='Старое слово', author=self.test_user)
+        post.text = 'Новое слово'
+        post.save()
+        self.assertEqual(self.found_ids('старое'), [])
+        self.assertEqual(self.found_ids('новое'), [post.id])
+        post.delete()
+        self.assertEqual(self.found_ids('новое'), [])
+
+    def test_search_is_paginated_with_query(self):
+        """Ссылки паджинатора сохраняют поисковый запрос."""
+        Post.objects.bulk_create(
+            Post(text=f'Заметка {i}', author=self.test_user)
+            for i in range(POSTS_PER_PAGE + 1)
+        )
+        search.reindex()
+        self.assertEqual(len(self.found_ids('заметка')), POSTS_PER_PAGE)
+        self.assertEqual(len(self.found_ids('заметка', page=2)), 1)
+        response = self.guest_client.get(reverse('search'), {'q': 'заметка'})
+        self.assertContains(response, '?q=%D0%B7%D0%B0%D0%BC%D0%B5%D1%82'
+                                      '%D0%BA%D0%B0&amp;page=2')
+
+    def test_fallback_matches_index(self):
+        """Поиск без индекса находит те же посты."""
+        fallback = search.SearchResults(search.FallbackBackend(), 'текст')
+        indexed = search.search('текст')
+        self.assertEqual([post.id for post in fallback[:10]],
+                         [post.id for post in indexed[:10]])
+
+
+class CommentPaginationTests(MyTestCase):
+    def add_comments(self, count):
+        Comment.objects.bulk_create(
+            Comment(post=self.test_post, author=self.test_author,
+                    text=f'Комментарий {i}')
+            for i in range(count)
+        )
+
+    def post_url(self, name='post'):
+        return reverse(name, kwargs={'username': self.test_user.username,
+                                     'post_id': self.test_post.id})
+
+    def test_comments_are_paged_by_cursor(self):
+        """На странице поста первая порция, остальное - фрагментом."""
+        self.add_comments(COMMENTS_PER_PAGE + 4)
+        response = self.guest_client.get(self.post_url())
+        page = response.context['comments_page']
+        self.assertEqual(len(page), COMMENTS_PER_PAGE)
+        self.assertContains(response, 'js-more-comments')
+
+        response = self.guest_client.get(self.post_url('post_comments'),
+                                         {'cursor': page.next_cursor})
+        rest = response.context['comments_page']
+        self.assertEqual(len(rest), 5)
+        self.assertFalse(rest.has_next())
+        self.assertNotContains(response, 'js-more-comments')
+        shown = [c.id for c in page] + [c.id for c in rest]
+        self.assertEqual(shown, list(
+            Comment.objects.order_by('-created', '-id')
+            .values_list('id', flat=True)
+        ))
+
+    def test_comment_authors_are_selected_together(self):
+        """Число запросов фрагмента не зависит от числа комментариев."""
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.guest_client.get(self.post_url('post_comments'))
+            return len(queries)
+
+        self.add_comments(2)
+        few = count_queries()
+        self.add_comments(COMMENTS_PER_PAGE)
+        self.assertEqual(count_queries(), few)
+
+
 class CommentTests(MyTestCase):
     def test_authorized_user_can_comment(self):
         """Авторизованный пользователь может комментировать посты."""
@@ -0,0 +1,332 @@
+"""Заранее построенные варианты картинок постов.
+
+При сохранении поста с новой картинкой она один раз декодируется,
+обрезается под пропорции карточки и сохраняется в нескольких ширинах
+и форматах (AVIF, если его умеет Pillow, WebP и JPEG). Список
+вариантов лежит в Post.renditions, а самый широкий JPEG - ещё и в
+Post.thumbnail_url, поэтому шаблоны выводят <picture> со srcset и не
+обращаются к Pillow во время запроса. Пока вариантов нет, карточка
+показывает исходную картинку.
+
+Настройки:
+    POSTS_THUMBNAIL_WORKERS - число потоков для построения вариантов
+        после коммита транзакции; 0 (по умолчанию) - строить сразу
+        при сохранении поста;
+    POSTS_IMAGE_WIDTHS - ширины вариантов в пикселях;
+    POSTS_IMAGE_FORMATS - форматы в порядке предпочтения, неизвестные
+        установленному Pillow пропускаются.
+"""
+import hashlib
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from . import page_cache
+from .models import Post
+from .storage import source_hash
+
+
+logger = logging.getLogger(__name__)
+
+# Пропорции карточки поста, как у прежней миниатюры 960x339
+ASPECT = 339 / 960
+WIDTHS = (320, 640, 960)
+FORMATS = ('avif', 'webp', 'jpeg')
+SAVE_OPTIONS = {
+    'avif': {'format': 'AVIF', 'quality': 60},
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 85, 'optimize': True,
+             'progressive': True},
+}
+EXTENSIONS = {'avif': 'avif', 'webp': 'webp', 'jpeg': 'jpg'}
+UPLOAD_TO = 'renditions'
+
+_executor = None
+
+
+def workers():
+    return getattr(settings, 'POSTS_THUMBNAIL_WORKERS', 0)
+
+
+def widths():
+    return sorted(getattr(settings, 'POSTS_IMAGE_WIDTHS', WIDTHS))
+
+
+def formats():
+    """Форматы из настроек, которые умеет сохранять установленный Pillow."""
+    Image.init()
+    wanted = getattr(settings, 'POSTS_IMAGE_FORMATS', FORMATS)
+    return [name for name in wanted
+            if name in SAVE_OPTIONS
+            and SAVE_OPTIONS[name]['format'] in Image.SAVE]
+
+
+def target_widths(source_width):
+    """Ширины не больше исходной; у маленькой картинки - самая узкая."""
+    allowed = [width for width in widths() if width <= source_width]
+    return allowed or widths()[:1]
+
+
+def _encode(picture, name):
+    buffer = BytesIO()
+    picture.save(buffer, **SAVE_OPTIONS[name])
+    return buffer.getvalue()
+
+
+def _prefix(name):
+    # Варианты одинаковых картинок совпадают, поэтому ключ - хеш исходника
+    return source_hash(name) or hashlib.md5(name.encode()).hexdigest()
+
+
+def rendition_paths(name):
+    """Пути всех сохранённых вариантов картинки name в хранилище."""
+    prefix = _prefix(name)
+    folder = f'{UPLOAD_TO}/{prefix[:2]}'
+    try:
+        _, files = default_storage.listdir(folder)
+    except FileNotFoundError:
+        return []
+    return [f'{folder}/{file}' for file in sorted(files)
+            if file.startswith(f'{prefix}_')]
+
+
+def delete_renditions(name):
+    """Удаляет варианты картинки name. Возвращает (файлов, байт)."""
+    files = size = 0
+    for path in rendition_paths(name):
+        size += default_storage.size(path)
+        default_storage.delete(path)
+        files += 1
+    return files, size
+
+
+def build(image):
+    """Строит все варианты картинки и сохраняет их в хранилище.
+
+    Возвращает словарь для Post.renditions: размер исходника
+    и список вариантов с форматом, шириной, URL и размером в байтах.
+    """
+    with image.storage.open(image.name, 'rb') as source:
+        original = Image.open(source)
+        original.load()
+    original = ImageOps.exif_transpose(original).convert('RGB')
+    original_size = image.storage.size(image.name)
+
+    sizes = target_widths(original.width)
+    largest = ImageOps.fit(
+        original, (sizes[-1], max(1, round(sizes[-1] * ASPECT))),
+        Image.LANCZOS
+    )
+    prefix = _prefix(image.name)
+    items = []
+    for width in sizes:
+        height = max(1, round(width * ASPECT))
+        picture = largest if width == sizes[-1] else largest.resize(
+            (width, height), Image.LANCZOS
+        )
+        for name in formats():
+            data = _encode(picture, name)
+            path = (f'{UPLOAD_TO}/{prefix[:2]}/{prefix}_{width}.'
+                    f'{EXTENSIONS[name]}')
+            if default_storage.exists(path):
+                default_storage.delete(path)
+            path = default_storage.save(path, ContentFile(data))
+            items.append({'format': name, 'width': width,
+                          'url': default_storage.url(path),
+                          'size': len(data)})
+    return {'original': original_size, 'items': items}
+
+
+def known_renditions(image, post_id=None):
+    """Готовые варианты той же картинки у другого поста."""
+    if not source_hash(image.name):
+        return None
+    raw = Post.objects.filter(image=image.name).exclude(
+        renditions=''
+    ).exclude(pk=post_id).values_list('renditions', flat=True).first()
+    return json.loads(raw) if raw else None
+
+
+def render(image, post_id=None, reuse=True):
+    """Строит варианты картинки, None - если картинку не прочитать.
+
+    Если та же картинка уже есть у другого поста, варианты берутся
+    у него без декодирования (reuse=False строит их заново).
+    """
+    try:
+        known = reuse and known_renditions(image, post_id)
+        if known:
+            return known
+        if not image.storage.exists(image.name):
+            return None
+        return build(image)
+    except Exception:
+        logger.warning('Не удалось построить варианты картинки %s', image,
+                       exc_info=True)
+        return None
+
+
+def largest_jpeg(renditions):
+    jpegs = [item for item in renditions['items']
+             if item['format'] == 'jpeg']
+    return max(jpegs, key=lambda item: item['width'])['url'] if jpegs else ''
+
+
+def store(post_id, image, renditions, bump=False):
+    """Сохраняет варианты, если картинка поста не успела смениться.
+
+    bump увеличивает версию карточки: нужно, когда карточка с исходной
+    картинкой могла уже попасть в кэш.
+    """
+    fields = {'thumbnail_url': largest_jpeg(renditions),
+              'renditions': json.dumps(renditions)}
+    if bump:
+        fields.update(card_version=F('card_version') + 1,
+                      updated=timezone.now())
+    return Post.objects.filter(pk=post_id, image=image).update(**fields)
+
+
+def remember_image(instance, update_fields=None):
+    """Вызывается из pre_save: сбрасывает варианты при смене картинки."""
+    if update_fields is not None and 'image' not in update_fields:
+        instance._image_changed = False
+        return
+    if instance._state.adding:
+        old = None
+    else:
+        old = Post.objects.filter(
+            pk=instance.pk
+        ).values_list('image', flat=True).first()
+    instance._old_image = old or ''
+    instance._image_changed = (old or '') != (instance.image.name or '')
+    if instance._image_changed:
+        instance.thumbnail_url = ''
+        instance.renditions = ''
+
+
+def image_changed(instance):
+    return getattr(instance, '_image_changed', False)
+
+
+def old_image(instance):
+    return getattr(instance, '_old_image', '')
+
+
+def _generate(post_id, image):
+    try:
+        post = Post.objects.filter(pk=post_id, image=image).first()
+        if post is not None:
+            renditions = render(post.image, post_id)
+            if renditions and store(post_id, image, renditions, bump=True):
+                page_cache.invalidate('feed')
+    finally:
+        connections.close_all()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=workers(),
+                                       thread_name_prefix='thumbnails')
+    return _executor
+
+
+def schedule(post):
+    """Строит варианты картинки только что сохранённого поста.
+
+    Без пула потоков варианты строятся сразу; с пулом - в фоне
+    после коммита, чтобы поток увидел сохранённый пост.
+    """
+    if not post.image:
+        return
+    image = post.image.name
+    if not workers():
+        renditions = render(post.image, post.pk)
+        if renditions:
+            store(post.pk, image, renditions)
+            post.thumbnail_url = largest_jpeg(renditions)
+            post.renditions = json.dumps(renditions)
+        return
+    transaction.on_commit(
+        lambda: get_executor().submit(_generate, post.pk, image)
+    )
+
+
+def backfill(force=False, threads=1, batch_size=100):
+    """Строит недостающие варианты. Возвращает (построено, ошибок).
+
+    Картинки обрабатываются параллельно в threads потоках, а результат
+    сохраняется из вызывающего потока.
+    """
+    posts = Post.objects.exclude(image='').exclude(image__isnull=True)
+    if not force:
+        posts = posts.filter(renditions='')
+    posts = posts.only('pk', 'image').order_by('pk')
+
+    built = failed = 0
+    executor = ThreadPoolExecutor(threads) if threads > 1 else None
+    try:
+        batch = []
+        for post in posts.iterator():
+            batch.append(post)
+            if len(batch) == batch_size:
+                done = _backfill_batch(batch, executor, not force)
+                built, failed = built + done, failed + len(batch) - done
+                batch = []
+        done = _backfill_batch(batch, executor, not force)
+        built, failed = built + done, failed + len(batch) - done
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    if built:
+        page_cache.invalidate('feed')
+    return built, failed
+
+
+def _render_in_thread(image, reuse):
+    try:
+        return render(image, reuse=reuse)
+    finally:
+        connections.close_all()
+
+
+def _backfill_batch(batch, executor, reuse):
+    images = [post.image for post in batch]
+    if executor is None:
+        results = [render(image, reuse=reuse) for image in images]
+    else:
+        results = executor.map(_render_in_thread, images,
+                               [reuse] * len(images))
+    done = 0
+    for post, renditions in zip(batch, list(results)):
+        if renditions:
+            store(post.pk, post.image.name, renditions, bump=True)
+            done += 1
+    return done
+
+
+def stats(posts=None):
+    """Сводка по вариантам картинок.
+
+    Возвращает {(формат, ширина): [штук, байт, байт исходников]}.
+    """
+    posts = Post.objects.exclude(renditions='') if posts is None else posts
+    result = {}
+    for raw in posts.values_list('renditions', flat=True).iterator():
+        renditions = json.loads(raw)
+        for item in renditions['items']:
+            row = result.setdefault((item['format'], item['width']),
+                                    [0, 0, 0])
+            row[0] += 1
+            row[1] += item['size']
+            row[2] += renditions['original']
+    return result
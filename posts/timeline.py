@@ -0,0 +1,243 @@
+"""Материализованная лента подписок (fan-out on write).
+
+Когда автор публикует пост, ссылка на него раскладывается в ленты всех
+его подписчиков, и follow_index читает ленту одним диапазоном по индексу
+(user, -pub_date, -post) вместо соединения Post с Follow: страница
+выбирается из TimelineEntry, а её посты догружаются по первичному ключу
+(см. TimelineFeed). У очень популярных авторов
+(POSTS_TIMELINE_FANOUT_LIMIT подписчиков и больше) раскладка не делается:
+автор отмечается в TimelinePull, и его посты подмешиваются в ленту при
+чтении. Отметка остаётся, когда подписчиков становится меньше порога,
+- иначе посты, не попавшие в ленты, пропали бы из них; снимает её
+перестройка лент.
+
+Включается настройкой POSTS_TIMELINE_ENABLED; после включения ленты
+существующих пользователей заполняет manage.py rebuild_timeline.
+Без неё лента выбирается по списку авторов из posts.follow_graph.
+"""
+from django.conf import settings
+from django.core.exceptions import FieldError
+from django.db import connection, transaction
+from django.db.models import Q
+
+from . import follow_graph
+from .models import Follow, Post, TimelineEntry, TimelinePull, UserCounters
+
+
+BATCH_SIZE = 1000
+# Больше авторов в IN () не передаём, а соединяем с Follow
+FOLLOW_GRAPH_IN_LIMIT = 500
+
+
+def is_enabled():
+    return getattr(settings, 'POSTS_TIMELINE_ENABLED', False)
+
+
+def fanout_limit():
+    return getattr(settings, 'POSTS_TIMELINE_FANOUT_LIMIT', 10000)
+
+
+def backfill_limit():
+    return getattr(settings, 'POSTS_TIMELINE_BACKFILL', 1000)
+
+
+def is_popular(author_id):
+    return UserCounters.objects.filter(
+        user_id=author_id, followers_count__gte=fanout_limit()
+    ).exists()
+
+
+def _bulk_insert(entries):
+    TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE,
+                                      ignore_conflicts=True)
+
+
+def _pull(author_id):
+    """Отмечает, что посты автора читаются при чтении ленты."""
+    TimelinePull.objects.bulk_create([TimelinePull(author_id=author_id)],
+                                     ignore_conflicts=True)
+
+
+def fan_out(post):
+    """Добавляет новый пост в ленты подписчиков автора."""
+    if not is_enabled():
+        return
+    if is_popular(post.author_id):
+        _pull(post.author_id)
+        return
+    followers = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    _bulk_insert(
+        TimelineEntry(user_id=user_id, post_id=post.pk,
+                      author_id=post.author_id, pub_date=post.pub_date)
+        for user_id in followers.iterator()
+    )
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту подписчика последние посты автора."""
+    if not is_enabled():
+        return
+    if is_popular(author_id):
+        # Старые посты автора могут быть только в чужих лентах
+        _pull(author_id)
+        return
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date'
+    ).values_list('pk', 'pub_date')[:backfill_limit()]
+    _bulk_insert(
+        TimelineEntry(user_id=user_id, post_id=post_id, author_id=author_id,
+                      pub_date=pub_date)
+        for post_id, pub_date in posts
+    )
+
+
+def prune(user_id, author_id):
+    """Убирает из ленты посты автора, от которого пользователь отписался."""
+    if is_enabled():
+        TimelineEntry.objects.filter(user_id=user_id,
+                                     author_id=author_id).delete()
+
+
+class TimelineFeed:
+    """Посты материализованной ленты в виде, понятном паджинаторам.
+
+    Срез выбирает post_id диапазоном по индексу TimelineEntry в порядке
+    (-pub_date, -post_id), без соединения с Post, а посты (или словари
+    values()) догружаются вторым запросом по первичному ключу. Из
+    методов QuerySet повторены те, что нужны Paginator, CursorPaginator,
+    API и feed_explain; поля постов в условиях и сортировке переводятся
+    в поля записи по FIELDS.
+    """
+
+    model = Post
+    FIELDS = {'pk': 'post_id', 'id': 'post_id', 'pub_date': 'pub_date'}
+
+    def __init__(self, entries, fields=None):
+        self.entries = entries
+        self.fields = fields
+        self._result = None
+
+    def _clone(self, entries, fields=None):
+        return TimelineFeed(entries, fields or self.fields)
+
+    def _field(self, name):
+        prefix = '-' if name.startswith('-') else ''
+        field, _, lookup = name.lstrip('-').partition('__')
+        if field not in self.FIELDS:
+            raise FieldError(f'Лента подписок не сортирует и не '
+                             f'фильтрует по полю {field}.')
+        return prefix + self.FIELDS[field] + (f'__{lookup}' if lookup
+                                               else '')
+
+    def _condition(self, condition):
+        if isinstance(condition, Q):
+            return Q(*map(self._condition, condition.children),
+                     _connector=condition.connector,
+                     _negated=condition.negated)
+        lookup, value = condition
+        return self._field(lookup), value
+
+    def filter(self, *args, **kwargs):
+        return self._clone(self.entries.filter(
+            *map(self._condition, args),
+            **dict(map(self._condition, kwargs.items()))
+        ))
+
+    def order_by(self, *names):
+        return self._clone(self.entries.order_by(*map(self._field, names)))
+
+    def values(self, *fields):
+        return self._clone(self.entries, fields)
+
+    def count(self):
+        return self.entries.count()
+
+    def explain(self, **options):
+        return self.entries.explain(**options)
+
+    def _fetch(self):
+        ids = list(self.entries.values_list('post_id', flat=True))
+        posts = Post.objects.for_feed().filter(pk__in=ids)
+        if self.fields:
+            found = {row['id']: row
+                     for row in posts.values('id', *self.fields)}
+        else:
+            found = posts.in_bulk()
+        # Пост мог быть удалён между двумя запросами
+        return [found[pk] for pk in ids if pk in found]
+
+    def _fetch_all(self):
+        if self._result is None:
+            self._result = self._fetch()
+        return self._result
+
+    def __iter__(self):
+        return iter(self._fetch_all())
+
+    def __len__(self):
+        return len(self._fetch_all())
+
+    def __getitem__(self, key):
+        if self._result is not None:
+            return self._result[key]
+        if isinstance(key, slice):
+            return self._clone(self.entries[key])
+        return self._clone(self.entries[key:key + 1])._fetch_all()[0]
+
+
+def follow_feed(user):
+    """Посты авторов, на которых подписан пользователь."""
+    posts = Post.objects.for_feed()
+    if not is_enabled():
+        if follow_graph.is_active():
+            authors = follow_graph.followees(user.pk)
+            if len(authors) <= FOLLOW_GRAPH_IN_LIMIT:
+                return posts.filter(author_id__in=list(authors))
+        return posts.filter(author__following__user=user)
+
+    pulled = list(Follow.objects.filter(
+        user=user, author__timeline_pull__isnull=False
+    ).values_list('author_id', flat=True))
+    if not pulled:
+        return TimelineFeed(TimelineEntry.objects.filter(
+            user=user
+        ).order_by('-pub_date', '-post_id'))
+    # Гибридный режим: посты популярных авторов читаются напрямую.
+    return posts.filter(
+        Q(pk__in=TimelineEntry.objects.filter(user=user).values('post_id'))
+        | Q(author_id__in=pulled)
+    )
+
+
+@transaction.atomic
+def rebuild():
+    """Перестраивает все ленты одним INSERT ... SELECT.
+
+    Возвращает количество записей в лентах после перестройки.
+    """
+    TimelineEntry.objects.all().delete()
+    timeline = TimelineEntry._meta.db_table
+    follow = Follow._meta.db_table
+    post = Post._meta.db_table
+    counters = UserCounters._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {timeline} (user_id, post_id, author_id, pub_date) '
+            f'SELECT DISTINCT f.user_id, p.id, p.author_id, p.pub_date '
+            f'FROM {follow} f '
+            f'JOIN {post} p ON p.author_id = f.author_id '
+            f'LEFT JOIN {counters} c ON c.user_id = f.author_id '
+            f'WHERE COALESCE(c.followers_count, 0) < %s',
+            [fanout_limit()]
+        )
+    TimelinePull.objects.all().delete()
+    TimelinePull.objects.bulk_create(
+        (TimelinePull(author_id=author_id)
+         for author_id in UserCounters.objects.filter(
+             followers_count__gte=fanout_limit()
+         ).values_list('user_id', flat=True).iterator()),
+        batch_size=BATCH_SIZE,
+    )
+    return TimelineEntry.objects.count()
@@ -0,0 +1,161 @@
+"""Потоковая загрузка картинок постов с ограничением по памяти.
+
+Стандартные обработчики Django держат небольшие файлы в памяти, а
+ImageField формы читает такой файл целиком в BytesIO. Здесь файл
+всегда пишется на диск кусками, заголовок картинки читается лениво
+(Pillow без декодирования узнаёт формат и размеры), а слишком большие
+файлы и "бомбы декомпрессии" отклоняются до того, как их кто-нибудь
+декодирует. Отклонённый файл не попадает в request.FILES, а причина
+добавляется к ошибкам формы.
+
+По каждой загрузке собираются метрики: размер, число кусков, время
+приёма и прирост пикового RSS процесса. Они пишутся в лог
+posts.uploads, лежат в request.upload_metrics и отдаются заголовком
+Server-Timing.
+
+Настройки:
+    POSTS_UPLOAD_MAX_BYTES - максимальный размер файла;
+    POSTS_UPLOAD_MAX_PIXELS - максимальное число пикселей картинки;
+    POSTS_UPLOAD_FORMATS - допустимые форматы Pillow.
+"""
+import logging
+import resource
+import time
+import warnings
+from functools import wraps
+
+from django.conf import settings
+from django.core.files.uploadhandler import (SkipFile,
+                                             TemporaryFileUploadHandler)
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from PIL import Image
+
+
+logger = logging.getLogger(__name__)
+
+MAX_BYTES = 10 * 1024 * 1024
+MAX_PIXELS = 40 * 1000 * 1000
+FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+# Запас на остальные поля формы при проверке Content-Length запроса
+FORM_OVERHEAD = 64 * 1024
+
+
+def max_bytes():
+    return getattr(settings, 'POSTS_UPLOAD_MAX_BYTES', MAX_BYTES)
+
+
+def max_pixels():
+    return getattr(settings, 'POSTS_UPLOAD_MAX_PIXELS', MAX_PIXELS)
+
+
+def allowed_formats():
+    return getattr(settings, 'POSTS_UPLOAD_FORMATS', FORMATS)
+
+
+def peak_rss():
+    """Пиковый RSS процесса в килобайтах (на Linux ru_maxrss уже в КБ)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def probe(path):
+    """Читает заголовок картинки без декодирования.
+
+    Возвращает текст ошибки или None, если картинка подходит.
+    """
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', Image.DecompressionBombWarning)
+            with Image.open(path) as image:
+                image_format, (width, height) = image.format, image.size
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+        return 'Слишком большое разрешение картинки.'
+    except Exception:
+        return 'Загрузите правильное изображение.'
+    if image_format not in allowed_formats():
+        return f'Формат {image_format} не поддерживается.'
+    if width * height > max_pixels():
+        return f'Слишком большое разрешение картинки: {width}x{height}.'
+    return None
+
+
+class BoundedImageUploadHandler(TemporaryFileUploadHandler):
+    """Пишет файлы на диск кусками и отклоняет неподходящие картинки."""
+
+    def handle_raw_input(self, input_data, META, content_length, boundary,
+                         encoding=None):
+        self.content_length = content_length
+        self.request.upload_errors = {}
+        self.request.upload_metrics = []
+
+    def reject(self, message):
+        self.request.upload_errors[self.field_name] = message
+        self.metrics['rejected'] = message
+        self.finish()
+
+    def finish(self):
+        self.metrics['seconds'] = time.perf_counter() - self.started
+        self.metrics['rss_growth_kb'] = peak_rss() - self.rss
+        self.request.upload_metrics.append(self.metrics)
+        logger.info('Загрузка %s: %s', self.file_name, self.metrics)
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.started = time.perf_counter()
+        self.rss = peak_rss()
+        self.metrics = {'field': field_name, 'bytes': 0, 'chunks': 0,
+                        'chunk_size': self.chunk_size}
+        length = self.content_length or 0
+        if length > max_bytes() + FORM_OVERHEAD:
+            self.reject('Файл слишком большой.')
+            raise SkipFile
+
+    def receive_data_chunk(self, raw_data, start):
+        self.metrics['bytes'] += len(raw_data)
+        self.metrics['chunks'] += 1
+        if start + len(raw_data) > max_bytes():
+            self.reject('Файл слишком большой.')
+            raise SkipFile
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        error = probe(uploaded.temporary_file_path())
+        if error:
+            uploaded.close()
+            self.reject(error)
+            return None
+        self.finish()
+        return uploaded
+
+
+def add_upload_errors(request, form):
+    """Переносит причины отклонения файлов в ошибки формы."""
+    for field, message in getattr(request, 'upload_errors', {}).items():
+        form.add_error(field, message)
+
+
+def server_timing(metrics):
+    return ', '.join(
+        f'upload;dur={item["seconds"] * 1000:.1f};'
+        f'desc="{item["field"]} {item["bytes"]}B"'
+        for item in metrics
+    )
+
+
+def bounded_image_upload(view):
+    """Включает BoundedImageUploadHandler для view.
+
+    Обработчики загрузки нельзя менять после того, как CsrfViewMiddleware
+    прочитала request.POST, поэтому проверка CSRF переносится внутрь.
+    """
+    protected = csrf_protect(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        request.upload_handlers = [BoundedImageUploadHandler(request)]
+        response = protected(request, *args, **kwargs)
+        metrics = getattr(request, 'upload_metrics', None)
+        if metrics:
+            response['Server-Timing'] = server_timing(metrics)
+        return response
+    return csrf_exempt(wrapper)
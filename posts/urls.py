@@ -6,16 +6,20 @@ from . import views
 urlpatterns = [
     path('', views.index, name='index'),
     path('follow/', views.follow_index, name='follow_index'),
+    path('follow/batch/', views.follow_batch, name='follow_batch'),
     path('<str:username>/follow/', views.profile_follow,
          name='profile_follow'),
     path('<str:username>/unfollow/', views.profile_unfollow,
          name='profile_unfollow'),
     path('group/<slug:slug>/', views.group_posts, name='group'),
     path('new/', views.new_post, name='new_post'),
+    path('search/', views.search, name='search'),
     path('<str:username>/', views.profile, name='profile'),
     path('<str:username>/<int:post_id>/', views.post_view, name='post'),
     path('<str:username>/<int:post_id>/edit/', views.post_edit,
          name='post_edit'),
+    path('<str:username>/<int:post_id>/comments/', views.post_comments,
+         name='post_comments'),
     path('<username>/<int:post_id>/comment/', views.add_comment,
          name='add_comment'),
     path('404/', views.page_not_found, name='404'),
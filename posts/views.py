@@ -1,45 +1,200 @@
+import time
+from datetime import datetime
+from urllib.parse import urlencode
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
+from django.db import transaction
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.shortcuts import render
-
+from django.utils import timezone
+from django.views.decorators.http import require_POST
+
+from . import follow_graph, timeline
+from . import search as post_search
+from .conditional import feed_condition
+from .constants import COMMENT_ORDERING, COMMENTS_PER_PAGE, POSTS_PER_PAGE
+from .degrade import serve_stale_on_error
+from .existence import require_existing
+from .follows import follow_many, resolve_usernames, unfollow_many
 from .forms import CommentForm, PostForm
 from .models import Follow, Group, Post, User
+from .page_cache import cache_anonymous_page
+from .paginator import CursorPaginator
+from .replicas import pin_primary, read_replica
+from .uploads import add_upload_errors, bounded_image_upload
 
 
-POSTS_PER_PAGE = 10
+INDEX_CACHE_SECONDS = 20
+SEARCH_QUERY_LENGTH = 200
+FOLLOW_BATCH_LIMIT = 1000
+CURSOR_PAGINATION = getattr(settings, 'POSTS_CURSOR_PAGINATION', False)
+PAGE_STATE_FIELDS = ('id', 'pub_date', 'card_version', 'comment_count',
+                     'updated')
+AUTHOR_STATE_FIELDS = ('first_name', 'last_name',
+                       'counters__followers_count',
+                       'counters__following_count',
+                       'counters__posts_count', 'counters__updated')
 
 
 def check_following(user, author):
     """Проверяет наличие одписки на автора."""
-    return user.is_authenticated and user != author and user.follower.filter(
-        author=author
-    ).exists()
-
-
+    return (user.is_authenticated and user != author
+            and follow_graph.is_following(user.pk, author.pk))
+
+
+def get_page(request, object_list):
+    """Возвращает страницу ленты и её паджинатор.
+
+    По умолчанию используется обычный Paginator с номерами страниц.
+    Если включена настройка POSTS_CURSOR_PAGINATION или в запросе
+    передан параметр cursor, лента листается по курсору (pub_date, id)
+    без подсчёта количества записей.
+    """
+    if CURSOR_PAGINATION or 'cursor' in request.GET:
+        paginator = CursorPaginator(object_list, POSTS_PER_PAGE)
+        return paginator.get_page(request.GET.get('cursor')), paginator
+    paginator = Paginator(object_list, POSTS_PER_PAGE)
+    return paginator.get_page(request.GET.get('page')), paginator
+
+
+def page_state(request, posts):
+    """Описывает видимую страницу ленты для условного GET.
+
+    Выбирает только поля PAGE_STATE_FIELDS строк страницы одним
+    запросом, без select_related, моделей и COUNT(*). Число страниц
+    в валидатор не входит: в профиле его заменяет posts_count, на
+    главной - окно INDEX_CACHE_SECONDS, а в группе навигация после
+    удаления поста с дальней страницы обновится вместе с первым
+    изменением строк этой страницы. Номер за пределами ленты
+    Paginator заменил бы последней страницей, которую без подсчёта не
+    описать, поэтому для него валидатора нет: возвращается (None, None).
+    """
+    rows = posts.values(*PAGE_STATE_FIELDS)
+    if CURSOR_PAGINATION or 'cursor' in request.GET:
+        paginator = CursorPaginator(rows, POSTS_PER_PAGE)
+        rows = paginator.get_page(request.GET.get('cursor')).object_list
+    else:
+        try:
+            number = int(request.GET.get('page', 1))
+        except (TypeError, ValueError):
+            number = 1
+        if number < 1:
+            return None, None
+        offset = (number - 1) * POSTS_PER_PAGE
+        rows = list(rows[offset:offset + POSTS_PER_PAGE])
+        if not rows and number > 1:
+            return None, None
+    parts = [tuple(row[field] for field in PAGE_STATE_FIELDS)
+             for row in rows]
+    last_modified = max((row['updated'] for row in rows), default=None)
+    return parts, last_modified
+
+
+def latest(*dates):
+    return max((date for date in dates if date is not None), default=None)
+
+
+def index_state(request):
+    # index.html держит ленту в кэше фрагментов INDEX_CACHE_SECONDS,
+    # поэтому и валидатор главной меняется не реже, чем раз в это время:
+    # иначе клиент мог бы навсегда сохранить устаревшую копию.
+    parts, modified = page_state(request, Post.objects.all())
+    if parts is None:
+        return None, None
+    window = int(time.time() // INDEX_CACHE_SECONDS)
+    started = datetime.fromtimestamp(window * INDEX_CACHE_SECONDS,
+                                     tz=timezone.utc)
+    return parts + [window], latest(modified, started)
+
+
+def group_state(request, slug):
+    group = Group.objects.filter(slug=slug).values_list(
+        'id', 'title', 'description'
+    ).first()
+    if group is None:
+        return None, None
+    posts = Post.objects.filter(group_id=group[0])
+    parts, modified = page_state(request, posts)
+    if parts is None:
+        return None, None
+    return [group] + parts, modified
+
+
+def profile_state(request, username):
+    author = User.objects.filter(username=username).values(
+        'id', *AUTHOR_STATE_FIELDS
+    ).first()
+    if author is None:
+        return None, None
+    posts = Post.objects.filter(author_id=author['id'])
+    parts, modified = page_state(request, posts)
+    if parts is None:
+        return None, None
+    return (list(author.values()) + parts,
+            latest(author['counters__updated'], modified))
+
+
+def post_state(request, username, post_id):
+    post = Post.objects.filter(id=post_id, author__username=username).values(
+        'id', 'card_version', 'comment_count', 'updated',
+        *(f'author__{field}' for field in AUTHOR_STATE_FIELDS)
+    ).first()
+    if post is None:
+        return None, None
+    return list(post.values()), latest(post['updated'],
+                                       post['author__counters__updated'])
+
+
+@serve_stale_on_error
+@read_replica
+@cache_anonymous_page()
+@feed_condition(index_state)
 def index(request):
-    post_list = Post.objects.select_related('group').all()
-    paginator = Paginator(post_list, POSTS_PER_PAGE)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = Post.objects.for_feed()
+    page, paginator = get_page(request, post_list)
     return render(request, 'index.html', {'page': page,
                                           'paginator': paginator})
 
 
+@require_existing('group', 'slug')
+@serve_stale_on_error
+@read_replica
+@cache_anonymous_page()
+@feed_condition(group_state)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
-    paginator = Paginator(posts, POSTS_PER_PAGE)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    posts = group.posts.for_feed()
+    page, paginator = get_page(request, posts)
     return render(request, 'group.html', {'group': group,
                                           'page': page,
                                           'paginator': paginator})
 
 
+def search(request):
+    """Полнотекстовый поиск по постам и комментариям к ним."""
+    query = request.GET.get('q', '').strip()[:SEARCH_QUERY_LENGTH]
+    page = paginator = None
+    if query:
+        paginator = Paginator(post_search.search(query), POSTS_PER_PAGE)
+        page = paginator.get_page(request.GET.get('page'))
+    return render(request, 'search.html', {
+        'query': query,
+        'page': page,
+        'paginator': paginator,
+        'pagination_query': urlencode({'q': query}) + '&',
+    })
+
+
 @login_required
+@pin_primary
+@bounded_image_upload
+@transaction.atomic
 def new_post(request):
-    form = PostForm(request.POST or None)
+    form = PostForm(request.POST or None, files=request.FILES or None)
+    add_upload_errors(request, form)
 
     if request.method == 'POST':
         if form.is_valid():
@@ -52,12 +207,15 @@ def new_post(request):
                                              'edit_mode': False})
 
 
+@require_existing('username', 'username')
+@serve_stale_on_error
+@read_replica
+@cache_anonymous_page('user:{username}')
+@feed_condition(profile_state)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    posts = author.posts.all()
-    paginator = Paginator(posts, POSTS_PER_PAGE)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    author = get_object_or_404(User.objects.select_related('counters'),
+                               username=username)
+    page, paginator = get_page(request, author.posts.for_feed())
     has_follow = check_following(request.user, author)
     return render(request, 'profile.html', {'profile': author,
                                             'page': page,
@@ -65,19 +223,52 @@ def profile(request, username):
                                             'following': has_follow})
 
 
+def get_comments_page(request, post):
+    """Первая или следующая по курсору страница комментариев поста.
+
+    Комментарии листаются по (created, id) вместе с авторами одним
+    запросом, поэтому страница не зависит от числа комментариев.
+    """
+    comments = post.comments.select_related('author')
+    paginator = CursorPaginator(comments, COMMENTS_PER_PAGE,
+                                ordering=COMMENT_ORDERING)
+    return comments, paginator.get_page(request.GET.get('cursor'))
+
+
+@require_existing('username', 'username')
+@serve_stale_on_error
+@read_replica
+@cache_anonymous_page('user:{username}')
+@feed_condition(post_state)
 def post_view(request, username, post_id):
-    post = get_object_or_404(Post, id=post_id, author__username=username)
-    comments = post.comments.all()
-    form = CommentForm()
+    post = get_object_or_404(
+        Post.objects.for_feed().select_related('author__counters'),
+        id=post_id,
+        author__username=username
+    )
+    comments, comments_page = get_comments_page(request, post)
     has_follow = check_following(request.user, post.author)
+    form = CommentForm()
     return render(request, 'post.html', {'profile': post.author,
                                          'post': post,
                                          'comments': comments,
+                                         'comments_page': comments_page,
                                          'form': form,
                                          'following': has_follow})
 
 
+def post_comments(request, username, post_id):
+    """Следующая порция комментариев HTML-фрагментом для подгрузки."""
+    post = get_object_or_404(Post.objects.select_related('author'),
+                             id=post_id, author__username=username)
+    _, comments_page = get_comments_page(request, post)
+    return render(request, 'includes/comment_list.html',
+                  {'post': post, 'comments_page': comments_page})
+
+
 @login_required
+@pin_primary
+@transaction.atomic
 def add_comment(request, username, post_id):
     post = get_object_or_404(Post, id=post_id)
     form = CommentForm(request.POST or None)
@@ -90,12 +281,16 @@ def add_comment(request, username, post_id):
 
 
 @login_required
+@pin_primary
+@bounded_image_upload
+@transaction.atomic
 def post_edit(request, username, post_id):
     post = get_object_or_404(Post, id=post_id, author__username=username)
     if request.user != post.author:
         return redirect('post', username=username, post_id=post_id)
     form = PostForm(request.POST or None, files=request.FILES or None,
                     instance=post)
+    add_upload_errors(request, form)
     if form.is_valid():
         form.save()
         return redirect('post', username=username, post_id=post_id)
@@ -105,20 +300,18 @@ def post_edit(request, username, post_id):
                                              'post': post})
 
 
+@read_replica
 @login_required
 def follow_index(request):
-    posts = Post.objects.select_related(
-        'group',
-        'author'
-    ).filter(author__following__user=request.user)
-    paginator = Paginator(posts, POSTS_PER_PAGE)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    posts = timeline.follow_feed(request.user)
+    page, paginator = get_page(request, posts)
     return render(request, 'follow.html', {'page': page,
                                            'paginator': paginator})
 
 
 @login_required
+@pin_primary
+@transaction.atomic
 def profile_follow(request, username):
     profile = get_object_or_404(User, username=username)
     if request.user != profile:
@@ -127,12 +320,43 @@ def profile_follow(request, username):
 
 
 @login_required
+@pin_primary
+@transaction.atomic
 def profile_unfollow(request, username):
     profile = get_object_or_404(User, username=username)
     Follow.objects.filter(user=request.user, author=profile).delete()
     return redirect('profile', username=username)
 
 
+@login_required
+@require_POST
+@pin_primary
+def follow_batch(request):
+    """Подписка на нескольких авторов или отписка от них одним запросом.
+
+    Принимает action (follow или unfollow) и author - имена авторов,
+    до FOLLOW_BATCH_LIMIT штук. Отвечает JSON с числом изменённых
+    подписок и именами, которых не нашлось.
+    """
+    action = request.POST.get('action', 'follow')
+    if action not in ('follow', 'unfollow'):
+        return JsonResponse({'error': 'Неизвестное действие.'}, status=400)
+    names = request.POST.getlist('author')
+    if len(names) > FOLLOW_BATCH_LIMIT:
+        return JsonResponse(
+            {'error': f'Не больше {FOLLOW_BATCH_LIMIT} авторов за раз.'},
+            status=400
+        )
+    authors = resolve_usernames(names)
+    pairs = [(request.user.pk, author_id) for author_id in authors.values()]
+    change = follow_many if action == 'follow' else unfollow_many
+    return JsonResponse({
+        'action': action,
+        'changed': change(pairs),
+        'missing': sorted(set(names) - set(authors)),
+    })
+
+
 def page_not_found(request, exception):
     return render(
         request,
@@ -13,6 +13,7 @@ handler500 = "posts.views.server_error" # noqa
 
 urlpatterns = [
     path('administrator/', admin.site.urls),
+    path('api/v1/', include('posts.api_urls')),
     path('', include('posts.urls')),
     path('auth/', include('users.urls')),
     path('auth/', include('django.contrib.auth.urls')),